@@ -0,0 +1,62 @@
+import hmac
+from typing import Literal
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.schemas.responses import ProfilingSettings
+from app.services.profiling import profiler
+from app.services.slice_scheduler import slice_scheduler
+from app.constants import settings
+
+async def require_admin(x_admin_token: str = Header(None, description="Value of the ADMIN_TOKEN setting")):
+    """Only let requests carrying the admin token through, hide the endpoints when none is configured"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/admin/profiling/")
+async def profiling_status():
+    """Profiler settings and the profiles currently kept, newest first"""
+    return {
+        **profiler.stats(),
+        'profiles': [
+            {key: profile[key] for key in ('id', 'request_id', 'method', 'path', 'status_code', 'reason', 'started_at', 'duration_ms')}
+            for profile in reversed(profiler.profiles)
+        ],
+    }
+
+@router.put("/admin/profiling/")
+async def configure_profiling(profiling_settings: ProfilingSettings):
+    """Switch the profiler on or off and change its threshold without a redeploy"""
+    profiler.configure(**profiling_settings.model_dump())
+    return profiler.stats()
+
+@router.get("/admin/profiling/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: Literal["json", "collapsed"] = Query("json", description="collapsed returns the stacks in the format flamegraph.pl and speedscope read"),
+):
+    """A kept profile, its stack samples and the slicer processes the request ran"""
+    profile = next((profile for profile in profiler.profiles if profile['id'] == profile_id), None)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found, it may have been rotated out")
+    if format == "collapsed":
+        return PlainTextResponse('\n'.join(f"{stack} {count}" for stack, count in profile['stacks'].items()) + '\n')
+    return profile
+
+@router.get("/admin/slicer-usage/")
+async def slicer_usage(
+    by: Literal["user", "profile"] = Query("user", description="Aggregate per user_id or per printer profile, keyed user_id/profile_name"),
+    sort: Literal["cpu_seconds", "wall_seconds", "max_peak_rss_mb", "mean_cpu_seconds", "jobs", "output_bytes"] = Query("cpu_seconds"),
+    limit: int = Query(20, ge=1, le=1000),
+    recent: int = Query(0, ge=0, le=200, description="Also return this many of the latest job records"),
+):
+    """Slicer CPU, wall time, peak memory and output size per user or profile, most expensive first"""
+    accounting = slice_scheduler.accounting
+    return {
+        'totals': accounting.summary(),
+        by + 's': accounting.top(by, sort=sort, limit=limit),
+        'recent_jobs': list(accounting.recent)[-recent:] if recent else [],
+    }
@@ -1,10 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.schemas.responses import TokenResponse
-import jwt
 from datetime import datetime, timedelta
 from app.constants import settings
-from app.db.supabase_auth import get_supabase_client
+from app.services.token_verifier import token_verifier
 
 router = APIRouter()
 security = HTTPBearer()
@@ -23,25 +22,19 @@ async def generate_token(
         # Extract token from authorization header
         supabase_token = credentials.credentials
         
-        # Initialize Supabase client
-        supabase = get_supabase_client()
-        
-        # Verify the token with Supabase
-        user = supabase.auth.get_user(supabase_token)
-        
-        if not user or not user.user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-            )
+        # Verify the token locally with the project's JWT secret or JWKS
+        claims = await token_verifier.verify(supabase_token)
         
         # Create payload for JWT token
         payload = {
-            "user_id": user.user.id,
-            "email": user.user.email,
+            "user_id": claims["sub"],
+            "email": claims.get("email"),
             "exp": datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         }
         
+        # Imported on first use, PyJWT pulls in cryptography
+        import jwt
+
         # Generate JWT token
         token = jwt.encode(
             payload, 
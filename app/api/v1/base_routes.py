@@ -1,4 +1,7 @@
-from fastapi import APIRouter, UploadFile, File, Query
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, Query, Request, HTTPException
+from pydantic import TypeAdapter, ValidationError
 from app.utils.utilities import (
     check_printability, 
     cleanup_files,
@@ -7,7 +10,11 @@ from app.utils.utilities import (
 from app.schemas.responses import (
     ProfileConfigRepsonse,
     InstantQuoteResponse,
+    ArchiveQuoteResponse,
     PrintabilityResponse,
+    FitMatrixResponse,
+    PrinterFit,
+    PrinterVolume,
     ProfileConfig,
 )
 from app.services.base_routes_helpers import (
@@ -15,21 +22,31 @@ from app.services.base_routes_helpers import (
     local_quote_model, 
     local_upload_stl, 
     create_quote_config,
+    create_printer_config,
     get_printer_config,
-    get_quote_config
+    get_quote_config,
+    printer_fit_matrix,
+    quote_local_stl,
 )
 from app.db.supabase_handler import upload_file
 from app.services.pro_routes_helpers import create_ini_config
-from app.constants import BUCKET_FILES
+from app.services.slice_progress import progress_broker
+from app.services.archive_quotes import quote_archive
+from app.services.tracing import span
+from app.constants import BUCKET_FILES, settings
 
 router = APIRouter()
 
+# Upper bound on the printers checked by one fit matrix request
+MAX_FIT_PRINTERS = 500
+
 @router.post("/printability/")
 async def check_model_printability(
     user_id: str = Query(..., description="User ID for the print job"),
     x_dimension: float = Query(210.0, description="Printer X dimension in mm"),
     y_dimension: float = Query(210.0, description="Printer Y dimension in mm"),
     z_dimension: float = Query(250.0, description="Printer Z dimension in mm"),
+    overhang_threshold: float = Query(45.0, description="Overhang slope in degrees from horizontal below which supports are needed", ge=0, le=90),
     file: UploadFile = File(..., description="STL file to check printability"),
 ):
     """Check if an STL model fits on the print bed.  Dimensions are in millimeters (mm)"""
@@ -40,18 +57,67 @@ async def check_model_printability(
     )
     
     file_path = f"{upload_response.stl_file_path}/{upload_response.file_name}"
-    printability_result = check_printability(
+    # Loading the mesh with NumPy takes long enough on large models to stall other requests
+    printability_result = await asyncio.to_thread(
+        check_printability,
         stl_file_path=file_path,
         printer_dimensions=(x_dimension, y_dimension, z_dimension),
+        overhang_threshold=overhang_threshold,
     )
 
-    cleanup_files(user_id)
+    await asyncio.to_thread(cleanup_files, user_id)
     
     return PrintabilityResponse(
         user_id=user_id,
         fits_printer=bool(printability_result["printable"]),
         model_dimensions=printability_result["model_dimensions"],
-        printer_dimensions=printability_result["printer_dimensions"]
+        printer_dimensions=printability_result["printer_dimensions"],
+        overhang_area=printability_result["overhang"]["overhang_area"],
+        overhang_fraction=printability_result["overhang"]["overhang_fraction"],
+        needs_support=printability_result["overhang"]["needs_support"],
+    )
+
+@router.post("/printability/matrix/", response_model=FitMatrixResponse)
+async def check_model_fit_matrix(
+    user_id: str = Query(..., description="User ID for the print job"),
+    overhang_threshold: float = Query(45.0, description="Overhang slope in degrees from horizontal below which supports are needed", ge=0, le=90),
+    printers: str = Form(..., description='JSON list of build volumes, e.g. [{"name": "MK4", "bed_size_x": 250, "bed_size_y": 210, "bed_size_z": 220}]'),
+    file: UploadFile = File(..., description="STL file to check printability"),
+):
+    """
+    Check which printers can print an STL model, as is or rotated.
+
+    The mesh is parsed once and every candidate orientation is checked against
+    all build volumes at once. Dimensions are in millimeters (mm)
+    """
+    try:
+        volumes = TypeAdapter(list[PrinterVolume]).validate_json(printers)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    if not volumes or len(volumes) > MAX_FIT_PRINTERS:
+        raise HTTPException(status_code=422, detail=f"Between 1 and {MAX_FIT_PRINTERS} printers are required")
+
+    result = await printer_fit_matrix(
+        file=file,
+        printers=volumes,
+        overhang_threshold=overhang_threshold,
+    )
+
+    rows = []
+    for printer, fits_as_is, fits, orientation in zip(volumes, result['fits_as_is'], result['fits'], result['orientations']):
+        row = PrinterFit(name=printer.name, fits_as_is=bool(fits_as_is), fits=bool(fits))
+        if orientation is not None:
+            row.reoriented = not orientation['is_original']
+            row.rotation = orientation['rotation'].round(6).tolist()
+            row.model_dimensions = orientation['dimensions']
+            row.overhang_fraction = orientation['overhang_fraction']
+        rows.append(row)
+
+    return FitMatrixResponse(
+        user_id=user_id,
+        model_dimensions=result['model_dimensions'],
+        candidates_evaluated=result['candidates_evaluated'],
+        printers=rows,
     )
 
 @router.post("/quote-profile/", response_model=ProfileConfigRepsonse)
@@ -79,32 +145,28 @@ async def create_quote_profile(
         quote_config=quote_config
     )
 
-    printer_config_file = await convert_path_to_upload_file(
-        file_path=printer_config_response['output_dir'],
-    )
-
-    quote_config_file = await convert_path_to_upload_file(
-        file_path=quote_config_response['output_dir'],
-    )
-
-    # Uload the .ini and quote json files to the storage bucket under the user_id/profiles/profile_name directory
-    await upload_file(
-        user_id=user_id,
-        folder_name=f"profiles/{profile_name}",
-        bucket_name=BUCKET_FILES,
-        file=printer_config_file,
-        overwrite=True
-    )
-    await upload_file(
+    # The .ini can't hold every printer setting, keep the whole config for loading the profile
+    printer_config_json_response = create_printer_config(
         user_id=user_id,
-        folder_name=f"profiles/{profile_name}",
-        bucket_name=BUCKET_FILES,
-        file=quote_config_file,
-        overwrite=True
+        printer_config_file=f"{user_id}/profiles/{profile_name}",
+        printer_config=printer_config,
     )
 
+    # Uload the .ini and json files to the storage bucket under the user_id/profiles/profile_name directory
+    for response in (printer_config_response, quote_config_response, printer_config_json_response):
+        profile_file = await convert_path_to_upload_file(
+            file_path=response['output_dir'],
+        )
+        await upload_file(
+            user_id=user_id,
+            folder_name=f"profiles/{profile_name}",
+            bucket_name=BUCKET_FILES,
+            file=profile_file,
+            overwrite=True
+        )
+
     # Cleanup local files after upload
-    cleanup_files(user_id)
+    await asyncio.to_thread(cleanup_files, user_id)
 
     return ProfileConfigRepsonse(
         user_id=user_id,
@@ -116,46 +178,81 @@ async def create_quote_profile(
 
 @router.post("/instant-quote/", response_model=InstantQuoteResponse)
 async def instant_quote(
+    request: Request,
     user_id: str = Query(..., description="User ID for the print job"),
     profile_name: str = Query(..., description="Name of the printer config profile"),
+    job_id: Optional[str] = Query(None, description="Client generated ID to follow progress on /jobs/{job_id}/events or /jobs/{job_id}/ws with the same user_id"),
+    auto_orient: bool = Query(True, description="Rotate the model to the orientation that fits the bed with the least height and overhang"),
     file: UploadFile = File(..., description="STL file for the instant quote")
 ):
     """Get instant quote details for a sliced model"""
-    # Retrieve the printer and quote configurations
-    printer_config = get_printer_config(
-        user_id=user_id, 
-        profile_name=profile_name
-    )
-    quote_config = get_quote_config(
-        user_id=user_id, 
-        profile_name=profile_name
-    )
+    async with progress_broker.track(job_id, user_id) as complete:
+        # Retrieve the printer and quote configurations, the storage client is synchronous
+        printer_config, quote_config = await asyncio.gather(
+            asyncio.to_thread(get_printer_config, user_id=user_id, profile_name=profile_name),
+            asyncio.to_thread(get_quote_config, user_id=user_id, profile_name=profile_name),
+        )
 
-    upload_response = await local_upload_stl(
-        user_id=user_id,
-        file=file
-    )
-    
-    slice_model_response = await local_slice_model(
-        user_id=user_id,
-        cleanup=False,
-        stl_file_path=upload_response.stl_file_path + '/' + upload_response.file_name,
-        printer_config=printer_config
+        with span('upload.local', file_name=file.filename):
+            upload_response = await local_upload_stl(
+                user_id=user_id,
+                file=file
+            )
+        
+        stl_file_path = upload_response.stl_file_path + '/' + upload_response.file_name
+
+        response = await quote_local_stl(
+            user_id=user_id,
+            stl_file_path=stl_file_path,
+            printer_config=printer_config,
+            quote_config=quote_config,
+            auto_orient=auto_orient,
+            request=request,
+            deadline=settings.INSTANT_QUOTE_DEADLINE_SECONDS,
+            job_id=job_id,
+            profile_name=profile_name,
+        )
+        complete(response.model_dump())
+
+    return response
+
+@router.post("/instant-quote/archive/", response_model=ArchiveQuoteResponse)
+async def instant_quote_archive(
+    request: Request,
+    user_id: str = Query(..., description="User ID for the print job"),
+    profile_name: str = Query(..., description="Name of the printer config profile"),
+    auto_orient: bool = Query(True, description="Rotate each model to the orientation that fits the bed with the least height and overhang"),
+    file: UploadFile = File(..., description="ZIP archive of STL files")
+):
+    """Get instant quotes for every STL in a ZIP archive, plus the total"""
+    if not file.filename.lower().endswith('.zip'):
+        raise HTTPException(status_code=400, detail="File must be a ZIP archive")
+
+    printer_config, quote_config = await asyncio.gather(
+        asyncio.to_thread(get_printer_config, user_id=user_id, profile_name=profile_name),
+        asyncio.to_thread(get_quote_config, user_id=user_id, profile_name=profile_name),
     )
-    
-    quote_model_response = await local_quote_model(
+
+    entries = await quote_archive(
         user_id=user_id,
-        gcode_path=slice_model_response.gcode_path,
+        file=file,
+        printer_config=printer_config,
         quote_config=quote_config,
+        auto_orient=auto_orient,
+        request=request,
+        profile_name=profile_name,
     )
 
-    return InstantQuoteResponse(
-        user_id = user_id,
-        total_price=quote_model_response.total_price,
-        currency=quote_model_response.currency,
-        estimated_time=quote_model_response.estimated_time,
-        estimated_time_seconds=quote_model_response.estimated_time_seconds,
-        filament_weight=quote_model_response.filament_weight,
-        filament_cost=quote_model_response.filament_cost,
-        status="quoted"
-    )
\ No newline at end of file
+    quoted = [entry for entry in entries if entry.status == "quoted"]
+    failed = sum(entry.status == "failed" for entry in entries)
+    return ArchiveQuoteResponse(
+        user_id=user_id,
+        entries=entries,
+        quoted=len(quoted),
+        failed=failed,
+        total_price=round(sum(entry.total_price for entry in quoted), 2),
+        currency=quote_config.currency,
+        total_estimated_time_seconds=sum(entry.estimated_time_seconds for entry in quoted),
+        total_filament_weight=round(sum(entry.filament_weight for entry in quoted), 2),
+        status="quoted" if not failed else "partial" if quoted else "failed",
+    )
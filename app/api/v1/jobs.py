@@ -0,0 +1,47 @@
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from app.services.slice_progress import progress_broker, format_sse
+
+router = APIRouter()
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(
+    job_id: str,
+    user_id: str = Query(..., description="User ID the job was started for"),
+):
+    """Stream slicing progress for a job as Server-Sent Events"""
+    # Checked before the stream starts so other users get a 404 rather than an empty stream
+    if not progress_broker.authorize(job_id, user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for event in progress_broker.subscribe(job_id, user_id):
+            yield format_sse(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/jobs/{job_id}/ws")
+async def job_websocket(
+    websocket: WebSocket,
+    job_id: str,
+    user_id: str = Query(..., description="User ID the job was started for"),
+):
+    """Stream slicing progress for a job over a WebSocket"""
+    if not progress_broker.authorize(job_id, user_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    try:
+        async for event in progress_broker.subscribe(job_id, user_id):
+            if event is None:
+                await websocket.send_json({"event": "keepalive", "job_id": job_id})
+            else:
+                await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,98 @@
+import asyncio
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.services.slice_scheduler import slice_scheduler
+from app.services.quote_cache import quote_cache
+from app.services.toolpath_store import toolpath_store
+from app.services.blob_cache import blob_cache
+from app.services.warmup import warmup_state
+from app.services.token_verifier import token_verifier
+from app.services.idempotency import idempotency_store
+from app.services.tracing import tracer
+from app.services.loop_monitor import loop_monitor
+from app.services.worker_queue import worker_queue
+from app.api.v1.admin import require_admin
+
+router = APIRouter()
+
+@router.get("/monitoring/slicer/")
+async def slicer_stats():
+    """Current slicer queue depth, running jobs and load shedding counters"""
+    return slice_scheduler.stats()
+
+@router.get("/monitoring/workers/")
+async def worker_queue_stats():
+    """Jobs waiting for and running on slicer workers, when slicing is offloaded to them"""
+    if worker_queue is None:
+        return {'backend': None}
+    return await asyncio.to_thread(worker_queue.stats)
+
+# Stall stacks and routes show the code's internals
+@router.get("/monitoring/event-loop/", dependencies=[Depends(require_admin)])
+async def event_loop_stats(
+    format: Literal["json", "prometheus"] = Query("json", description="prometheus returns the lag and per route stall histograms in the Prometheus text format"),
+):
+    """Event loop lag histogram and the stalls per route, with the stacks that blocked the loop"""
+    if format == "prometheus":
+        return PlainTextResponse(loop_monitor.prometheus(), media_type="text/plain; version=0.0.4")
+    return loop_monitor.stats()
+
+@router.get("/monitoring/quote-cache/")
+async def quote_cache_stats():
+    """Geometry fingerprint cache size and hit rate for instant quotes"""
+    return quote_cache.stats()
+
+@router.get("/monitoring/toolpath-store/")
+async def toolpath_store_stats():
+    """Stored G-code reused for toolpath invariant config changes"""
+    return toolpath_store.stats()
+
+@router.get("/monitoring/blob-cache/")
+async def blob_cache_stats():
+    """Storage downloads served from the node local cache and the bytes they saved"""
+    return blob_cache.stats()
+
+@router.get("/monitoring/warmup/")
+async def warmup_stats():
+    """Background warm-up progress and time spent per step"""
+    return warmup_state
+
+@router.get("/monitoring/token-verifier/")
+async def token_verifier_stats():
+    """Local Supabase token verification cache and JWKS refreshes"""
+    return token_verifier.stats()
+
+@router.get("/monitoring/idempotency/")
+async def idempotency_stats():
+    """Stored, replayed and coalesced Idempotency-Key requests"""
+    return await asyncio.to_thread(idempotency_store.stats)
+
+# Timelines carry user IDs, file names and paths
+@router.get("/monitoring/traces/", dependencies=[Depends(require_admin)])
+async def recent_traces(
+    limit: int = Query(20, ge=1, le=200, description="Number of traces returned"),
+    min_duration_ms: float = Query(0, ge=0, description="Only traces of requests at least this slow"),
+):
+    """Recent request traces, slowest first"""
+    timelines = [tracer.timeline(trace) for trace in list(tracer.recent.values())]
+    slow = sorted(
+        (timeline for timeline in timelines if timeline['duration_ms'] >= min_duration_ms),
+        key=lambda timeline: timeline['duration_ms'],
+        reverse=True,
+    )[:limit]
+    return [
+        {key: timeline[key] for key in ('trace_id', 'request_id', 'name', 'duration_ms')} | {'spans': len(timeline['spans'])}
+        for timeline in slow
+    ]
+
+@router.get("/monitoring/traces/{trace_id}", dependencies=[Depends(require_admin)])
+async def trace_timeline(trace_id: str):
+    """Timeline of one request, every span with its offset and duration in milliseconds"""
+    trace = tracer.recent.get(trace_id)
+    if trace is None:
+        # Looked up by the request ID a client got back in X-Request-ID
+        trace = next((trace for trace in list(tracer.recent.values()) if trace.request_id == trace_id), None)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found, it may have been evicted")
+    return tracer.timeline(trace)
@@ -1,16 +1,30 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Query, Request
 from fastapi.responses import FileResponse
 
+import json
 import shutil
+import logging
+import asyncio
+import hashlib
 from pathlib import Path
+from typing import Literal, Optional
 
 from app.utils.utilities import convert_path_to_upload_file, cleanup_files, cleanup_after_download
 from app.schemas.responses import STLResponse ,SliceResponse, QuoteResponse, PrinterConfig, QuoteConfig
-from app.constants import LOCAL_DIR, BUCKET_FILES
+from app.constants import LOCAL_DIR, BUCKET_FILES, settings
 from app.services.prusa_slicer import PrusaSlicer
-from app.services.pro_routes_helpers import create_ini_config
+from app.services.pro_routes_helpers import create_ini_config, toolpath_signature, temperature_settings, stored_print_details
+from app.services.toolpath_store import toolpath_store
+from app.utils.gcode_patch import patch_temperatures
+from app.utils.gcode_metadata import SIDECAR_SUFFIX, build_sidecar
+from app.services.base_routes_helpers import get_printer_config
+from app.services.slice_scheduler import slice_scheduler
+from app.services.slice_progress import progress_broker
+from app.services.tracing import span
 from app.db.supabase_handler import upload_file, download_file
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 @router.post(
@@ -47,73 +61,139 @@ async def upload_stl(
     description="Slice the uploaded STL file and generate the G-code"
     )
 async def slice_model(
+    request: Request,
     user_id: str = Query(..., description="User ID for the print job"),
     file_path: str = Query(..., description="Path to the STL file (this can be found in the upload response)"),
+    job_id: Optional[str] = Query(None, description="Client generated ID to follow progress on /jobs/{job_id}/events or /jobs/{job_id}/ws with the same user_id"),
     printer_config : PrinterConfig = PrinterConfig(),
 ):
-    # Generate output file path
-    file_path_parts = file_path.split('/')
-    output_name = file_path_parts[-1].rsplit('.', 1)[0] + '.gcode'
-    output_path = file_path.rsplit('.', 1)[0] + '.gcode'
+    async with progress_broker.track(job_id, user_id) as complete:
+        # Generate output file path
+        file_path_parts = file_path.split('/')
+        output_name = file_path_parts[-1].rsplit('.', 1)[0] + '.gcode'
+        output_path = file_path.rsplit('.', 1)[0] + '.gcode'
 
-    # Get file from supabase and write to local
-    download_file_response = download_file(
-        bucket_name=BUCKET_FILES,
-        file_path=file_path
-    )
+        # Get file from supabase and write to local
+        download_file_response = await asyncio.to_thread(
+            download_file,
+            bucket_name=BUCKET_FILES,
+            file_path=file_path
+        )
     
-    job_output_dir = LOCAL_DIR / user_id
-    job_output_dir.mkdir(parents=True, exist_ok=True)
+        job_output_dir = LOCAL_DIR / user_id
+        job_output_dir.mkdir(parents=True, exist_ok=True)
 
-    with open(job_output_dir / file_path_parts[-1], 'wb') as f:
-        f.write(download_file_response['data'])
+        # Large models take a while to write and hash, keep both off the event loop
+        await asyncio.to_thread((job_output_dir / file_path_parts[-1]).write_bytes, download_file_response['data'])
+        model_digest = (await asyncio.to_thread(hashlib.sha256, download_file_response['data'])).hexdigest()
 
-    response = create_ini_config(
-        user_id=user_id,
-        stl_file_path=file_path,
-        printer_config=printer_config
-    )
+        # Auto support parses the mesh
+        with span('config.create_ini'):
+            response = await asyncio.to_thread(
+                create_ini_config,
+                user_id=user_id,
+                stl_file_path=file_path,
+                printer_config=printer_config,
+                model_path=job_output_dir / file_path_parts[-1],
+            )
 
-    slicer = PrusaSlicer(
-        stl_file_path=job_output_dir / file_path_parts[-1],
-        config_path=response['output_dir'],
-    )
+        # Same model and toolpath settings sliced before: patch that G-code instead
+        with span('toolpath.reuse') as reuse_span:
+            toolpath_key = hashlib.sha256(
+                f"{user_id}|{model_digest}|{toolpath_signature(printer_config)}".encode()
+            ).hexdigest()
+            temperatures = temperature_settings(printer_config)
+            stored = toolpath_store.get(toolpath_key)
+            patched = None
+            if stored is not None:
+                try:
+                    patched = await asyncio.to_thread(
+                        patch_temperatures,
+                        source=stored['path'],
+                        destination=job_output_dir / output_name,
+                        old=stored['temperatures'],
+                        new=temperatures,
+                    )
+                except OSError as e:
+                    # Evicted by a concurrent store since the lookup, slice instead
+                    logger.warning(f"Could not patch stored G-code: {e}")
+            if reuse_span is not None:
+                reuse_span.set(stored=stored is not None, patched=patched is not None)
 
-    # Run slicing operation
-    success = slicer.slice(
-        output_gcode_path=job_output_dir / output_name
-    )
-    
-    file = await convert_path_to_upload_file(
-        file_path=job_output_dir / output_name
-    )
-    
-    if not success:
-        raise HTTPException(status_code=500, detail="Slicing failed")
+        if patched is None:
+            from app.utils.mesh_analysis import stl_statistics
 
-    trimmed_folder_path = '/'.join(output_path.split('/')[1:][:-1])
+            slicer = PrusaSlicer(
+                stl_file_path=job_output_dir / file_path_parts[-1],
+                config_path=response['output_dir'],
+            )
 
-    # Upload the sliced G-code file to Supabase
-    upload_response = await upload_file(
-        user_id=user_id,
-        overwrite=True,
-        folder_name=trimmed_folder_path,
-        bucket_name=BUCKET_FILES,
-        file=file
-    )
+            model = await asyncio.to_thread(stl_statistics, job_output_dir / file_path_parts[-1])
+
+            # Run slicing operation once admission control hands us a slot and enough memory,
+            # full slices rank behind interactive quotes of the same predicted length
+            success = await slice_scheduler.run(
+                user_id,
+                slicer.slice,
+                deadline=printer_config.slice_timeout or settings.SLICE_DEADLINE_SECONDS,
+                request=request,
+                job_id=job_id,
+                triangles=model['triangles'],
+                dimensions=model['dimensions'],
+                layer_height=printer_config.layer_height,
+                support_material=response['support_material'],
+                output_gcode_path=job_output_dir / output_name
+            )
+
+            if not success:
+                raise HTTPException(status_code=500, detail="Slicing failed")
+
+            with span('toolpath.store'):
+                await asyncio.to_thread(toolpath_store.put, toolpath_key, job_output_dir / output_name, temperatures)
+
+        # Quotes read the estimates from this sidecar instead of downloading the G-code
+        with span('gcode.sidecar'):
+            sidecar = await asyncio.to_thread(
+                build_sidecar,
+                job_output_dir / output_name,
+                config_path=response['output_dir'],
+            )
+            sidecar_file = job_output_dir / (output_name + SIDECAR_SUFFIX)
+            sidecar_file.write_text(json.dumps(sidecar))
+
+        trimmed_folder_path = '/'.join(output_path.split('/')[1:][:-1])
+
+        # Upload the sliced G-code file and its sidecar to Supabase
+        for local_path in (job_output_dir / output_name, sidecar_file):
+            file = await convert_path_to_upload_file(
+                file_path=local_path
+            )
+
+            upload_response = await upload_file(
+                user_id=user_id,
+                overwrite=True,
+                folder_name=trimmed_folder_path,
+                bucket_name=BUCKET_FILES,
+                file=file
+            )
     
-    if upload_response['status'] != 'successful':
-        raise HTTPException(status_code=500, detail="Failed to upload G-code file")
+            if upload_response['status'] != 'successful':
+                raise HTTPException(status_code=500, detail="Failed to upload G-code file")
     
-    #Remove local stl and gcode file after upload for cleanup
-    cleanup_files(user_id=user_id)
+        #Remove local stl and gcode file after upload for cleanup
+        await asyncio.to_thread(cleanup_files, user_id=user_id)
             
-    return SliceResponse(
-        status="success",
-        user_id=user_id,
-        file_name=output_name,
-        gcode_path=output_path
-    )
+        slice_response = SliceResponse(
+            status="success",
+            user_id=user_id,
+            file_name=output_name,
+            gcode_path=output_path,
+            support_material=response['support_material'],
+            reused_toolpath=patched is not None,
+        )
+        complete(slice_response.model_dump())
+
+    return slice_response
 
 @router.post(
     "/gcode/quote/", 
@@ -123,11 +203,31 @@ async def slice_model(
 async def quote_model(
     user_id: str = Query(..., description="User ID for the print job"),
     gcode_path: str = Query(..., description="Path to the G-code file (this can be found in the slice response)"),
+    profile_name: Optional[str] = Query(None, description="Printer profile whose acceleration and jerk are used when the G-code has no time estimate"),
+    detail: Optional[Literal["summary", "features", "layers"]] = Query(None, description="Include a toolpath analysis: totals only, per-feature, or per-feature and per-layer breakdowns"),
     quote_config: QuoteConfig = QuoteConfig(),
 ):  
 
+    slicer = PrusaSlicer(
+        base_price=quote_config.base_price,
+        cost_per_hour=quote_config.cost_per_hour,
+        cost_per_gram=quote_config.cost_per_gram,
+        currency=quote_config.currency,
+    )
+
+    # Sidecar or head and tail of the stored G-code, enough unless it has no estimate
+    # or a toolpath analysis was asked for
+    if detail is None:
+        with span('quote.stored_details') as stored_span:
+            stored = await asyncio.to_thread(stored_print_details, gcode_path)
+            if stored_span is not None:
+                stored_span.set(source=stored['source'])
+        if stored['estimated_time'] is not None and stored['filament_weight'] is not None:
+            return QuoteResponse(user_id=user_id, gcode_path=gcode_path, **slicer.quote(stored), time_source='slicer', status="quoted")
+
     # Download the G-code file from Supabase
-    download_response = download_file(
+    download_response = await asyncio.to_thread(
+        download_file,
         bucket_name=BUCKET_FILES,
         file_path=gcode_path
     )
@@ -136,23 +236,37 @@ async def quote_model(
     job_output_dir = LOCAL_DIR / user_id
     job_output_dir.mkdir(parents=True, exist_ok=True)
     
-    with open(job_output_dir / gcode_path.split('/')[-1], 'wb') as f:
-        f.write(download_response['data'])
-
-    slicer = PrusaSlicer(
-        base_price=quote_config.base_price,
-        cost_per_hour=quote_config.cost_per_hour,
-        cost_per_gram=quote_config.cost_per_gram,
-        currency=quote_config.currency,
-    )
+    await asyncio.to_thread((job_output_dir / gcode_path.split('/')[-1]).write_bytes, download_response['data'])
     
-    # Get print details
-    details = slicer.quote_price_basic(
-        gcode_file_path=job_output_dir / gcode_path.split('/')[-1]
-    )
+    printer_config = await asyncio.to_thread(get_printer_config, user_id=user_id, profile_name=profile_name) if profile_name else PrinterConfig()
+
+    # Get print details, simulating the toolpath when the G-code has no estimate
+    with span('quote.print_details'):
+        details = await asyncio.to_thread(
+            slicer.quote_price_basic,
+            gcode_file_path=job_output_dir / gcode_path.split('/')[-1],
+            acceleration=printer_config.acceleration,
+            jerk=printer_config.jerk,
+        )
+
+    analysis = None
+    if detail is not None:
+        from app.utils.gcode_analysis import analyze_gcode
+
+        # Large files take seconds to analyze, keep the event loop free meanwhile
+        with span('gcode.analyze', detail=detail):
+            analysis = await asyncio.to_thread(
+                analyze_gcode,
+                gcode_file_path=job_output_dir / gcode_path.split('/')[-1],
+                estimated_time_seconds=details['estimated_time_seconds'],
+            )
+        if detail == "summary":
+            analysis.pop('features')
+        if detail != "layers":
+            analysis.pop('layers')
 
     # Clean up local files
-    cleanup_files(user_id=user_id)
+    await asyncio.to_thread(cleanup_files, user_id=user_id)
     
     return QuoteResponse(
         user_id=user_id,
@@ -163,6 +277,8 @@ async def quote_model(
         filament_weight=details['filament_weight'],
         filament_cost=details['filament_cost'],
         estimated_time_seconds=details['estimated_time_seconds'],
+        time_source=details['time_source'],
+        analysis=analysis,
         status="quoted"
     )
 
@@ -175,7 +291,8 @@ async def download_gcode(
         user_id: str = Query(..., description="User ID for the print job"),
         gcode_path: str = Query(..., description="Path to the G-code file (this can be found in the slice response)"),
     ):
-    download_response = download_file(
+    download_response = await asyncio.to_thread(
+        download_file,
         bucket_name=BUCKET_FILES,
         file_path=gcode_path
     )
@@ -188,8 +305,7 @@ async def download_gcode(
     job_output_dir = LOCAL_DIR / user_id
     job_output_dir.mkdir(parents=True, exist_ok=True)
     
-    with open(job_output_dir / gcode_path.split('/')[-1], 'wb') as f:
-        f.write(download_response['data'])
+    await asyncio.to_thread((job_output_dir / gcode_path.split('/')[-1]).write_bytes, download_response['data'])
     
     # Add cleanup task to run after response is sent by running it in the background
     background_tasks.add_task(cleanup_after_download, user_id=user_id)
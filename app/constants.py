@@ -4,6 +4,14 @@ from pydantic_settings import BaseSettings
 
 # Constants for file paths and bucket names
 LOCAL_DIR = Path("./app/db/temp")
+TOOLPATH_DIR = Path("./app/db/toolpaths")
+IDEMPOTENCY_DB_PATH = Path("./app/db/idempotency.sqlite3")
+TRACE_EXPORT_PATH = Path("./app/db/traces.jsonl")
+BLOB_CACHE_DIR = Path("./app/db/blob_cache")
+WORKER_QUEUE_DB_PATH = Path("./app/db/worker_queue.sqlite3")
+WORKER_SCRATCH_DIR = Path("./app/db/worker")
+# Outside LOCAL_DIR so cleaning up a user's files never removes a batch being quoted
+ARCHIVE_SCRATCH_DIR = Path("./app/db/archives")
 
 # Bucket names
 BUCKET_FILES = "user-files"
@@ -18,4 +26,100 @@ class Settings(BaseSettings):
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
 
+    # Shared secret for the /admin endpoints, which are disabled while it is empty
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+
+    # Local verification of Supabase access tokens, the JWKS is used for asymmetric keys
+    SUPABASE_JWT_SECRET: str = os.getenv("SUPABASE_JWT_SECRET", "")
+    SUPABASE_JWT_AUDIENCE: str = "authenticated"
+    SUPABASE_JWKS_REFRESH_SECONDS: int = 600
+    TOKEN_CACHE_MAX_ENTRIES: int = 10000
+
+    # Slicer admission control
+    SLICER_MAX_CONCURRENCY: int = 2
+    SLICE_QUEUE_MAX: int = 32
+    SLICE_QUEUE_MAX_PER_USER: int = 8
+    SLICE_RETRY_AFTER_DEFAULT: int = 30  # seconds, used before any drain rate is known
+
+    # Shortest job first ranking: background jobs count this many times their predicted
+    # time, each running slice of the same user adds seconds, each second waited removes AGING
+    SLICE_BACKGROUND_WEIGHT: float = 4.0
+    SLICE_FAIR_SHARE_SECONDS: float = 30.0
+    SLICE_AGING: float = 1.0
+
+    # Slicer workers started with `python -m app.worker`: '' slices in the API process,
+    # 'sqlite:' or 'sqlite:///path' for workers on this machine, 'redis://host:port/db' for
+    # workers anywhere. SLICER_MAX_CONCURRENCY then caps slices in flight across all workers
+    WORKER_QUEUE_URL: str = os.getenv("WORKER_QUEUE_URL", "")
+    WORKER_CONCURRENCY: int = 2
+    WORKER_HEARTBEAT_SECONDS: float = 5.0
+    WORKER_STALE_SECONDS: float = 30.0
+
+    # Slicer threads: every job gets a share of SLICER_CPU_THREADS (0 leaves it to PrusaSlicer),
+    # at most one per SLICE_SECONDS_PER_THREAD of predicted single thread slicing time.
+    # With slicer workers this is the threads of all worker machines together
+    SLICER_CPU_THREADS: int = os.cpu_count() or 2
+    SLICE_SECONDS_PER_THREAD: float = 10.0
+    SLICER_PARALLEL_FRACTION: float = 0.8
+
+    # Slicer memory in MB, sized for a 2 GB VM with room left for the API itself
+    SLICER_MEMORY_BUDGET_MB: int = 1400
+    SLICER_MEMORY_LIMIT_MB: int = 1200
+    SLICER_MEMORY_SAFETY_FACTOR: float = 1.25
+
+    # Users and profiles whose slicer CPU and memory totals are kept
+    SLICER_ACCOUNTING_MAX_KEYS: int = 10000
+
+    # Slicer deadlines in seconds, a profile's slice_timeout takes precedence
+    SLICE_DEADLINE_SECONDS: int = 600
+    INSTANT_QUOTE_DEADLINE_SECONDS: int = 120
+
+    # Load heavy modules, slicer configs and clients in the background after startup
+    WARMUP_ON_STARTUP: bool = True
+
+    # Instant quote results reused for geometrically identical parts
+    QUOTE_CACHE_MAX_ENTRIES: int = 2048
+    QUOTE_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+
+    # Disk budget for sliced G-code kept to serve toolpath invariant config changes,
+    # per process: every API and worker process keeps its own store
+    TOOLPATH_STORE_MAX_BYTES: int = 2 * 1024 ** 3
+
+    # Disk budget for storage objects kept on this node, validated against storage before use,
+    # per process: every API and worker process keeps its own cache
+    BLOB_CACHE_MAX_BYTES: int = 1024 ** 3
+
+    # Responses replayed to retries sent with the same Idempotency-Key
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 3600
+    IDEMPOTENT_PATHS: list[str] = [
+        "/v1/stl/",
+        "/v1/stl/slice/",
+        "/v1/gcode/quote/",
+        "/v1/instant-quote/",
+        "/v1/instant-quote/archive/",
+    ]
+
+    # ZIP archive quotes, entries on scratch disk at once and per entry size cap
+    ARCHIVE_MAX_ENTRIES: int = 200
+    ARCHIVE_PIPELINE_DEPTH: int = 4
+    ARCHIVE_MAX_ENTRY_BYTES: int = 256 * 1024 ** 2
+
+    # Request traces, written as OTLP/JSON lines an OpenTelemetry collector can tail
+    TRACE_EXPORT_ENABLED: bool = True
+    TRACE_EXPORT_MAX_BYTES: int = 50 * 1024 ** 2
+    TRACE_RECENT_MAX: int = 200
+
+    # Event loop lag: heartbeat interval, lag counted as a stall and stalls kept with their stacks
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_MONITOR_INTERVAL_MS: float = 50.0
+    LOOP_STALL_THRESHOLD_MS: float = 100.0
+    LOOP_MONITOR_MAX_STALLS: int = 100
+
+    # Sampling profiler for slow requests, also switched on at runtime from /admin/profiling/
+    PROFILING_ENABLED: bool = False
+    PROFILING_THRESHOLD_MS: float = 2000.0
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_INTERVAL_MS: float = 5.0
+    PROFILING_MAX_PROFILES: int = 50
+
 settings = Settings()
\ No newline at end of file
@@ -1,12 +1,21 @@
-from supabase import create_client, Client
+from __future__ import annotations
+from typing import TYPE_CHECKING
 from app.constants import settings
 from functools import lru_cache
 
+if TYPE_CHECKING:
+    from supabase import Client
+
 @lru_cache()
 def get_supabase_client() -> Client:
     """
     Returns a cached Supabase client instance.
+
+    The SDK is imported on first use, it costs more to import than the rest
+    of the API together.
     """
+    from supabase import create_client
+
     return create_client(
         settings.SUPABASE_URL,
         settings.SUPABASE_KEY
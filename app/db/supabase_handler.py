@@ -1,6 +1,14 @@
-from supabase import Client
+from __future__ import annotations
+import asyncio
+from typing import TYPE_CHECKING, Optional
 from app.db.supabase_auth import get_supabase_client
 from fastapi import UploadFile, HTTPException
+from app.services.tracing import span
+from app.services.blob_cache import blob_cache
+from app.constants import settings
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 
 def create_bucket(bucket_name: str) -> dict:
@@ -55,24 +63,33 @@ async def upload_file(
     else:
         directory = f"{user_id}"
     
-    # Check if the file already exists
-    files = supabase.storage.from_(bucket_name).list(path=directory)
-    if any(existing_file['name'] == file.filename for existing_file in files):
-        if overwrite:
-            supabase.storage.from_(bucket_name).remove([f"{directory}/{file.filename}"])
-        else:
-            raise HTTPException(status_code=400, detail=f"File '{file.filename}' already exists at directory: {directory}.  Consider using overwrite=True to replace it.")
-    
-    # Read file content
-    file_content = await file.read()
-    
-    # Upload to Supabase
-    upload_filepath = f"{directory}/{file.filename}"
-    response = supabase.storage.from_(bucket_name).upload(
-        upload_filepath,
-        file_content,
-        {"content-type": file.content_type}
-    )
+    with span('storage.upload', bucket=bucket_name, file_name=file.filename) as upload_span:
+        # The storage client is synchronous, its calls run in worker threads to keep the event loop free
+        # Check if the file already exists
+        files = await asyncio.to_thread(supabase.storage.from_(bucket_name).list, path=directory)
+        if any(existing_file['name'] == file.filename for existing_file in files):
+            if overwrite:
+                await asyncio.to_thread(supabase.storage.from_(bucket_name).remove, [f"{directory}/{file.filename}"])
+                blob_cache.invalidate(bucket_name, f"{directory}/{file.filename}")
+            else:
+                raise HTTPException(status_code=400, detail=f"File '{file.filename}' already exists at directory: {directory}.  Consider using overwrite=True to replace it.")
+
+        # Read file content
+        file_content = await file.read()
+
+        # Upload to Supabase
+        upload_filepath = f"{directory}/{file.filename}"
+        response = await asyncio.to_thread(
+            supabase.storage.from_(bucket_name).upload,
+            upload_filepath,
+            file_content,
+            {"content-type": file.content_type}
+        )
+        if upload_span is not None:
+            upload_span.set(bytes=len(file_content))
+
+    # Write through, a download right after the upload is served locally
+    await asyncio.to_thread(blob_cache.put, bucket_name, upload_filepath, file_content)
     
     return {
         "status": "successful",
@@ -82,7 +99,8 @@ async def upload_file(
 
 def download_file(bucket_name: str, file_path: str) -> dict:
     """
-    Download a file from a Supabase storage bucket
+    Download a file from a Supabase storage bucket, or from the node local
+    blob cache when storage confirms the cached copy is current
     
     Args:
         bucket_name: Name of the bucket
@@ -93,7 +111,15 @@ def download_file(bucket_name: str, file_path: str) -> dict:
     """
     try:
         supabase: Client = get_supabase_client()
-        response = supabase.storage.from_(bucket_name).download(file_path)
+        with span('storage.download', bucket=bucket_name, file_path=file_path) as download_span:
+            info = get_file_info(bucket_name, file_path) if blob_cache.enabled else None
+            response = blob_cache.get(bucket_name, file_path, info)
+            cached = response is not None
+            if not cached:
+                response = supabase.storage.from_(bucket_name).download(file_path)
+                blob_cache.put(bucket_name, file_path, response, version=info.get('version') if info else None)
+            if download_span is not None:
+                download_span.set(bytes=len(response), cached=cached)
         return {
             "message": f"File '{file_path}' downloaded successfully", 
             "status": 200,
@@ -106,6 +132,66 @@ def download_file(bucket_name: str, file_path: str) -> dict:
             detail="Failed to download file. File does not exist"
         )
 
+def get_file_info(bucket_name: str, file_path: str) -> Optional[dict]:
+    """Size, version and ETag of a file without downloading it, None when storage can't tell"""
+    try:
+        supabase: Client = get_supabase_client()
+        with span('storage.info', bucket=bucket_name, file_path=file_path):
+            return supabase.storage.from_(bucket_name).info(file_path)
+    except Exception:
+        return None
+
+def download_file_windows(bucket_name: str, file_path: str, head_size: int, tail_size: int) -> tuple[bytes, bytes]:
+    """
+    Download only the first and last bytes of a file with ranged requests
+
+    storage3 has no ranged download, the requests go to the storage REST API
+    directly with the same credentials as the client.
+
+    Args:
+        bucket_name: Name of the bucket
+        file_path: Path to the file in the bucket
+        head_size: Bytes read from the start of the file
+        tail_size: Bytes read from the end of the file, never overlapping the head
+
+    Returns:
+        The head and tail windows, the tail is empty for files that fit in the head
+
+    Raises:
+        HTTPException: 404 when the file does not exist or the storage API can't be read
+    """
+    import httpx
+
+    url = f"{settings.SUPABASE_URL.rstrip('/')}/storage/v1/object/{bucket_name}/{file_path}"
+    headers = {"apikey": settings.SUPABASE_KEY, "Authorization": f"Bearer {settings.SUPABASE_KEY}"}
+    try:
+        with span('storage.download_range', bucket=bucket_name, file_path=file_path) as range_span, \
+                httpx.Client(timeout=30.0) as client:
+            response = client.get(url, headers={**headers, "Range": f"bytes=0-{head_size - 1}"})
+            response.raise_for_status()
+            if response.status_code != 206:
+                # Range ignored, the whole file came back
+                content = response.content
+                head, tail = content[:head_size], content[max(len(content) - tail_size, head_size):]
+            else:
+                head = response.content
+                size = int(response.headers["content-range"].rsplit('/', 1)[1])
+                tail = b''
+                if size > head_size:
+                    start = max(size - tail_size, head_size)
+                    tail_response = client.get(url, headers={**headers, "Range": f"bytes={start}-"})
+                    tail_response.raise_for_status()
+                    tail = tail_response.content
+            if range_span is not None:
+                range_span.set(bytes=len(head) + len(tail))
+        return head, tail
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=404, 
+            detail="Failed to download file. File does not exist"
+        )
+
 def delete_file(bucket_name: str, file_path: str) -> dict:
     """
     Delete a file from a Supabase storage bucket
@@ -120,6 +206,7 @@ def delete_file(bucket_name: str, file_path: str) -> dict:
     try:
         supabase: Client = get_supabase_client()
         response = supabase.storage.from_(bucket_name).remove([file_path])
+        blob_cache.invalidate(bucket_name, file_path)
         return {"message": f"File '{file_path}' deleted successfully", "data": response}
     
     except Exception as e:
@@ -1,13 +1,68 @@
 import uvicorn
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.api.v1.base_routes import router as base_router
 from app.api.v1.pro_routes import router as pro_router
 from app.api.v1.auth import router as auth_router
+from app.api.v1.monitoring import router as monitoring_router
+from app.api.v1.jobs import router as jobs_router
+from app.api.v1.admin import router as admin_router
+from app.services.warmup import start_warm_up
+from app.services.token_verifier import token_verifier
+from app.services.idempotency import IdempotencyMiddleware, idempotency_store
+from app.services.tracing import TracingMiddleware, tracer, configure_logging
+from app.services.profiling import ProfilingMiddleware, profiler
+from app.services.loop_monitor import LoopLagMiddleware, loop_monitor
+from app.constants import settings
 from fastapi.middleware.cors import CORSMiddleware
 
+configure_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    profiler.install(asyncio.get_running_loop())
+    app.state.loop_monitor = loop_monitor.start(asyncio.get_running_loop())
+    # Not awaited, the port opens while heavy modules and configs load
+    app.state.warmup = start_warm_up()
+    app.state.jwks_refresh = token_verifier.start()
+    yield
+    if app.state.jwks_refresh is not None:
+        app.state.jwks_refresh.cancel()
+    if app.state.loop_monitor is not None:
+        app.state.loop_monitor.cancel()
+
 app = FastAPI(
     title="Cloud Slicer API",
-    description="API for slicing 3D models"
+    description="API for slicing 3D models",
+    lifespan=lifespan,
+)
+
+# Innermost, profiles only the handler itself
+app.add_middleware(
+    ProfilingMiddleware,
+    profiler=profiler,
+    exclude=("/v1/admin/", "/v1/monitoring/"),
+)
+
+# Inside tracing so stalls carry the request ID of the request that blocked the loop
+app.add_middleware(
+    LoopLagMiddleware,
+    monitor=loop_monitor,
+)
+
+# Added before CORS so replayed responses still pass through it
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=idempotency_store,
+    paths=settings.IDEMPOTENT_PATHS,
+)
+
+# Outside idempotency so replayed responses are traced and carry a request ID too
+app.add_middleware(
+    TracingMiddleware,
+    tracer=tracer,
+    exclude=("/v1/monitoring/",),
 )
 
 app.add_middleware(
@@ -19,11 +74,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
 app.include_router(base_router, prefix="/v1", tags=["Basic Level"])
 app.include_router(pro_router, prefix="/v1", tags=["Advanced Level"])
 app.include_router(auth_router, prefix="/v1", tags=["Authentication"])
+app.include_router(monitoring_router, prefix="/v1", tags=["Monitoring"])
+app.include_router(jobs_router, prefix="/v1", tags=["Jobs"])
+app.include_router(admin_router, prefix="/v1", tags=["Admin"])
 
 @app.get("/", include_in_schema=False)
 async def root():
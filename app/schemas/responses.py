@@ -3,7 +3,15 @@ from pydantic import BaseModel, Field
 
 # -------------------------- INPUT SCHEMAS --------------------------
 class PrinterConfig(BaseModel):
-    """Printer configuration settings for slicing"""
+    """
+    Printer configuration settings for slicing
+
+    Fields marked `toolpath: False` don't change the G-code's moves or
+    filament use, a G-code sliced with different values can be reused by
+    patching its commands. Acceleration and jerk only change print times
+    simulated for G-code without a slicer estimate, those are cached together
+    with the values they were simulated with
+    """
     # Printer bed dimensions
     bed_size_x: int = Field(default=210, description="X dimension of the print bed in mm")
     bed_size_y: int = Field(default=210, description="Y dimension of the print bed in mm")
@@ -12,6 +20,8 @@ class PrinterConfig(BaseModel):
     # Speed settings
     print_speed: int = Field(default=100, description="Default print speed in mm/s")
     first_layer_speed: int = Field(default=50, description="First layer speed in mm/s")
+    acceleration: int = Field(default=1000, description="Print acceleration in mm/s^2, used to estimate print time when the G-code has no estimate", gt=0, json_schema_extra={"toolpath": False})
+    jerk: float = Field(default=8.0, description="Maximum instantaneous speed change in mm/s, used to estimate print time when the G-code has no estimate", gt=0, json_schema_extra={"toolpath": False})
     
     # Default printer settings
     nozzle_diameter: float = Field(default=0.4, description="Nozzle diameter in mm")
@@ -21,11 +31,14 @@ class PrinterConfig(BaseModel):
     bottom_solid_layers: int = Field(default=3, description="Number of bottom layers")
     fill_density: int = Field(default=20, description="Infill density percentage (0-100)", ge=0, le=100)
     support_material: bool = Field(default=False, description="Whether or not to generate the supports")
+    auto_support: bool = Field(default=False, description="Choose support_material from an overhang analysis of the model instead of the value above")
+    support_material_threshold: int = Field(default=45, description="Overhang slope in degrees from horizontal below which supports are needed", ge=0, le=90)
+    slice_timeout: Optional[int] = Field(default=None, description="Seconds allowed for slicing before the job is killed, defaults to the route's deadline", gt=0, json_schema_extra={"toolpath": False})
     
     # Material settings
     filament_type: str = Field(default="PLA", description="Type of filament to print with (PLA, ABS, PETG)")
-    temperature: int = Field(default=210, description="Filament temperature in Celsius")
-    bed_temperature: int = Field(default=60, description="Bed temperature in Celsius")
+    temperature: int = Field(default=210, description="Filament temperature in Celsius", json_schema_extra={"toolpath": False})
+    bed_temperature: int = Field(default=60, description="Bed temperature in Celsius", json_schema_extra={"toolpath": False})
 
 class QuoteConfig(BaseModel):
     """Configuration for instant quote"""
@@ -40,6 +53,20 @@ class ProfileConfig(BaseModel):
     printer_config: PrinterConfig = Field(default_factory=PrinterConfig, description="Printer configuration settings")
     quote_config: QuoteConfig = Field(default_factory=QuoteConfig, description="Quote configuration settings")
 
+class PrinterVolume(BaseModel):
+    """Build volume of a printer checked by the fit matrix"""
+    name: str = Field(..., description="Printer or profile name")
+    bed_size_x: float = Field(..., description="X dimension of the print bed in mm", gt=0)
+    bed_size_y: float = Field(..., description="Y dimension of the print bed in mm", gt=0)
+    bed_size_z: float = Field(..., description="Z dimension of the print bed in mm", gt=0)
+
+class ProfilingSettings(BaseModel):
+    """Runtime settings of the request profiler, omitted fields are left unchanged"""
+    enabled: Optional[bool] = Field(default=None, description="Profile requests")
+    threshold_ms: Optional[float] = Field(default=None, description="Requests at least this slow are kept", ge=0)
+    sample_rate: Optional[float] = Field(default=None, description="Fraction of all requests kept regardless of latency", ge=0, le=1)
+    interval_ms: Optional[float] = Field(default=None, description="Milliseconds between stack samples", ge=1)
+
 # -------------------------- RESPONSE SCHEMAS --------------------------
 class STLResponse(BaseModel):
     status: str
@@ -52,7 +79,31 @@ class SliceResponse(BaseModel):
     user_id: str
     file_name: str
     gcode_path: Optional[str] = None
+    support_material: Optional[bool] = None
+    reused_toolpath: Optional[bool] = None
     
+class FeatureBreakdown(BaseModel):
+    time_seconds: float
+    filament_mm: float
+    filament_g: float
+    distance_mm: float
+
+class LayerBreakdown(BaseModel):
+    layer: int
+    z: float
+    start_seconds: float
+    time_seconds: float
+    filament_mm: float
+
+class GcodeAnalysis(BaseModel):
+    layer_count: int
+    arc_moves: int = Field(default=0, description="G2/G3 arcs, counted as straight moves to their end point")
+    total_time_seconds: float
+    total_filament_mm: float
+    total_filament_g: float
+    features: Optional[dict[str, FeatureBreakdown]] = None
+    layers: Optional[list[LayerBreakdown]] = None
+
 class QuoteResponse(BaseModel):
     user_id: str
     gcode_path: str
@@ -62,6 +113,8 @@ class QuoteResponse(BaseModel):
     filament_weight: Optional[float] = None
     filament_cost: Optional[float] = None
     estimated_time_seconds: Optional[int] = None
+    time_source: Optional[str] = Field(default=None, description="'slicer' when the G-code carried an estimate, 'simulation' when the time was simulated with the profile's acceleration and jerk")
+    analysis: Optional[GcodeAnalysis] = None
     status: str
 
 class ProfileConfigRepsonse(BaseModel):
@@ -79,6 +132,32 @@ class InstantQuoteResponse(BaseModel):
     estimated_time_seconds: Optional[int] = None
     filament_weight: Optional[float] = None
     filament_cost: Optional[float] = None
+    reoriented: Optional[bool] = None
+    cached: Optional[bool] = None
+    status: str
+
+class ArchiveEntryQuote(BaseModel):
+    file_name: str
+    total_price: Optional[float] = None
+    currency: Optional[str] = None
+    estimated_time: Optional[str] = None
+    estimated_time_seconds: Optional[int] = None
+    filament_weight: Optional[float] = None
+    filament_cost: Optional[float] = None
+    reoriented: Optional[bool] = None
+    cached: Optional[bool] = None
+    error: Optional[str] = None
+    status: str
+
+class ArchiveQuoteResponse(BaseModel):
+    user_id : str
+    entries: list[ArchiveEntryQuote]
+    quoted: int
+    failed: int
+    total_price: float
+    currency: str
+    total_estimated_time_seconds: int
+    total_filament_weight: float
     status: str
 
 class PrintabilityResponse(BaseModel):
@@ -86,6 +165,24 @@ class PrintabilityResponse(BaseModel):
     fits_printer: bool
     model_dimensions : dict
     printer_dimensions : dict
+    overhang_area: Optional[float] = None
+    overhang_fraction: Optional[float] = None
+    needs_support: Optional[bool] = None
+
+class PrinterFit(BaseModel):
+    name: str
+    fits_as_is: bool
+    fits: bool
+    reoriented: Optional[bool] = None
+    rotation: Optional[list[list[float]]] = None
+    model_dimensions: Optional[dict] = None
+    overhang_fraction: Optional[float] = None
+
+class FitMatrixResponse(BaseModel):
+    user_id : str
+    model_dimensions : dict
+    candidates_evaluated: int
+    printers: list[PrinterFit]
 
 class TokenResponse(BaseModel):
     access_token: str
@@ -0,0 +1,187 @@
+import re
+import uuid
+import shutil
+import asyncio
+import logging
+import zipfile
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException, Request, UploadFile
+from app.schemas.responses import PrinterConfig, QuoteConfig, ArchiveEntryQuote
+from app.services.base_routes_helpers import quote_local_stl
+from app.constants import ARCHIVE_SCRATCH_DIR, settings
+
+logger = logging.getLogger(__name__)
+
+# Bytes decompressed per read while copying an entry to scratch disk
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Folders and files archivers add next to the real content
+IGNORED_ENTRY = re.compile(r'(^|/)(__MACOSX/|\.)')
+
+
+class EntryTooLarge(Exception):
+    pass
+
+
+def _extract_entry(archive: zipfile.ZipFile, info: zipfile.ZipInfo, destination: Path, max_bytes: int):
+    """
+    Stream one entry to disk, counting the bytes actually decompressed rather
+    than trusting the size in the header
+    """
+    written = 0
+    try:
+        with archive.open(info) as source, open(destination, 'wb') as target:
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise EntryTooLarge(f"Entry is larger than {max_bytes} bytes uncompressed")
+                target.write(chunk)
+    except BaseException:
+        destination.unlink(missing_ok=True)
+        raise
+
+
+def _entry_stem(batch: str, index: int, name: str) -> str:
+    """File name of an entry on scratch disk, unique per batch and safe for the slicer command line"""
+    stem = re.sub(r'[^A-Za-z0-9._-]', '_', Path(name).stem)[:64]
+    return f"{batch}-{index}-{stem}"
+
+
+def _remove_entry_files(directory: Path, stem: str):
+    for path in directory.glob(f"{stem}.*"):
+        path.unlink(missing_ok=True)
+
+
+def _remove_batch_directory(directory: Path):
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        directory.parent.rmdir()
+    except OSError:
+        # Another batch of the user is still running
+        pass
+
+
+async def quote_archive(
+    user_id: str,
+    file: UploadFile,
+    printer_config: PrinterConfig,
+    quote_config: QuoteConfig,
+    auto_orient: bool = True,
+    request: Optional[Request] = None,
+    profile_name: Optional[str] = None,
+) -> list[ArchiveEntryQuote]:
+    """
+    Quote every STL of a ZIP archive, streaming entries through the quote pipeline.
+
+    Entries are decompressed one at a time straight from the upload. As soon as
+    an entry is on scratch disk it is handed to the orient/slice/quote pipeline
+    while the next one is decompressed. At most `ARCHIVE_PIPELINE_DEPTH` entries
+    are on disk at once and each is capped at `ARCHIVE_MAX_ENTRY_BYTES`, so
+    memory and scratch disk stay bounded whatever the archive size. The slice
+    scheduler still decides how many of them slice concurrently.
+
+    Each batch works in a scratch directory of its own under
+    `ARCHIVE_SCRATCH_DIR`, so other requests cleaning up the user's local
+    files do not remove entries being quoted.
+
+    Args:
+        user_id (str): User the slices are queued under
+        file (UploadFile): ZIP archive upload
+        printer_config (PrinterConfig): Profile's printer configuration
+        quote_config (QuoteConfig): Profile's pricing
+        auto_orient (bool): Rotate each model to its best orientation
+        request (Request, optional): Request to watch for client disconnects
+        profile_name (str, optional): Profile the configs came from, for slicer accounting
+
+    Returns:
+        list[ArchiveEntryQuote]: One result per archive entry, in archive order
+
+    Raises:
+        HTTPException: 400 when the upload is not a readable ZIP archive, 413 when
+            it has more entries than `ARCHIVE_MAX_ENTRIES`
+    """
+    try:
+        archive = zipfile.ZipFile(file.file)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read ZIP archive: {e}")
+
+    with archive:
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir() and not IGNORED_ENTRY.search(info.filename)
+        ]
+        if len(entries) > settings.ARCHIVE_MAX_ENTRIES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Archive has {len(entries)} files, at most {settings.ARCHIVE_MAX_ENTRIES} are quoted per request",
+            )
+
+        batch = uuid.uuid4().hex[:8]
+        job_output_dir = ARCHIVE_SCRATCH_DIR / user_id / batch
+        job_output_dir.mkdir(parents=True, exist_ok=True)
+        slots = asyncio.Semaphore(settings.ARCHIVE_PIPELINE_DEPTH)
+        results: list[Optional[ArchiveEntryQuote]] = [None] * len(entries)
+        tasks = []
+
+        async def process(index: int, name: str, stem: str):
+            try:
+                quote = await quote_local_stl(
+                    user_id=user_id,
+                    stl_file_path=f"{job_output_dir}/{stem}.stl",
+                    printer_config=printer_config,
+                    quote_config=quote_config,
+                    auto_orient=auto_orient,
+                    request=request,
+                    deadline=settings.SLICE_DEADLINE_SECONDS,
+                    cleanup=False,
+                    profile_name=profile_name,
+                    # Batches of parts rank with full slices, single instant quotes go first
+                    interactive=False,
+                    work_dir=job_output_dir,
+                )
+                results[index] = ArchiveEntryQuote(file_name=name, **quote.model_dump(exclude={'user_id'}))
+            except HTTPException as e:
+                results[index] = ArchiveEntryQuote(file_name=name, status="failed", error=str(e.detail))
+            except Exception as e:
+                # Anything else one part raises fails that part only, not the whole archive
+                logger.exception(f"Quoting archive entry {name} failed")
+                results[index] = ArchiveEntryQuote(file_name=name, status="failed", error=f"Could not quote file: {e}")
+            finally:
+                await asyncio.to_thread(_remove_entry_files, job_output_dir, stem)
+                slots.release()
+
+        try:
+            for index, info in enumerate(entries):
+                name = info.filename
+                if not name.lower().endswith('.stl'):
+                    results[index] = ArchiveEntryQuote(file_name=name, status="skipped", error="Not an STL file")
+                    continue
+
+                await slots.acquire()
+                stem = _entry_stem(batch, index, name)
+                try:
+                    await asyncio.to_thread(
+                        _extract_entry, archive, info, job_output_dir / f"{stem}.stl", settings.ARCHIVE_MAX_ENTRY_BYTES,
+                    )
+                except (EntryTooLarge, zipfile.BadZipFile, RuntimeError, NotImplementedError, OSError) as e:
+                    # Corrupt, encrypted or oversized entries fail alone
+                    slots.release()
+                    logger.info(f"Skipping archive entry {name}: {e}")
+                    results[index] = ArchiveEntryQuote(file_name=name, status="failed", error=str(e))
+                    continue
+
+                tasks.append(asyncio.create_task(process(index, name, stem)))
+
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Let cancelled entries stop writing before their directory goes
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(_remove_batch_directory, job_output_dir)
+
+    return results
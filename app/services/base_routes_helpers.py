@@ -1,15 +1,31 @@
 import json
+import struct
 import shutil
+import asyncio
+import logging
 from pathlib import Path
-from fastapi import UploadFile, HTTPException
+from typing import Optional
+from fastapi import UploadFile, HTTPException, Request
 from pydantic import TypeAdapter
-from app.utils.utilities import convert_path_to_upload_file, cleanup_files
-from app.schemas.responses import SliceResponse, QuoteResponse, STLResponse, PrinterConfig, QuoteConfig
+from app.utils.utilities import convert_path_to_upload_file, cleanup_files, check_printability
+from app.schemas.responses import SliceResponse, QuoteResponse, STLResponse, PrinterConfig, QuoteConfig, PrinterVolume, InstantQuoteResponse
 from app.services.prusa_slicer import PrusaSlicer
-from app.services.pro_routes_helpers import create_ini_config
+from app.services.pro_routes_helpers import create_ini_config, printer_config_from_ini
+from app.services.slice_scheduler import slice_scheduler
+from app.services.quote_cache import quote_cache
+from app.services.tracing import span
 from app.db.supabase_handler import download_file
-from app.constants import LOCAL_DIR, BUCKET_FILES
+from app.constants import LOCAL_DIR, BUCKET_FILES, settings
 
+logger = logging.getLogger(__name__)
+
+# Profiles store the PrinterConfig itself next to the slicer .ini, which can't hold every field
+PRINTER_CONFIG_SUFFIX = '.printer.json'
+
+
+def _save_upload(source, destination: Path):
+    with open(destination, "wb") as buffer:
+        shutil.copyfileobj(source, buffer)
 
 async def local_upload_stl(
         user_id: str,
@@ -24,9 +40,8 @@ async def local_upload_stl(
 
     file_path = LOCAL_DIR / user_id / file.filename
 
-    # Save the uploaded file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save the uploaded file, copying a large upload would block the event loop
+    await asyncio.to_thread(_save_upload, file.file, file_path)
 
     return STLResponse(
         status="success",
@@ -35,25 +50,153 @@ async def local_upload_stl(
         stl_file_path=str(job_output_dir)
     )
 
+async def orient_for_printer(
+    stl_file_path: str,
+    printer_config: PrinterConfig,
+    apply: bool = True,
+):
+    """
+    Search for the best orientation of a local STL on the profile's bed and rotate it.
+
+    Raises a 422 before any slicer time is spent when no orientation fits.
+
+    Returns:
+        dict: The chosen orientation from `evaluate_orientations`
+    """
+    printability = await asyncio.to_thread(
+        check_printability,
+        stl_file_path=stl_file_path,
+        printer_dimensions=(printer_config.bed_size_x, printer_config.bed_size_y, printer_config.bed_size_z),
+        auto_orient=True,
+        overhang_threshold=printer_config.support_material_threshold,
+    )
+
+    if 'error' in printability:
+        raise HTTPException(status_code=400, detail=printability['error'])
+
+    orientation = printability['orientation']
+    fits = orientation['fits'] if apply else printability['printable']
+    if not fits:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Model does not fit the {printer_config.bed_size_x}x{printer_config.bed_size_y}x{printer_config.bed_size_z} mm build volume in {'any' if apply else 'its current'} orientation",
+        )
+
+    if apply and not orientation['is_original']:
+        from app.utils.mesh_analysis import rotate_stl
+
+        await asyncio.to_thread(rotate_stl, stl_file_path, orientation['rotation'])
+
+    return orientation
+
+def _fit_printers(data: bytes, printers: list[PrinterVolume], overhang_threshold: float) -> dict:
+    from app.utils.mesh_analysis import triangles_from_bytes, fit_matrix
+
+    triangles = triangles_from_bytes(data)
+    if not len(triangles):
+        raise ValueError("STL file has no triangles")
+
+    low, high = triangles.reshape(-1, 3).min(axis=0), triangles.reshape(-1, 3).max(axis=0)
+    result = fit_matrix(
+        triangles,
+        [(printer.bed_size_x, printer.bed_size_y, printer.bed_size_z) for printer in printers],
+        overhang_threshold=overhang_threshold,
+    )
+    result['model_dimensions'] = dict(zip('xyz', (high - low).tolist()))
+    return result
+
+async def printer_fit_matrix(
+    file: UploadFile,
+    printers: list[PrinterVolume],
+    overhang_threshold: float = 45.0,
+) -> dict:
+    """
+    Check an uploaded STL against many printers, parsing the mesh only once
+
+    The file is read straight from the upload, nothing is written to disk.
+
+    Returns:
+        dict: Result of `fit_matrix` plus the model's `model_dimensions` as uploaded
+    """
+    if not file.filename.lower().endswith('.stl'):
+        raise HTTPException(status_code=400, detail="File must be an STL")
+
+    data = await file.read()
+    try:
+        return await asyncio.to_thread(_fit_printers, data, printers, overhang_threshold)
+    except (ValueError, AssertionError, struct.error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read STL file: {e}")
+
+def _analyze_stl(stl_file_path: str, overhang_threshold: float) -> dict:
+    from app.utils.mesh_analysis import load_triangles, geometry_fingerprint, analyze_overhangs
+
+    triangles = load_triangles(stl_file_path)
+    vertices = triangles.reshape(-1, 3)
+    size = vertices.max(axis=0) - vertices.min(axis=0) if len(vertices) else (0.0, 0.0, 0.0)
+    try:
+        fingerprint = geometry_fingerprint(triangles)
+        fingerprint['height'] = float(size[2])
+    except ValueError as e:
+        logger.info(f"No geometry fingerprint for {stl_file_path}: {e}")
+        fingerprint = None
+
+    return {
+        'fingerprint': fingerprint,
+        'overhang': analyze_overhangs(triangles=triangles, overhang_threshold=overhang_threshold),
+        'statistics': {'triangles': len(triangles), 'dimensions': tuple(round(float(value), 3) for value in size)},
+    }
+
+async def analyze_model(stl_file_path: str, overhang_threshold: float = 45.0) -> dict:
+    """
+    Everything quoting needs from a local STL as placed, parsing the mesh once
+
+    Returns:
+        dict: 'fingerprint', the result of `geometry_fingerprint` plus `height` or None
+            when the mesh is not closed enough to have a volume, 'overhang' from
+            `analyze_overhangs` and 'statistics' like `stl_statistics`
+    """
+    return await asyncio.to_thread(_analyze_stl, stl_file_path, overhang_threshold)
+
 async def local_slice_model(
     user_id: str,
     stl_file_path: str,
     printer_config: PrinterConfig,
     cleanup: bool = False,
+    request: Optional[Request] = None,
+    deadline: Optional[float] = None,
+    job_id: Optional[str] = None,
+    profile_name: Optional[str] = None,
+    interactive: bool = True,
+    model: Optional[dict] = None,
+    work_dir: Optional[Path] = None,
 ):
+    """
+    Slice a local STL through the slice scheduler
+
+    Args:
+        model (dict, optional): Result of `analyze_model` for the STL, saves parsing it again
+        work_dir (Path, optional): Directory of the STL where the config and G-code
+            are written, the user's local directory by default
+    """
     # Generate output file path
     stl_file_path_parts = stl_file_path.split('/')
     output_name = stl_file_path_parts[-1].rsplit('.', 1)[0] + '.gcode'
     output_path = stl_file_path.rsplit('.', 1)[0] + '.gcode'
 
-    job_output_dir = LOCAL_DIR / user_id
+    job_output_dir = work_dir or LOCAL_DIR / user_id
     job_output_dir.mkdir(parents=True, exist_ok=True)
 
-    response = create_ini_config(
-        user_id=user_id,
-        stl_file_path=stl_file_path,
-        printer_config=printer_config
-    )
+    # Auto support parses the mesh unless the overhangs were analyzed already
+    with span('config.create_ini'):
+        response = await asyncio.to_thread(
+            create_ini_config,
+            user_id=user_id,
+            stl_file_path=stl_file_path,
+            printer_config=printer_config,
+            model_path=Path(stl_file_path),
+            overhang=model['overhang'] if model else None,
+            work_dir=job_output_dir,
+        )
 
     # TODO: See if we can avoid writing the config file to disk
     slicer = PrusaSlicer(
@@ -61,8 +204,27 @@ async def local_slice_model(
         config_path=response['output_dir'],
     )
 
-    # Run slicing operation
-    success = slicer.slice(
+    if model is not None:
+        statistics = model['statistics']
+    else:
+        from app.utils.mesh_analysis import stl_statistics
+
+        statistics = await asyncio.to_thread(stl_statistics, stl_file_path)
+
+    # Run slicing operation once admission control hands us a slot and enough memory
+    success = await slice_scheduler.run(
+        user_id,
+        slicer.slice,
+        deadline=printer_config.slice_timeout or deadline,
+        request=request,
+        job_id=job_id,
+        triangles=statistics['triangles'],
+        dimensions=statistics['dimensions'],
+        layer_height=printer_config.layer_height,
+        support_material=response['support_material'],
+        interactive=interactive,
+        # Profile names are per user, every user has a "default"
+        profile=f"{user_id}/{profile_name}" if profile_name else None,
         output_gcode_path=job_output_dir / output_name
     )
     
@@ -78,13 +240,14 @@ async def local_slice_model(
     
     #Remove local stl and gcode file after upload for cleanup
     if cleanup:
-        cleanup_files(user_id=user_id)
+        await asyncio.to_thread(cleanup_files, user_id=user_id)
 
     return SliceResponse(
         status="success",
         user_id=user_id,
         file_name=output_name,
-        gcode_path=output_path
+        gcode_path=output_path,
+        support_material=response['support_material'],
     )
 
 async def local_quote_model(
@@ -92,8 +255,10 @@ async def local_quote_model(
     gcode_path: str,
     quote_config: QuoteConfig,
     cleanup: bool = True,
-    
+    printer_config: Optional[PrinterConfig] = None,
+    work_dir: Optional[Path] = None,
 ):  
+    printer_config = printer_config or PrinterConfig()
     slicer = PrusaSlicer(
         base_price=quote_config.base_price,
         cost_per_hour=quote_config.cost_per_hour,
@@ -102,13 +267,18 @@ async def local_quote_model(
     )
     
     # Get print details
-    details = slicer.quote_price_basic(
-        gcode_file_path= LOCAL_DIR / user_id / gcode_path.split('/')[-1]
-    )
+    # Falls back to simulating the toolpath when the G-code has no estimate, keep it off the event loop
+    with span('quote.print_details'):
+        details = await asyncio.to_thread(
+            slicer.quote_price_basic,
+            gcode_file_path=(work_dir or LOCAL_DIR / user_id) / gcode_path.split('/')[-1],
+            acceleration=printer_config.acceleration,
+            jerk=printer_config.jerk,
+        )
 
     # Clean up local files
     if cleanup:
-        cleanup_files(user_id=user_id)
+        await asyncio.to_thread(cleanup_files, user_id=user_id)
     
     return QuoteResponse(
         user_id=user_id,
@@ -119,6 +289,118 @@ async def local_quote_model(
         filament_weight=details['filament_weight'],
         filament_cost=details['filament_cost'],
         estimated_time_seconds=details['estimated_time_seconds'],
+        time_source=details['time_source'],
+        status="quoted"
+    )
+
+async def quote_local_stl(
+    user_id: str,
+    stl_file_path: str,
+    printer_config: PrinterConfig,
+    quote_config: QuoteConfig,
+    auto_orient: bool = True,
+    request: Optional[Request] = None,
+    deadline: Optional[float] = None,
+    job_id: Optional[str] = None,
+    cleanup: bool = True,
+    profile_name: Optional[str] = None,
+    interactive: bool = True,
+    work_dir: Optional[Path] = None,
+) -> InstantQuoteResponse:
+    """
+    Orient, slice and price a local STL, reusing cached results of identical parts
+
+    Args:
+        cleanup (bool): Remove the user's local files afterwards, callers quoting
+            several files at once remove their own files instead
+        profile_name (str, optional): Profile the configs came from, for slicer accounting
+        interactive (bool): Someone waits on this quote, slice it ahead of background jobs
+        work_dir (Path, optional): Directory of the STL, where the slicer's files are written
+            instead of the user's local directory
+
+    Raises:
+        HTTPException: 422 when the model doesn't fit the profile's bed, or any
+            error of the slice scheduler
+    """
+    # Reject parts that cannot fit before any slicer time is spent
+    with span('model.orient', auto_orient=auto_orient):
+        orientation = await orient_for_printer(
+            stl_file_path=stl_file_path,
+            printer_config=printer_config,
+            apply=auto_orient,
+        )
+
+    # Re-exports of a part already quoted with this profile skip the slicer
+    with span('model.analyze'):
+        model = await analyze_model(stl_file_path, overhang_threshold=printer_config.support_material_threshold)
+    fingerprint = model['fingerprint']
+    with span('quote_cache.lookup') as lookup_span:
+        cache_key = quote_cache.key(
+            user_id=user_id,
+            fingerprint=fingerprint['fingerprint'],
+            printer_config=printer_config,
+            height=fingerprint['height'],
+        ) if fingerprint else None
+        sliced = quote_cache.get(cache_key, printer_config) if cache_key else None
+        if lookup_span is not None:
+            lookup_span.set(hit=sliced is not None)
+
+    if sliced is None:
+        slice_model_response = await local_slice_model(
+            user_id=user_id,
+            cleanup=False,
+            stl_file_path=stl_file_path,
+            printer_config=printer_config,
+            request=request,
+            deadline=deadline or settings.INSTANT_QUOTE_DEADLINE_SECONDS,
+            job_id=job_id,
+            profile_name=profile_name,
+            interactive=interactive,
+            model=model,
+            work_dir=work_dir,
+        )
+
+        quote_model_response = await local_quote_model(
+            user_id=user_id,
+            gcode_path=slice_model_response.gcode_path,
+            quote_config=quote_config,
+            printer_config=printer_config,
+            cleanup=cleanup,
+            work_dir=work_dir,
+        )
+        sliced = {
+            'estimated_time': quote_model_response.estimated_time,
+            'estimated_time_seconds': quote_model_response.estimated_time_seconds,
+            'filament_weight': quote_model_response.filament_weight,
+            'filament_cost': quote_model_response.filament_cost,
+            # Simulated times only hold for the acceleration and jerk they were simulated with
+            'kinematics': [printer_config.acceleration, printer_config.jerk] if quote_model_response.time_source == 'simulation' else None,
+        }
+        if cache_key:
+            quote_cache.put(cache_key, sliced)
+        cached = False
+    else:
+        if cleanup:
+            await asyncio.to_thread(cleanup_files, user_id)
+        cached = True
+
+    pricing = PrusaSlicer(
+        base_price=quote_config.base_price,
+        cost_per_hour=quote_config.cost_per_hour,
+        cost_per_gram=quote_config.cost_per_gram,
+        currency=quote_config.currency,
+    )
+
+    return InstantQuoteResponse(
+        user_id = user_id,
+        total_price=pricing.price(sliced['estimated_time_seconds'], sliced['filament_weight']),
+        currency=quote_config.currency,
+        estimated_time=sliced['estimated_time'],
+        estimated_time_seconds=sliced['estimated_time_seconds'],
+        filament_weight=sliced['filament_weight'],
+        filament_cost=sliced['filament_cost'],
+        reoriented=auto_orient and not orientation['is_original'],
+        cached=cached,
         status="quoted"
     )
 
@@ -151,29 +433,68 @@ def create_quote_config(
         'output_dir': job_output_dir / output_name
     }
 
+def create_printer_config(
+    user_id: str,
+    printer_config_file: str,
+    printer_config: PrinterConfig,
+):
+    """
+    Create a printer config json file using the provided PrinterConfig object.
+    
+    Args:
+        user_id: User ID for the print job
+        printer_config_file: Path to the printer configuration file
+        printer_config: PrinterConfig object with configuration details
+    
+    Returns:
+        Path to the created printer configuration file
+    """
+    file_path_parts = printer_config_file.split('/')
+    output_name = file_path_parts[-1].rsplit('.', 1)[0] + PRINTER_CONFIG_SUFFIX
+
+    job_output_dir = Path(LOCAL_DIR / user_id)
+    job_output_dir.mkdir(parents=True, exist_ok=True)
+    
+    with open(job_output_dir / output_name, 'w') as f:
+        json.dump(printer_config.model_dump(), f, indent=4)
+    
+    return {
+        'output_dir': job_output_dir / output_name
+    }
+
 def get_printer_config(
     user_id: str,
     profile_name: str,
 ):
     """
-    Get the printer configuration from an INI file.
+    Get the printer configuration saved with a profile.
+
+    Profiles saved before the JSON copy was stored are read from their slicer
+    .ini, which keeps every field but acceleration, jerk, auto_support and
+    slice_timeout; those fall back to their defaults.
     
     Args:
         user_id: User ID for the print job
-        quote_config_file: Path to the printer configuration file
+        profile_name: Name of the printer config profile
     
     Returns:
         PrinterConfig dictionary object with the loaded configuration
     """
+    profile_dir = f"{user_id}/profiles/{profile_name}"
 
-    file_path = f"{user_id}/profiles/{profile_name}/{profile_name}.ini"
-
-    printer_config = download_file(
-        bucket_name=BUCKET_FILES,
-        file_path=file_path,
-    )
+    try:
+        printer_config = download_file(
+            bucket_name=BUCKET_FILES,
+            file_path=f"{profile_dir}/{profile_name}{PRINTER_CONFIG_SUFFIX}",
+        )
+    except HTTPException:
+        printer_config = download_file(
+            bucket_name=BUCKET_FILES,
+            file_path=f"{profile_dir}/{profile_name}.ini",
+        )
+        return printer_config_from_ini(printer_config['data'].decode())
 
-    return PrinterConfig.model_validate(printer_config)
+    return PrinterConfig.model_validate_json(printer_config['data'])
 
 def get_quote_config(
     user_id: str,
@@ -197,4 +518,4 @@ def get_quote_config(
         file_path=file_path,
     )
 
-    return QuoteConfig.model_validate(quote_config) if quote_config else QuoteConfig.model_validate({})
\ No newline at end of file
+    return QuoteConfig.model_validate_json(quote_config['data'])
\ No newline at end of file
@@ -0,0 +1,175 @@
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional
+from app.constants import BLOB_CACHE_DIR, settings
+from app.utils.utilities import process_directory
+
+logger = logging.getLogger(__name__)
+
+
+def etag_digest(etag: Optional[str]) -> Optional[str]:
+    """MD5 hex digest an ETag stands for, None for multipart and other opaque ETags"""
+    if not etag:
+        return None
+    etag = etag.removeprefix('W/').strip('"')
+    return etag.lower() if len(etag) == 32 and '-' not in etag else None
+
+
+class BlobCache:
+    def __init__(self, directory: Path, max_bytes: int = 1024 ** 3):
+        """
+        Node local cache of storage objects in front of `download_file`.
+
+        Slicing, quoting and downloading the same G-code or STL fetch it from
+        storage again each time. Objects are kept on disk here and only served
+        after storage confirms the cached copy is current: the object's version
+        must match the one it was downloaded at, or its ETag the MD5 of the
+        cached bytes, which also validates copies written through on upload.
+        Anything that cannot be validated is downloaded again, so a stale copy
+        is never served. The least recently used objects are evicted once the
+        cache grows past `max_bytes`.
+
+        Args:
+            directory (Path): Where the cached objects are kept, each process uses its own subdirectory
+            max_bytes (int): Disk budget of this process' cache, 0 disables it
+        """
+        self.root = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+        self._bytes = 0
+        # Downloads run in worker threads
+        self._lock = threading.Lock()
+        self._directory: Optional[Path] = None
+        self._pid: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.bytes_saved = 0
+
+    @property
+    def directory(self) -> Path:
+        """This process' directory, set up on first use so importing the module deletes nothing"""
+        if self._pid != os.getpid():
+            # A forked process starts over, the parent's index isn't its own
+            self._entries.clear()
+            self._bytes = 0
+            self._directory = process_directory(self.root)
+            self._pid = os.getpid()
+        return self._directory
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, bucket_name: str, file_path: str, info: Optional[dict]) -> Optional[bytes]:
+        """
+        Cached content of an object, if it is still current
+
+        Args:
+            bucket_name (str): Storage bucket
+            file_path (str): Object path in the bucket
+            info (dict, optional): Object info from storage, with its 'version' and 'etag'
+
+        Returns:
+            bytes: The object's content, None on a miss
+        """
+        key = (bucket_name, file_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            current = bool(info) and (
+                (info.get('version') is not None and info.get('version') == entry['version'])
+                or etag_digest(info.get('etag')) == entry['md5']
+            )
+            if not current:
+                self._remove(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            data = entry['path'].read_bytes()
+        except OSError:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._remove(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(data)
+        return data
+
+    def put(self, bucket_name: str, file_path: str, data: bytes, version: Optional[str] = None):
+        """
+        Keep a copy of an object just downloaded or uploaded
+
+        Args:
+            bucket_name (str): Storage bucket
+            file_path (str): Object path in the bucket
+            data (bytes): The object's content
+            version (str, optional): Storage version the content was read at
+        """
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        key = (bucket_name, file_path)
+        with self._lock:
+            directory = self.directory
+
+        # Hashed and written outside the lock, objects can be hundreds of MB. Every
+        # copy gets a file of its own, a concurrent get() may still be reading the last one
+        md5 = hashlib.md5(data).hexdigest()
+        path = directory / f"{hashlib.sha256(f'{bucket_name}/{file_path}'.encode()).hexdigest()}.{uuid.uuid4().hex}"
+        try:
+            path.write_bytes(data)
+        except OSError as e:
+            path.unlink(missing_ok=True)
+            logger.warning(f"Could not cache {bucket_name}/{file_path}: {e}")
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {'path': path, 'size': len(data), 'version': version, 'md5': md5}
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, bucket_name: str, file_path: str):
+        """Forget an object that was deleted or replaced"""
+        with self._lock:
+            if (bucket_name, file_path) in self._entries:
+                self._remove((bucket_name, file_path))
+
+    def _remove(self, key: tuple[str, str]):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+        entry['path'].unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            'bytes_saved': self.bytes_saved,
+        }
+
+
+blob_cache = BlobCache(
+    directory=BLOB_CACHE_DIR,
+    max_bytes=settings.BLOB_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,317 @@
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qsl
+from app.constants import IDEMPOTENCY_DB_PATH, settings
+
+logger = logging.getLogger(__name__)
+
+# Replayed in chunks of this size to the wrapped app
+BODY_CHUNK_SIZE = 64 * 1024
+
+# Request bodies up to this size are spooled in memory, larger ones go to a temporary file
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Failures a retry should run again rather than replay
+TRANSIENT_STATUS = {408, 425, 429, 499}
+
+
+class IdempotencyStore:
+    def __init__(self, path: Path, ttl: float = 24 * 3600):
+        """
+        SQLite store of responses to requests sent with an Idempotency-Key.
+
+        Survives restarts so a client retrying after a deploy still gets the
+        original response instead of a second slice.
+
+        Args:
+            path (Path): SQLite database file
+            ttl (float): Seconds a stored response is replayed
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+        # Requests currently running under a key, shared by the middleware
+        self.in_flight: dict[str, _InFlight] = {}
+        self.counts = {'stored': 0, 'replayed': 0, 'coalesced': 0, 'mismatched': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            self._connection = connection
+        return self._connection
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT fingerprint, status, headers, body, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[4] > self.ttl:
+            return None
+        return {'fingerprint': row[0], 'status': row[1], 'headers': json.loads(row[2]), 'body': row[3]}
+
+    def put(self, key: str, fingerprint: str, status: int, headers: list, body: bytes):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, fingerprint, status, json.dumps(headers), body, time.time()),
+                )
+
+    def stats(self) -> dict:
+        with self._lock:
+            stored = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            'in_flight': len(self.in_flight),
+            'stored_responses': stored,
+            'ttl_seconds': self.ttl,
+            **self.counts,
+        }
+
+
+class _InFlight:
+    """A request being handled, with the retries of it waiting for its response"""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.response: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.clients = 1
+        self.abandoned = asyncio.Event()
+
+    def detach(self):
+        self.clients -= 1
+        if self.clients <= 0:
+            self.abandoned.set()
+
+
+def _multipart_boundary(headers: dict) -> Optional[bytes]:
+    content_type = headers.get(b'content-type', b'')
+    if not content_type.startswith(b'multipart/'):
+        return None
+    for part in content_type.split(b';'):
+        name, _, value = part.strip().partition(b'=')
+        if name.lower() == b'boundary':
+            return b'--' + value.strip(b'"')
+    return None
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app, store: IdempotencyStore, paths: list[str]):
+        """
+        Honors the Idempotency-Key header on the slice and quote endpoints.
+
+        The first request with a key runs normally and its response is stored.
+        A retry with the same key and payload gets the stored response, or, while
+        the first one is still running, waits for it instead of starting another
+        slice. The running request only sees its client disconnect once every
+        client waiting for it is gone, so a mobile client that drops and retries
+        keeps its slice alive. Reusing a key for a different payload is a 422.
+
+        Keys are scoped by method, path and `user_id`. The payload fingerprint
+        covers the query string and the body, with the multipart boundary
+        removed since clients pick a new one on every attempt.
+
+        Args:
+            app: ASGI app to wrap
+            store (IdempotencyStore): Persistent store of responses
+            paths (list[str]): Paths whose POST requests honor the header
+        """
+        self.app = app
+        self.store = store
+        self.paths = set(paths)
+        self.counts = store.counts
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope['headers'])
+        idempotency_key = headers.get(b'idempotency-key', b'').decode(errors='replace').strip()
+        if not idempotency_key:
+            return await self.app(scope, receive, send)
+        if len(idempotency_key) > 255:
+            return await self._respond(send, 400, {'detail': "Idempotency-Key must be at most 255 characters"})
+
+        query = sorted(parse_qsl(scope['query_string'].decode(errors='replace')))
+        user_id = dict(query).get('user_id', '')
+        key = hashlib.sha256(f"{scope['path']}|{user_id}|{idempotency_key}".encode()).hexdigest()
+
+        body, fingerprint, on_disk = await self._read_body(receive, _multipart_boundary(headers), query)
+        if body is None:
+            # Cut off mid upload, running the app on part of the body would store
+            # its error under the key and turn the retry into a mismatch
+            return
+        try:
+            in_flight = self.store.in_flight.get(key)
+            if in_flight is not None:
+                return await self._attach(in_flight, fingerprint, receive, send)
+
+            # Registered before the first await so concurrent duplicates attach to it
+            in_flight = self.store.in_flight[key] = _InFlight(fingerprint)
+            try:
+                stored = await asyncio.to_thread(self.store.get, key)
+                if stored is None:
+                    await self._run(key, in_flight, scope, body, on_disk, receive, send)
+                    return
+
+                if stored['fingerprint'] != fingerprint:
+                    in_flight.response.set_result(None)
+                    return await self._mismatch(send)
+                self.counts['replayed'] += 1
+                in_flight.response.set_result((stored['status'], stored['headers'], stored['body']))
+                await self._replay(send, stored['status'], stored['headers'], stored['body'])
+            finally:
+                if not in_flight.response.done():
+                    in_flight.response.set_result(None)
+                del self.store.in_flight[key]
+        finally:
+            body.close()
+
+    async def _read_body(self, receive, boundary: Optional[bytes], query: list) -> tuple:
+        """
+        Spool the request body to a temporary file while fingerprinting it
+
+        Returns:
+            tuple: (body, fingerprint, whether the body is on disk), body is None
+                if the client disconnected before sending all of it
+        """
+        digest = hashlib.sha256(json.dumps(query).encode())
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        size, carry = 0, b''
+        keep = len(boundary) - 1 if boundary else 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None, None, False
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            # Past the spool size the writes hit the disk, keep them off the event loop
+            if size > SPOOL_MAX_SIZE:
+                await asyncio.to_thread(body.write, chunk)
+            else:
+                body.write(chunk)
+            if boundary:
+                data = (carry + chunk).replace(boundary, b'')
+                carry = data[len(data) - keep:] if len(data) > keep else data
+                digest.update(data[:len(data) - len(carry)])
+            else:
+                digest.update(chunk)
+            if not message.get('more_body', False):
+                break
+        digest.update(carry)
+        body.seek(0)
+        return body, digest.hexdigest(), size > SPOOL_MAX_SIZE
+
+    async def _run(self, key: str, in_flight: _InFlight, scope, body, on_disk: bool, receive, send):
+        """Run the wrapped app, then hand its response to waiting retries and the store"""
+        watcher = asyncio.ensure_future(self._watch(receive, in_flight))
+        start, chunks = {}, []
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                chunk = await asyncio.to_thread(body.read, BODY_CHUNK_SIZE) if on_disk else body.read(BODY_CHUNK_SIZE)
+                body_sent = len(chunk) < BODY_CHUNK_SIZE
+                return {'type': 'http.request', 'body': chunk, 'more_body': not body_sent}
+            # Only report a disconnect once no client is waiting for this response
+            await in_flight.abandoned.wait()
+            return {'type': 'http.disconnect'}
+
+        async def capture_send(message):
+            if message['type'] == 'http.response.start':
+                start.update(message)
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            watcher.cancel()
+
+        status = start.get('status', 500)
+        response_headers = [
+            [name.decode('latin-1'), value.decode('latin-1')] for name, value in start.get('headers', [])
+            if name.lower() not in (b'content-length', b'date', b'server')
+        ]
+        response_body = b''.join(chunks)
+        in_flight.response.set_result((status, response_headers, response_body))
+
+        if status < 500 and status not in TRANSIENT_STATUS:
+            try:
+                await asyncio.to_thread(self.store.put, key, in_flight.fingerprint, status, response_headers, response_body)
+                self.counts['stored'] += 1
+            except sqlite3.Error as e:
+                logger.warning(f"Could not store idempotent response: {e}")
+
+    async def _attach(self, in_flight: _InFlight, fingerprint: str, receive, send):
+        """Wait for the response of the request already running under this key"""
+        if in_flight.fingerprint != fingerprint:
+            return await self._mismatch(send)
+
+        self.counts['coalesced'] += 1
+        in_flight.clients += 1
+        watcher = asyncio.ensure_future(self._watch(receive, in_flight))
+        try:
+            response = await asyncio.shield(in_flight.response)
+        finally:
+            watcher.cancel()
+
+        if response is None:
+            return await self._respond(send, 500, {'detail': "The original request with this Idempotency-Key failed, please retry"})
+        await self._replay(send, *response)
+
+    async def _watch(self, receive, in_flight: _InFlight):
+        """Detach a client from the in-flight request once it disconnects"""
+        try:
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+        except asyncio.CancelledError:
+            return
+        in_flight.detach()
+
+    async def _mismatch(self, send):
+        self.counts['mismatched'] += 1
+        await self._respond(send, 422, {'detail': "Idempotency-Key was already used for a different request"})
+
+    async def _replay(self, send, status: int, headers: list, body: bytes, replayed: bool = True):
+        raw_headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        raw_headers.append((b'content-length', str(len(body)).encode()))
+        if replayed:
+            raw_headers.append((b'idempotent-replayed', b'true'))
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _respond(self, send, status: int, content: dict):
+        await self._replay(send, status, [['content-type', 'application/json']], json.dumps(content).encode(), replayed=False)
+
+
+idempotency_store = IdempotencyStore(
+    path=IDEMPOTENCY_DB_PATH,
+    ttl=settings.IDEMPOTENCY_TTL_SECONDS,
+)
@@ -0,0 +1,264 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter, deque
+from typing import Optional
+from app.constants import settings
+from app.services.profiling import collapsed_stack
+from app.services.tracing import request_id_var
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the lag and stall histogram buckets, in milliseconds
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Route of stalls that happened outside any request, e.g. in a startup task
+NO_ROUTE = '<no request>'
+
+
+def _histogram() -> list[int]:
+    return [0] * (len(BUCKETS_MS) + 1)
+
+
+def _observe(histogram: list[int], value_ms: float):
+    histogram[bisect_left(BUCKETS_MS, value_ms)] += 1
+
+
+def _buckets(histogram: list[int]) -> dict:
+    """Cumulative counts per bucket upper bound, like a Prometheus histogram"""
+    total, buckets = 0, {}
+    for bound, count in zip((*BUCKETS_MS, '+Inf'), histogram):
+        total += count
+        buckets[str(bound)] = total
+    return buckets
+
+
+class _Stall:
+    """A stall in progress, filled in by the watchdog and closed by the heartbeat"""
+
+    def __init__(self, route: str, request_id: Optional[str], started_at: float):
+        self.route = route
+        self.request_id = request_id
+        self.started_at = started_at
+        self.stacks: Counter[str] = Counter()
+
+
+class LoopLagMonitor:
+    def __init__(
+        self,
+        enabled: bool = True,
+        interval_ms: float = 50.0,
+        stall_ms: float = 100.0,
+        max_stalls: int = 100,
+    ):
+        """
+        Measures event loop lag and attributes stalls to the route and stack that caused them.
+
+        A heartbeat task sleeps `interval_ms` on the loop and records how late
+        it wakes up, which is how long every other request waited for the loop.
+        A watchdog thread checks the heartbeat; once it is half `stall_ms` overdue it
+        samples the loop thread's stack and notes the route of the request task
+        running, until the loop comes back. Lag and stall durations are kept in
+        histograms, stalls also per route, and the last `max_stalls` stalls are
+        kept with their stacks.
+
+        Args:
+            enabled (bool): Start the heartbeat and watchdog with the app
+            interval_ms (float): Milliseconds between heartbeats
+            stall_ms (float): Lag from which the loop counts as stalled
+            max_stalls (int): Number of stalls kept with their stacks
+        """
+        self.enabled = enabled
+        self.interval_ms = interval_ms
+        self.stall_ms = stall_ms
+        self.stalls: deque[dict] = deque(maxlen=max_stalls)
+
+        self.lag_histogram = _histogram()
+        self.lag_seconds = 0.0
+        self.stall_histograms: dict[str, list[int]] = {}
+        self.stall_seconds: Counter[str] = Counter()
+        self.max_lag_ms = 0.0
+        self.beats = 0
+
+        self._routes: dict[asyncio.Task, dict] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat_due: Optional[float] = None
+        self._stall: Optional[_Stall] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> Optional[asyncio.Task]:
+        """Start the heartbeat on `loop` and the watchdog thread, call from the loop"""
+        if not self.enabled:
+            return None
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True)
+            self._watchdog.start()
+        return loop.create_task(self._heartbeat())
+
+    def track(self, scope: dict) -> Optional[asyncio.Task]:
+        """Remember which request the current task serves"""
+        task = asyncio.current_task()
+        if task is not None:
+            self._routes[task] = {'scope': scope, 'request_id': request_id_var.get()}
+        return task
+
+    def untrack(self, task: Optional[asyncio.Task]):
+        self._routes.pop(task, None)
+
+    def _route(self, task: Optional[asyncio.Task]) -> tuple[str, Optional[str]]:
+        entry = self._routes.get(task)
+        if entry is None:
+            return NO_ROUTE, None
+        scope = entry['scope']
+        # The router stores the matched route in the scope, its template groups stalls per endpoint
+        route = scope.get('route')
+        return f"{scope['method']} {getattr(route, 'path', scope['path'])}", entry['request_id']
+
+    async def _heartbeat(self):
+        interval = self.interval_ms / 1000
+        try:
+            while True:
+                self._beat_due = time.perf_counter() + interval
+                await asyncio.sleep(interval)
+                lag_ms = max((time.perf_counter() - self._beat_due) * 1000, 0.0)
+                self._record(lag_ms)
+        finally:
+            # Stopped with the app, nothing is overdue anymore
+            self._beat_due = None
+
+    def _record(self, lag_ms: float):
+        with self._lock:
+            stall, self._stall = self._stall, None
+        self.beats += 1
+        _observe(self.lag_histogram, lag_ms)
+        self.lag_seconds += lag_ms / 1000
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        if lag_ms < self.stall_ms:
+            return
+
+        route, request_id = (stall.route, stall.request_id) if stall is not None else (NO_ROUTE, None)
+        histogram = self.stall_histograms.setdefault(route, _histogram())
+        _observe(histogram, lag_ms)
+        self.stall_seconds[route] += lag_ms / 1000
+        stacks = stall.stacks.most_common() if stall is not None else []
+        self.stalls.append({
+            'route': route,
+            'request_id': request_id,
+            'started_at': stall.started_at if stall is not None else time.time() - lag_ms / 1000,
+            'lag_ms': round(lag_ms, 1),
+            'stack': stacks[0][0] if stacks else None,
+            'stacks': dict(stacks),
+        })
+        top = stacks[0][0].rsplit(';', 1)[-1] if stacks else 'unknown'
+        logger.warning(f"Event loop stalled {lag_ms:.0f}ms in {route} at {top}")
+
+    def _watch(self):
+        while True:
+            time.sleep(min(self.interval_ms, self.stall_ms) / 4000)
+            due = self._beat_due
+            # Sampling from half the threshold catches short stalls before they end,
+            # only those that reach it are recorded
+            if due is None or (time.perf_counter() - due) * 1000 < self.stall_ms / 2:
+                continue
+            try:
+                self._sample(overdue=time.perf_counter() - due)
+            except Exception as e:
+                logger.warning(f"Loop lag sample failed: {e}")
+
+    def _sample(self, overdue: float):
+        """Sample the blocked loop thread, it can't run anything else until the call returns"""
+        frame = sys._current_frames().get(self._loop_thread)
+        with self._lock:
+            if self._stall is None:
+                route, request_id = self._route(asyncio.current_task(self._loop))
+                self._stall = _Stall(route, request_id, started_at=time.time() - overdue)
+            if frame is not None:
+                self._stall.stacks[collapsed_stack(frame, 'event-loop')] += 1
+
+    def stats(self) -> dict:
+        routes = sorted(self.stall_seconds, key=self.stall_seconds.get, reverse=True)
+        return {
+            'enabled': self.enabled,
+            'interval_ms': self.interval_ms,
+            'stall_ms': self.stall_ms,
+            'beats': self.beats,
+            'max_lag_ms': round(self.max_lag_ms, 1),
+            'lag_ms_buckets': _buckets(self.lag_histogram),
+            'stalls': sum(sum(histogram) for histogram in self.stall_histograms.values()),
+            'routes': [
+                {
+                    'route': route,
+                    'stalls': sum(self.stall_histograms[route]),
+                    'stalled_seconds': round(self.stall_seconds[route], 3),
+                    'stall_ms_buckets': _buckets(self.stall_histograms[route]),
+                }
+                for route in routes
+            ],
+            'recent': [{key: stall[key] for key in ('route', 'request_id', 'started_at', 'lag_ms', 'stack')} for stall in reversed(self.stalls)],
+        }
+
+    def prometheus(self) -> str:
+        """Lag and per route stall histograms in the Prometheus text format"""
+        lines = [
+            '# HELP event_loop_lag_seconds Delay of the event loop heartbeat',
+            '# TYPE event_loop_lag_seconds histogram',
+            *self._prometheus_histogram('event_loop_lag_seconds', self.lag_histogram, self.lag_seconds),
+            '# HELP event_loop_stall_seconds Event loop stalls by the route that blocked the loop',
+            '# TYPE event_loop_stall_seconds histogram',
+        ]
+        for route, histogram in self.stall_histograms.items():
+            label = route.replace('\\', '\\\\').replace('"', '\\"')
+            lines += self._prometheus_histogram(
+                'event_loop_stall_seconds', histogram, self.stall_seconds[route], f'route="{label}"'
+            )
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _prometheus_histogram(name: str, histogram: list[int], total: float, labels: str = '') -> list[str]:
+        separator = ',' if labels else ''
+        lines = []
+        for bound, count in _buckets(histogram).items():
+            le = bound if bound == '+Inf' else f"{int(bound) / 1000:g}"
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{le}"}} {count}')
+        suffix = f"{{{labels}}}" if labels else ''
+        lines.append(f"{name}_sum{suffix} {total:g}")
+        lines.append(f"{name}_count{suffix} {sum(histogram)}")
+        return lines
+
+
+class LoopLagMiddleware:
+    def __init__(self, app, monitor: LoopLagMonitor):
+        """
+        Tells the loop lag monitor which route each request task serves.
+
+        Args:
+            app: ASGI app to wrap
+            monitor (LoopLagMonitor): Monitor stalls are attributed by
+        """
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if not self.monitor.enabled or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        task = self.monitor.track(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.untrack(task)
+
+
+loop_monitor = LoopLagMonitor(
+    enabled=settings.LOOP_MONITOR_ENABLED,
+    interval_ms=settings.LOOP_MONITOR_INTERVAL_MS,
+    stall_ms=settings.LOOP_STALL_THRESHOLD_MS,
+    max_stalls=settings.LOOP_MONITOR_MAX_STALLS,
+)
@@ -1,7 +1,17 @@
 import json
+import hashlib
+from functools import lru_cache
+import logging
 from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException
 from app.schemas.responses import PrinterConfig
-from app.constants import LOCAL_DIR
+from app.constants import LOCAL_DIR, BUCKET_FILES
+from app.db.supabase_handler import download_file, download_file_windows, get_file_info
+from app.services.blob_cache import etag_digest
+from app.utils.gcode_metadata import HEAD_WINDOW, TAIL_WINDOW, SIDECAR_VERSION, sidecar_path, parse_print_details
+
+logger = logging.getLogger(__name__)
 
 FILAMENT_PROFILES = {
     "PLA": {
@@ -55,6 +65,26 @@ SPEED_RATIOS = {
     'first_layer_speed': 0.5
 }
 
+# PrinterConfig fields that don't change the toolpath, see the field declarations
+TOOLPATH_INVARIANT_FIELDS = {
+    name for name, field in PrinterConfig.model_fields.items()
+    if isinstance(field.json_schema_extra, dict) and field.json_schema_extra.get('toolpath') is False
+}
+
+def toolpath_signature(printer_config: PrinterConfig) -> str:
+    """Hash of the PrinterConfig fields that affect the toolpath"""
+    config = printer_config.model_dump_json(exclude=TOOLPATH_INVARIANT_FIELDS)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+def temperature_settings(printer_config: PrinterConfig) -> dict:
+    """Temperatures written to the slicer config, including the derived first layer ones"""
+    return {
+        'temperature': printer_config.temperature,
+        'first_layer_temperature': round(printer_config.temperature * 1.05),
+        'bed_temperature': printer_config.bed_temperature,
+        'first_layer_bed_temperature': round(printer_config.bed_temperature * 1.25),
+    }
+
 def get_filament_profile_section(filament_type):
     """Generate a filament profile section for the INI file based on filament type."""
     if filament_type not in FILAMENT_PROFILES:
@@ -67,31 +97,87 @@ def get_filament_profile_section(filament_type):
     
     return section
 
+DEFAULT_CONFIG_PATH = Path("./app/services/configs/default_config.json")
+
+
+@lru_cache()
+def load_default_config() -> dict:
+    """Slicer settings every profile starts from, read once per process"""
+    if not DEFAULT_CONFIG_PATH.exists():
+        raise FileNotFoundError(f"Default configuration file not found at: {DEFAULT_CONFIG_PATH}")
+
+    with open(DEFAULT_CONFIG_PATH, 'r') as f:
+        return json.loads(f.read())
+
+
+def printer_config_from_ini(config_string: str) -> PrinterConfig:
+    """
+    Recover the PrinterConfig a slicer .ini was created from
+
+    Only the fields create_ini_config writes are read back, acceleration, jerk,
+    auto_support and slice_timeout keep their defaults.
+
+    Args:
+        config_string (str): Contents of an .ini written by create_ini_config
+
+    Returns:
+        PrinterConfig: The configuration found in the file
+    """
+    config_dict = {}
+    for line in config_string.splitlines():
+        key, separator, value = line.partition('=')
+        if separator:
+            config_dict[key.strip()] = value.strip()
+
+    fields = {}
+    for key, value in config_dict.items():
+        if key == 'bed_shape':
+            corners = [corner.split('x') for corner in value.split(',')]
+            fields['bed_size_x'] = round(max(float(x) for x, _ in corners))
+            fields['bed_size_y'] = round(max(float(y) for _, y in corners))
+
+        elif key == 'max_print_height':
+            fields['bed_size_z'] = round(float(value))
+
+        elif key == 'default_speed':
+            fields['print_speed'] = round(float(value))
+
+        elif key == 'infill_density':
+            fields['fill_density'] = round(float(value.rstrip('%')))
+
+        elif key == 'support_material':
+            fields['support_material'] = value == '1'
+
+        elif key in PrinterConfig.model_fields:
+            fields[key] = value
+
+    return PrinterConfig.model_validate(fields)
+
 def create_ini_config(
         user_id: str,
         stl_file_path: str,
         printer_config: PrinterConfig,
+        model_path: Optional[Path] = None,
+        overhang: Optional[dict] = None,
+        work_dir: Optional[Path] = None,
     ):
     """
-    Create a configuration .ini file for the slicer.
+    Create a configuration .ini file for the slicer. Parses the model with
+    auto support, call it from a worker thread.
     
     Args:
         user_id (str): User ID for the print job
         stl_file_path (str): Path to the STL file
         printer_config (PrinterConfig): Configuration settings for the printer
+        model_path (Path, optional): Local STL to analyze when printer_config.auto_support is set
+        overhang (dict, optional): Overhang analysis of the model already run, used instead of analyzing model_path
+        work_dir (Path, optional): Directory the file is written to, the user's local directory by default
         
     Returns:
-        str: The path to the created configuration file
+        dict: The path to the created configuration file, whether supports are
+            enabled and the overhang analysis if one was run
     """
-    default_config_path = Path("./app/services/configs/default_config.json")
-    
-    if not default_config_path.exists():
-        raise FileNotFoundError(f"Default configuration file not found at: {default_config_path}")
-
-    with open(default_config_path, 'r') as f:
-        config_content = f.read()
-    
-    config_dict = json.loads(config_content)
+    config_dict = dict(load_default_config())
     config_dict['bed_shape'] = f"0x0,{printer_config.bed_size_x}x0,{printer_config.bed_size_x}x{printer_config.bed_size_y},0x{printer_config.bed_size_y}"
     
     for key, value in dict(printer_config).items():
@@ -104,8 +190,7 @@ def create_ini_config(
 
         elif key == 'filament_type':
             config_dict.update(FILAMENT_PROFILES[value])
-            config_dict['first_layer_temperature'] = round(printer_config.temperature * 1.05)
-            config_dict['first_layer_bed_temperature'] = round(printer_config.bed_temperature * 1.25)
+            config_dict.update(temperature_settings(printer_config))
         
         elif key == 'support_material':
             config_dict['support_material'] = '1' if value else '0'
@@ -116,6 +201,19 @@ def create_ini_config(
         elif key in config_dict:
             config_dict[key] = value
 
+    # Decide supports from the model's overhangs instead of trusting the guess
+    if not printer_config.auto_support:
+        overhang = None
+    elif overhang is None and model_path is not None:
+        from app.utils.mesh_analysis import load_triangles, analyze_overhangs
+
+        overhang = analyze_overhangs(
+            triangles=load_triangles(model_path),
+            overhang_threshold=printer_config.support_material_threshold,
+        )
+    if overhang is not None:
+        config_dict['support_material'] = '1' if overhang['needs_support'] else '0'
+        logger.info(f"Auto support for {model_path}: {overhang['overhang_area']:.1f} mm^2 overhang, support_material = {config_dict['support_material']}")
     
     # Convert the updated dictionary back to a string for the INI file
     config_string = ""
@@ -125,7 +223,7 @@ def create_ini_config(
     file_path_parts = stl_file_path.split('/')
     output_name = file_path_parts[-1].rsplit('.', 1)[0] + '.ini'
 
-    job_output_dir = Path(LOCAL_DIR / user_id)
+    job_output_dir = Path(work_dir or LOCAL_DIR / user_id)
     job_output_dir.mkdir(parents=True, exist_ok=True)
     
     # Write the modified configuration to a new file in the user's job output directory
@@ -133,5 +231,49 @@ def create_ini_config(
         f.write(config_string)
     
     return {
-        'output_dir' : job_output_dir / output_name
-    }
\ No newline at end of file
+        'output_dir' : job_output_dir / output_name,
+        'support_material': config_dict['support_material'] == '1',
+        'overhang': overhang,
+    }
+
+def stored_print_details(gcode_path: str) -> dict:
+    """
+    Print details of a stored G-code without downloading all of it.
+
+    Reads the metadata sidecar uploaded with the G-code when its MD5 matches
+    the G-code's ETag, otherwise parses ranged reads of the G-code's head and
+    tail. The estimates are None when neither has them and the G-code has to
+    be simulated.
+
+    Args:
+        gcode_path (str): Path of the G-code in the bucket
+
+    Returns:
+        dict: Print details as from `get_print_details`, with 'source' set to
+            'sidecar', 'range' or 'download' when ranged reads failed
+
+    Raises:
+        HTTPException: 404 when the G-code does not exist
+    """
+    try:
+        sidecar = json.loads(download_file(bucket_name=BUCKET_FILES, file_path=sidecar_path(gcode_path))['data'])
+    except (HTTPException, ValueError):
+        sidecar = None
+
+    if sidecar is not None and sidecar.get('version') == SIDECAR_VERSION:
+        info = get_file_info(BUCKET_FILES, gcode_path)
+        # A G-code replaced without its sidecar must not be quoted from the old one
+        if info and etag_digest(info.get('etag')) == sidecar.get('gcode_md5'):
+            return {**sidecar, 'source': 'sidecar'}
+        logger.info(f"Metadata sidecar of {gcode_path} does not match the G-code, reading its head and tail")
+
+    try:
+        head, tail = download_file_windows(BUCKET_FILES, gcode_path, head_size=HEAD_WINDOW, tail_size=TAIL_WINDOW)
+        source = 'range'
+    except HTTPException:
+        # Ranged reads are an optimization, the full download still quotes and tells a missing G-code apart
+        logger.warning(f"Ranged read of {gcode_path} failed, downloading all of it")
+        content = download_file(bucket_name=BUCKET_FILES, file_path=gcode_path)['data']
+        head, tail = content[:HEAD_WINDOW], content[max(len(content) - TAIL_WINDOW, HEAD_WINDOW):]
+        source = 'download'
+    return {**parse_print_details(head, tail), 'source': source}
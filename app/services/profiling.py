@@ -0,0 +1,288 @@
+import sys
+import time
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Optional
+from app.constants import settings
+from app.services.tracing import request_id_var
+
+logger = logging.getLogger(__name__)
+
+# Frames kept per sampled stack, the innermost ones
+MAX_STACK_DEPTH = 64
+
+# Pseudo frame for samples where the request was neither on the loop nor in a worker thread
+AWAITING = '<awaiting>'
+
+_session_var: ContextVar[Optional['ProfileSession']] = ContextVar('profile_session', default=None)
+
+
+class ProfileSession:
+    """Stack samples and child processes of one request while it runs"""
+
+    def __init__(self, method: str, path: str, task: asyncio.Task, loop: asyncio.AbstractEventLoop):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.request_id = request_id_var.get()
+        self.task = task
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.process_cpu_start = time.process_time()
+        self.stacks: Counter[str] = Counter()
+        self.loop_samples = 0
+        self.thread_samples = 0
+        self.awaiting_samples = 0
+        self.children: list[dict] = []
+        self.status_code: Optional[int] = None
+
+
+def collapsed_stack(frame, threads: str) -> str:
+    """A frame and its callers in collapsed-stack form, outermost first"""
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        frames.append(f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}:{frame.f_lineno}")
+        frame = frame.f_back
+    frames.append(threads)
+    return ';'.join(reversed(frames))
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        enabled: bool = False,
+        threshold_ms: float = 2000.0,
+        sample_rate: float = 0.0,
+        interval_ms: float = 5.0,
+        max_profiles: int = 50,
+    ):
+        """
+        Statistical profiler for slow requests, switched on and off at runtime.
+
+        While enabled, a sampler thread records the Python stack of every
+        request every `interval_ms`: the event loop's stack when the request's
+        task is the one running, and the stacks of worker threads running
+        `asyncio.to_thread` calls made by it. Requests slower than
+        `threshold_ms`, plus a `sample_rate` fraction of all requests, are kept
+        in a rolling set of `max_profiles` profiles together with the wall
+        time, CPU time and peak RSS of the slicer processes they ran.
+
+        When disabled the middleware costs a single attribute check per request.
+
+        Args:
+            enabled (bool): Profile requests
+            threshold_ms (float): Requests at least this slow are kept
+            sample_rate (float): Fraction of all requests kept regardless of latency
+            interval_ms (float): Milliseconds between stack samples
+            max_profiles (int): Number of profiles kept
+        """
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.interval_ms = interval_ms
+        self.profiles: deque[dict] = deque(maxlen=max_profiles)
+
+        self._sessions: dict[asyncio.Task, ProfileSession] = {}
+        self._thread_sessions: dict[int, ProfileSession] = {}
+        self._sampler: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.profiled = 0
+        self.kept = 0
+        self.samples = 0
+
+    def configure(self, **options):
+        """Change the profiler's settings, e.g. from the admin endpoint"""
+        for name, value in options.items():
+            if value is not None:
+                setattr(self, name, value)
+        if self.enabled:
+            self._start_sampler()
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        """Use a default executor that tells the sampler which request a worker thread runs for"""
+        loop.set_default_executor(_ProfilingExecutor(self))
+        if self.enabled:
+            self._start_sampler()
+
+    def begin(self, method: str, path: str) -> Optional[ProfileSession]:
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        session = ProfileSession(method, path, task, asyncio.get_running_loop())
+        with self._lock:
+            self._sessions[task] = session
+        self.profiled += 1
+        return session
+
+    def end(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.pop(session.task, None)
+
+        duration_ms = (time.perf_counter() - session.start) * 1000
+        slow = duration_ms >= self.threshold_ms
+        if not slow and random.random() >= self.sample_rate:
+            return
+
+        self.kept += 1
+        self.profiles.append({
+            'id': session.id,
+            'request_id': session.request_id,
+            'method': session.method,
+            'path': session.path,
+            'status_code': session.status_code,
+            'reason': 'slow' if slow else 'sampled',
+            'started_at': session.started_at,
+            'duration_ms': round(duration_ms, 2),
+            # Covers every thread of the API process, concurrent requests included
+            'process_cpu_seconds': round(time.process_time() - session.process_cpu_start, 4),
+            'interval_ms': self.interval_ms,
+            'samples': {
+                'event_loop': session.loop_samples,
+                'worker_threads': session.thread_samples,
+                'awaiting': session.awaiting_samples,
+            },
+            'stacks': dict(session.stacks.most_common()),
+            'child_processes': session.children,
+        })
+
+    def run_in_thread(self, session: ProfileSession, func, *args, **kwargs):
+        """Run a worker thread call, attributing its samples to `session`"""
+        ident = threading.get_ident()
+        self._thread_sessions[ident] = session
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._thread_sessions.pop(ident, None)
+
+    def _start_sampler(self):
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample_forever, name='request-profiler', daemon=True)
+            self._sampler.start()
+
+    def _sample_forever(self):
+        while self.enabled:
+            time.sleep(self.interval_ms / 1000)
+            try:
+                self._sample()
+            except Exception as e:
+                logger.warning(f"Profiler sample failed: {e}")
+
+    def _sample(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        if not sessions:
+            return
+
+        frames = sys._current_frames()
+        self.samples += 1
+        sampled = set()
+
+        for ident, session in list(self._thread_sessions.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                session.stacks[collapsed_stack(frame, 'worker-thread')] += 1
+                session.thread_samples += 1
+                sampled.add(session.id)
+
+        running = {}
+        for session in sessions:
+            if session.loop not in running:
+                running[session.loop] = asyncio.current_task(session.loop)
+            if running[session.loop] is session.task:
+                frame = frames.get(session.loop_thread)
+                if frame is not None:
+                    session.stacks[collapsed_stack(frame, 'event-loop')] += 1
+                    session.loop_samples += 1
+                    sampled.add(session.id)
+            if session.id not in sampled:
+                session.stacks[AWAITING] += 1
+                session.awaiting_samples += 1
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'threshold_ms': self.threshold_ms,
+            'sample_rate': self.sample_rate,
+            'interval_ms': self.interval_ms,
+            'in_flight': len(self._sessions),
+            'profiled_requests': self.profiled,
+            'kept_profiles': self.kept,
+            'stored_profiles': len(self.profiles),
+            'max_profiles': self.profiles.maxlen,
+            'samples': self.samples,
+        }
+
+
+class _ProfilingExecutor(ThreadPoolExecutor):
+    """Default executor recording which profiled request each call was submitted by"""
+
+    def __init__(self, profiler: RequestProfiler):
+        super().__init__(thread_name_prefix='asyncio')
+        self.profiler = profiler
+
+    def submit(self, fn, /, *args, **kwargs):
+        session = _session_var.get()
+        if session is None:
+            return super().submit(fn, *args, **kwargs)
+        return super().submit(self.profiler.run_in_thread, session, fn, *args, **kwargs)
+
+
+def record_child_process(name: str, **usage):
+    """Attach the resource usage of a child process to the request being profiled, if any"""
+    session = _session_var.get()
+    if session is not None:
+        session.children.append({'name': name, **usage})
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: RequestProfiler, exclude: tuple[str, ...] = ()):
+        """
+        Profiles requests while the profiler is enabled.
+
+        Args:
+            app: ASGI app to wrap
+            profiler (RequestProfiler): Profiler sessions are recorded by
+            exclude (tuple[str, ...]): Path prefixes never profiled
+        """
+        self.app = app
+        self.profiler = profiler
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.enabled or scope['type'] != 'http' or scope['path'].startswith(self.exclude):
+            return await self.app(scope, receive, send)
+
+        session = self.profiler.begin(scope['method'], scope['path'])
+        if session is None:
+            return await self.app(scope, receive, send)
+
+        async def profiled_send(message):
+            if message['type'] == 'http.response.start':
+                session.status_code = message['status']
+            await send(message)
+
+        token = _session_var.set(session)
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            _session_var.reset(token)
+            self.profiler.end(session)
+
+
+profiler = RequestProfiler(
+    enabled=settings.PROFILING_ENABLED,
+    threshold_ms=settings.PROFILING_THRESHOLD_MS,
+    sample_rate=settings.PROFILING_SAMPLE_RATE,
+    interval_ms=settings.PROFILING_INTERVAL_MS,
+    max_profiles=settings.PROFILING_MAX_PROFILES,
+)
@@ -4,10 +4,13 @@ import logging
 from pathlib import Path
 from app.utils.utilities import (
     fancy_shell,
-    get_prusa_print_details,
     time_str_to_seconds,
+    seconds_to_time_str,
     check_printability
 )
+from app.utils.gcode_metadata import get_print_details
+from app.services.tracing import subprocess_env
+from app.services.worker_queue import worker_queue
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +59,9 @@ class PrusaSlicer:
             self,
             stl_file_path : Path = None,
             output_gcode_path : Path = './app/db/temp',
+            job=None,
+            local: bool = False,
+            env: dict = None,
             **override_params
         ):
         """
@@ -64,6 +70,9 @@ class PrusaSlicer:
         Args:
             stl_file_path (str): Path to the STL file
             output_gcode_path (str, optional): Path for output G-code file. Defaults to None.
+            job (SliceJob, optional): Scheduler job that tracks the slicer process
+            local (bool, optional): Run PrusaSlicer here even when a worker queue is configured
+            env (dict, optional): Slicer environment, defaults to the current request's
             **override_params: Any parameters to override for this specific slicing operation
             
         Returns:
@@ -76,12 +85,30 @@ class PrusaSlicer:
         params = {param: value for param, value in self.__dict__.items() if param in self.param_flags}
         params.update(override_params)
         
-        # Add output path
-        command += f" --output {output_gcode_path}"
-        
         # Use object STL file path if not provided
         if stl_file_path is None:
             stl_file_path = self.stl_file_path
+
+        if env is None:
+            env = subprocess_env()
+
+        if worker_queue is not None and not local:
+            # Slicer workers run PrusaSlicer, this process only waits for the G-code
+            return worker_queue.run_slice(
+                stl_file_path,
+                params.get('config_path'),
+                output_gcode_path,
+                job,
+                env=env,
+                params={param: value for param, value in params.items() if param in self.param_flags and param != 'config_path'},
+            )
+
+        # Add output path
+        command += f" --output {output_gcode_path}"
+
+        # Thread budget the scheduler gave this job
+        if job is not None and job.threads:
+            command += f" --threads {job.threads}"
             
         # Add parameters to command
         for param, value in params.items():
@@ -96,40 +123,86 @@ class PrusaSlicer:
         command += f' "{stl_file_path}"'
         
         try:
-            # Execute PrusaSlicer
-            fancy_shell(command)
+            # Execute PrusaSlicer, its environment carries the request ID and trace
+            fancy_shell(command, job=job, env=env)
+            if job is not None:
+                job.output_bytes = os.path.getsize(output_gcode_path)
             logger.info(f"Slicing completed successfully for {stl_file_path}")
             return True
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logger.info(f"Slicing failed: {e}")
-            logger.error(f"Error output: {e.stderr}")
+            logger.error(f"Error output: {getattr(e, 'stderr', None)}")
             return False
 
+    def price(self, time_seconds: float, weight: float) -> float:
+        """
+        Price of a print from its duration and filament weight
+        
+        Args:
+            time_seconds (float): Print time in seconds
+            weight (float): Filament weight in grams
+            
+        Returns:
+            float: Total price rounded to cents
+        """
+        return round((self.base_price + (time_seconds / 3600) * self.cost_per_hour + (weight * self.cost_per_gram)), 2)
+
     def quote_price_basic(
             self,
-            gcode_file_path: Path = None
+            gcode_file_path: Path = None,
+            acceleration: float = 1000.0,
+            jerk: float = 8.0,
         ) -> dict:
         """
         Quote the price of the print based on G-code file
         
         Args:
             gcode_file_path (str): Path to the G-code file
+            acceleration (float): Printer acceleration in mm/s^2, used when the G-code has no time estimate
+            jerk (float): Printer jerk in mm/s, used when the G-code has no time estimate
             
         Returns:
-            float: Estimated price of the print
+            dict: Quote as from `quote`, with 'time_source' 'slicer' or 'simulation'
+                when the time was simulated with `acceleration` and `jerk`
         """
         if gcode_file_path is None:
             gcode_file_path = self.stl_file_path.with_suffix('.gcode')
 
-        details = get_prusa_print_details(gcode_file_path=gcode_file_path)
+        details = get_print_details(gcode_file_path=gcode_file_path)
+        time_source = 'slicer' if details['estimated_time'] is not None else 'simulation'
+
+        if details['estimated_time'] is None or details['filament_weight'] is None:
+            # Custom G-code or another slicer, simulate the moves instead
+            logger.info(f"No slicer estimate in {gcode_file_path}, estimating from the toolpath")
+            from app.utils.gcode_analysis import estimate_print_time
+
+            estimate = estimate_print_time(
+                gcode_file_path=gcode_file_path,
+                acceleration=acceleration,
+                jerk=jerk,
+            )
+            if details['estimated_time'] is None:
+                details['estimated_time'] = seconds_to_time_str(estimate['total_time_seconds'])
+            if details['filament_weight'] is None:
+                details['filament_weight'] = estimate['total_filament_g']
         
+        return {**self.quote(details), 'time_source': time_source}
+
+    def quote(self, details: dict) -> dict:
+        """
+        Quote a print from its estimated time and filament weight
+        
+        Args:
+            details (dict): Print details with 'estimated_time', 'filament_weight' and 'filament_cost'
+            
+        Returns:
+            dict: Price, currency, estimated time and filament use
+        """
         time =  time_str_to_seconds(details['estimated_time']) # Convert estimated time to seconds
         weight = float(details['filament_weight']) # weight in grams
 
-        total_price = round((self.base_price + (time / 3600) * self.cost_per_hour + (weight * self.cost_per_gram)), 2)
-
         quote = {
-            'total_price': total_price,
+            'total_price': self.price(time, weight),
             'currency': self.currency,
             'estimated_time': details['estimated_time'],
             'filament_weight': weight,
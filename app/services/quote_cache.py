@@ -0,0 +1,86 @@
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+from app.constants import settings
+from app.schemas.responses import PrinterConfig
+from app.services.pro_routes_helpers import toolpath_signature
+
+
+class QuoteCache:
+    def __init__(self, max_entries: int = 2048, ttl: float = 7 * 24 * 3600):
+        """
+        LRU cache of slicing results keyed by geometry fingerprint.
+
+        Stores what the slicer produced (print time, filament use), not the
+        price, so quotes are recomputed with the profile's current pricing.
+
+        Args:
+            max_entries (int): Maximum number of cached results
+            ttl (float): Seconds a result stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(user_id: str, fingerprint: str, printer_config: PrinterConfig, height: float) -> str:
+        """
+        Cache key of a part sliced with a printer configuration
+
+        The fingerprint ignores orientation, the height of the part as it will be
+        sliced is part of the key so a part standing up doesn't reuse the quote of
+        the same part lying flat. Only toolpath affecting settings are part of
+        the key, a temperature change doesn't change time or filament use.
+        """
+        raw = f"{user_id}|{fingerprint}|{round(height, 2)}|{toolpath_signature(printer_config)}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str, printer_config: Optional[PrinterConfig] = None) -> Optional[dict]:
+        """
+        Cached result for a key
+
+        Acceleration and jerk are not part of the key, they don't change the
+        G-code. Results whose time was simulated from the toolpath record the
+        values they were simulated with and only match a `printer_config` with
+        the same ones.
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        kinematics = entry[1].get('kinematics')
+        if kinematics is not None and printer_config is not None and kinematics != [printer_config.acceleration, printer_config.jerk]:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, result: dict):
+        self._entries[key] = (time.monotonic(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+quote_cache = QuoteCache(
+    max_entries=settings.QUOTE_CACHE_MAX_ENTRIES,
+    ttl=settings.QUOTE_CACHE_TTL_SECONDS,
+)
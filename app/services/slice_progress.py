@@ -0,0 +1,218 @@
+import re
+import time
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from fastapi import HTTPException
+
+# PrusaSlicer reports progress as e.g. "45 => Making infill"
+PROGRESS_PATTERN = re.compile(r'(?<![\d.])(\d{1,3})\s*=>\s*(.+)$')
+
+TERMINAL_EVENTS = {'completed', 'failed'}
+
+
+def parse_progress_line(line: str) -> Optional[dict]:
+    """
+    Parse a line of slicer output into a progress event
+
+    Args:
+        line (str): A line of prusa-slicer output
+
+    Returns:
+        dict: {'percent': int, 'stage': str} or None if the line is not a progress line
+    """
+    match = PROGRESS_PATTERN.search(line.strip())
+    if not match:
+        return None
+
+    percent = int(match.group(1))
+    if percent > 100:
+        return None
+
+    return {'percent': percent, 'stage': match.group(2).strip()}
+
+
+class _Channel:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.events: list[dict] = []
+        self.subscribers: set[asyncio.Queue] = set()
+        self.active = False
+        self.closed_at: Optional[float] = None
+        self.updated_at = time.monotonic()
+
+
+class ProgressBroker:
+    def __init__(self, retention: float = 120.0, max_history: int = 200):
+        """
+        Fan out slicing progress events to SSE and WebSocket subscribers.
+
+        Channels are keyed by a client generated job ID and belong to the user
+        whose request or subscriber created them, other users can't subscribe.
+        Subscribers may connect before the job starts, and subscribers joining a
+        running job get its event history replayed so the final result is not
+        missed. A request reusing the job ID of a finished job starts a fresh
+        channel, and a subscriber arriving after a job finished waits for the
+        next run with its ID rather than getting the old one replayed.
+
+        Args:
+            retention (float): Seconds an unwatched channel is kept after its last event
+            max_history (int): Maximum number of events replayed to late subscribers
+        """
+        self.retention = retention
+        self.max_history = max_history
+        self._channels: dict[str, _Channel] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def publish(self, job_id: Optional[str], event: dict):
+        """Publish an event for a job, safe to call from slicer worker threads"""
+        if job_id is None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._publish, job_id, event)
+        else:
+            self._loop = loop
+            self._publish(job_id, event)
+
+    def _publish(self, job_id: str, event: dict):
+        channel = self._channels.get(job_id)
+        if channel is None or channel.closed_at is not None:
+            return
+
+        event = {'job_id': job_id, 'time': time.time(), **event}
+        channel.events.append(event)
+        del channel.events[:-self.max_history]
+        channel.updated_at = time.monotonic()
+
+        if event['event'] in TERMINAL_EVENTS:
+            channel.active = False
+            channel.closed_at = time.monotonic()
+
+        for queue in channel.subscribers:
+            queue.put_nowait(event)
+
+    def _expire(self):
+        """Drop finished or abandoned channels that nobody is listening to"""
+        now = time.monotonic()
+        for job_id, channel in list(self._channels.items()):
+            if not channel.active and not channel.subscribers and now - channel.updated_at > self.retention:
+                del self._channels[job_id]
+
+    def _open(self, job_id: str, user_id: str):
+        """
+        Start the channel of a job about to run
+
+        Raises:
+            HTTPException: 409 if another running request uses the job ID
+        """
+        self._expire()
+        channel = self._channels.get(job_id)
+        if channel is not None and channel.active:
+            raise HTTPException(status_code=409, detail="Job ID is already in use")
+
+        if channel is None or channel.closed_at is not None or channel.user_id != user_id:
+            if channel is not None and channel.closed_at is None:
+                # Waiting subscribers of another user, end their streams
+                event = {'job_id': job_id, 'time': time.time(), 'event': 'failed', 'detail': "Job not found"}
+                for queue in channel.subscribers:
+                    queue.put_nowait(event)
+            channel = self._channels[job_id] = _Channel(user_id)
+
+        channel.active = True
+        channel.updated_at = time.monotonic()
+
+    def authorize(self, job_id: str, user_id: str) -> bool:
+        """
+        Check that a user may subscribe to a job, claiming job IDs that have no channel yet
+
+        Returns:
+            bool: False if the job ID belongs to another user
+        """
+        self._expire()
+        channel = self._channels.get(job_id)
+        if channel is None:
+            self._channels[job_id] = _Channel(user_id)
+            return True
+        if channel.user_id != user_id:
+            return False
+        if channel.closed_at is not None:
+            # The last run is over, wait for the next one instead of replaying it
+            self._channels[job_id] = _Channel(user_id)
+        return True
+
+    async def subscribe(self, job_id: str, user_id: str, keepalive: float = 15.0) -> AsyncIterator[Optional[dict]]:
+        """
+        Yield the events of a job until it completes or fails.
+
+        Yields None every `keepalive` seconds without events so transports can
+        send a heartbeat and notice disconnected clients. Yields nothing if the
+        job ID belongs to another user.
+        """
+        self._loop = asyncio.get_running_loop()
+        if not self.authorize(job_id, user_id):
+            return
+        channel = self._channels[job_id]
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in channel.events:
+            queue.put_nowait(event)
+        channel.subscribers.add(queue)
+
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+
+                yield event
+                if event['event'] in TERMINAL_EVENTS:
+                    return
+        finally:
+            channel.subscribers.discard(queue)
+
+    @asynccontextmanager
+    async def track(self, job_id: Optional[str], user_id: str):
+        """
+        Publish the terminal event of a slicing request.
+
+        Yields a callable that records the successful result. Any exception
+        raised inside the block is published as a `failed` event.
+
+        Raises:
+            HTTPException: 409 if another running request uses the job ID
+        """
+        if job_id is not None:
+            self._loop = asyncio.get_running_loop()
+            self._open(job_id, user_id)
+
+        result = {}
+
+        def complete(payload: dict):
+            result.update(payload)
+
+        try:
+            yield complete
+        except Exception as e:
+            detail = getattr(e, 'detail', None) or str(e)
+            self.publish(job_id, {'event': 'failed', 'detail': detail})
+            raise
+        else:
+            self.publish(job_id, {'event': 'completed', 'percent': 100, 'result': result})
+
+
+def format_sse(event: Optional[dict]) -> str:
+    """Format an event (or a heartbeat when None) as a Server-Sent Events message"""
+    if event is None:
+        return ": keepalive\n\n"
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+progress_broker = ProgressBroker()
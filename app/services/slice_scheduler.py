@@ -0,0 +1,761 @@
+import os
+import math
+import time
+import signal
+import asyncio
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from fastapi import HTTPException, Request
+from app.constants import settings
+from app.services.slice_progress import progress_broker, parse_progress_line
+from app.services.tracing import span
+from app.services.profiling import record_child_process
+from app.services.slicer_accounting import SlicerAccounting
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SliceJob:
+    """A single unit of slicer work waiting for, or holding, a slicer slot"""
+    user_id: str
+    job_id: Optional[str] = None
+    deadline: Optional[float] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    admitted: Optional[asyncio.Future] = None
+    process: Optional[object] = None
+    cancel_reason: Optional[str] = None
+    killed_at: Optional[float] = None
+    profile: Optional[str] = None
+    spawned_at: Optional[float] = None
+    cpu_seconds: Optional[float] = None
+    user_cpu_seconds: Optional[float] = None
+    system_cpu_seconds: Optional[float] = None
+    wall_seconds: Optional[float] = None
+    peak_rss_kb: Optional[int] = None
+    output_bytes: Optional[int] = None
+    returncode: Optional[int] = None
+    triangles: Optional[int] = None
+    memory_mb: float = 0.0
+    memory_limit_mb: Optional[int] = None
+    bypassed: int = 0
+    features: Optional[list[float]] = None
+    predicted_seconds: float = 0.0
+    interactive: bool = False
+    threads: Optional[int] = None
+
+    def attach(self, process):
+        """Called from the worker thread once the slicer process has been spawned"""
+        self.process = process
+        self.spawned_at = time.monotonic()
+        if self.cancel_reason is not None:
+            # Cancelled before the process existed
+            self._terminate()
+
+    def on_line(self, line: str):
+        """Called from the worker thread for every line the slicer prints"""
+        progress = parse_progress_line(line)
+        if progress is not None:
+            progress_broker.publish(self.job_id, {'event': 'progress', **progress})
+
+    def record_exit(self, rusage, returncode: Optional[int] = None):
+        """Store the resource usage and exit code of the reaped slicer process"""
+        self.user_cpu_seconds = rusage.ru_utime
+        self.system_cpu_seconds = rusage.ru_stime
+        self.cpu_seconds = rusage.ru_utime + rusage.ru_stime
+        self.peak_rss_kb = rusage.ru_maxrss
+        if self.spawned_at is not None:
+            self.wall_seconds = time.monotonic() - self.spawned_at
+        self.returncode = returncode
+
+    def kill(self, reason: str):
+        """Kill the slicer process group, recording why"""
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+            self.killed_at = time.monotonic()
+        if self.process is not None:
+            self._terminate()
+
+    def _terminate(self):
+        process = self.process
+        if process.returncode is not None:
+            return
+        try:
+            # Slices running on a worker have no local process group
+            if os.name != 'nt' and process.pid is not None:
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class MemoryPredictor:
+    def __init__(
+        self,
+        base_mb: float = 150.0,
+        mb_per_triangle: float = 0.0015,
+        safety_factor: float = 1.25,
+        decay: float = 0.98,
+    ):
+        """
+        Predicts the peak RSS of a slicer process from the model's triangle count.
+
+        A linear model refit from the peak RSS of every finished slice, with older
+        observations decaying away. The defaults enter the fit as two pseudo
+        observations so predictions are sane before any slice has finished and
+        get replaced as real ones come in.
+
+        Args:
+            base_mb (float): Prior peak memory of an empty model in MB
+            mb_per_triangle (float): Prior memory per triangle in MB
+            safety_factor (float): Multiplier applied to predictions used for admission
+            decay (float): Weight kept by past observations on every new one
+        """
+        self.safety_factor = safety_factor
+        self.decay = decay
+        self.observations = 0
+        self._sums = [0.0] * 5  # weight, x, y, xx, xy with x in millions of triangles
+        for triangles in (0, 1_000_000):
+            self._add(triangles, base_mb + mb_per_triangle * triangles)
+
+    def _add(self, triangles: int, peak_mb: float):
+        x = triangles / 1e6
+        weight, sx, sy, sxx, sxy = (value * self.decay for value in self._sums)
+        self._sums = [weight + 1, sx + x, sy + peak_mb, sxx + x * x, sxy + x * peak_mb]
+
+    def observe(self, triangles: int, peak_mb: float):
+        """Record the peak RSS of a finished slice"""
+        self._add(triangles, peak_mb)
+        self.observations += 1
+
+    def coefficients(self) -> tuple[float, float]:
+        """(base MB, MB per million triangles) of the current fit"""
+        weight, sx, sy, sxx, sxy = self._sums
+        variance = weight * sxx - sx * sx
+        slope = max((weight * sxy - sx * sy) / variance, 0.0) if variance > 1e-12 else 0.0
+        base = max((sy - slope * sx) / weight, 0.0)
+        return base, slope
+
+    def predict(self, triangles: int, safe: bool = True) -> float:
+        """Predicted peak memory in MB, padded by the safety factor unless `safe` is False"""
+        base, slope = self.coefficients()
+        predicted = base + slope * triangles / 1e6
+        return predicted * self.safety_factor if safe else predicted
+
+
+def _solve(matrix: list[list[float]], vector: list[float]) -> list[float]:
+    """Solve a small symmetric positive definite system by Gaussian elimination"""
+    n = len(vector)
+    rows = [matrix[i][:] + [vector[i]] for i in range(n)]
+    for column in range(n):
+        pivot = max(range(column, n), key=lambda row: abs(rows[row][column]))
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, n):
+            factor = rows[row][column] / rows[column][column]
+            for k in range(column, n + 1):
+                rows[row][k] -= factor * rows[column][k]
+    solution = [0.0] * n
+    for row in reversed(range(n)):
+        solution[row] = (rows[row][n] - sum(rows[row][k] * solution[k] for k in range(row + 1, n))) / rows[row][row]
+    return solution
+
+
+class DurationPredictor:
+    # Prior weights of (intercept, triangles, bounding volume, layers, supports), a
+    # 5k triangle part of 10 cm3 and 100 layers starts at ~5s, 100k triangles at ~25s
+    PRIOR = (-0.5, 0.5, 0.2, 0.3, 0.4)
+
+    def __init__(self, prior_weight: float = 2.0, decay: float = 0.99, max_seconds: float = 3600.0):
+        """
+        Predicts how long a slice takes from the model and its settings.
+
+        log(seconds) is modelled as linear in the log of the triangle count, the
+        log of the bounding volume, the log of the layer count (height over
+        `layer_height`) and whether supports are generated. The fit is a ridge
+        regression towards `PRIOR`, refit from the wall time of every finished
+        slice with older observations decaying away, so predictions are sane
+        before the first slice and follow the machine they run on after.
+
+        Args:
+            prior_weight (float): Observations the prior is worth
+            decay (float): Weight kept by past observations on every new one
+            max_seconds (float): Upper bound of predictions
+        """
+        self.prior_weight = prior_weight
+        self.decay = decay
+        self.max_seconds = max_seconds
+        self.observations = 0
+        size = len(self.PRIOR)
+        self._xx = [[0.0] * size for _ in range(size)]
+        self._xy = [0.0] * size
+        self._errors: deque[float] = deque(maxlen=50)
+        self.weights = list(self.PRIOR)
+
+    @staticmethod
+    def features(
+        triangles: Optional[int] = None,
+        dimensions: Optional[tuple[float, float, float]] = None,
+        layer_height: Optional[float] = None,
+        support_material: Optional[bool] = None,
+    ) -> list[float]:
+        """Regression inputs of a job, typical values stand in for unknown ones"""
+        triangles = 50_000 if triangles is None else triangles
+        x, y, z = dimensions or (60.0, 60.0, 40.0)
+        layers = z / (layer_height or 0.2)
+        return [
+            1.0,
+            math.log1p(triangles / 10_000),
+            math.log1p(x * y * z / 1000),
+            math.log1p(layers),
+            1.0 if support_material else 0.0,
+        ]
+
+    def predict(self, features: list[float]) -> float:
+        """Predicted wall time of a slice in seconds"""
+        log_seconds = sum(weight * value for weight, value in zip(self.weights, features))
+        return min(math.exp(log_seconds), self.max_seconds)
+
+    def observe(self, features: list[float], seconds: float):
+        """Record the wall time of a finished slice and refit"""
+        target = math.log(max(seconds, 0.01))
+        self._errors.append(abs(target - math.log(self.predict(features))))
+        size = len(features)
+        for i in range(size):
+            self._xy[i] = self._xy[i] * self.decay + features[i] * target
+            for j in range(size):
+                self._xx[i][j] = self._xx[i][j] * self.decay + features[i] * features[j]
+        self.observations += 1
+
+        # Ridge towards the prior: (X'X + kI) w = X'y + k w0
+        matrix = [
+            [self._xx[i][j] + (self.prior_weight if i == j else 0.0) for j in range(size)]
+            for i in range(size)
+        ]
+        vector = [self._xy[i] + self.prior_weight * self.PRIOR[i] for i in range(size)]
+        self.weights = _solve(matrix, vector)
+
+    def stats(self) -> dict:
+        return {
+            'weights': [round(weight, 3) for weight in self.weights],
+            'observations': self.observations,
+            # exp of the mean absolute log error, 1.5 means predictions are off by 50% on average
+            'mean_error_factor': round(math.exp(sum(self._errors) / len(self._errors)), 2) if self._errors else None,
+        }
+
+
+class SliceScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        max_queue: int = 32,
+        max_queue_per_user: int = 8,
+        drain_window: float = 300.0,
+        poll_interval: float = 0.5,
+        memory_budget_mb: Optional[float] = None,
+        memory_limit_mb: Optional[int] = None,
+        memory_predictor: Optional[MemoryPredictor] = None,
+        max_bypass: int = 8,
+        accounting: Optional[SlicerAccounting] = None,
+        duration_predictor: Optional[DurationPredictor] = None,
+        background_weight: float = 4.0,
+        fair_share_seconds: float = 30.0,
+        aging: float = 1.0,
+        cpu_threads: int = 0,
+        seconds_per_thread: float = 10.0,
+        parallel_fraction: float = 0.8,
+    ):
+        """
+        Admission control in front of the slicer.
+
+        Queued jobs are dispatched shortest predicted job first. A job's rank
+        is its predicted slicing time, multiplied by `background_weight` for
+        background jobs (full slices) so interactive ones (instant quotes) go
+        first, plus `fair_share_seconds` for every slice its user already has
+        running so one user's burst cannot crowd out everyone else. Every second
+        spent waiting lowers the rank by `aging` seconds, so long jobs still
+        start within a bounded wait. Predictions are learned from the wall time
+        of finished slices. When the global (or per-user) queue is full, new
+        jobs are shed immediately with a 429 and a Retry-After derived from the
+        observed drain rate.
+
+        Jobs given a triangle count also reserve their predicted peak memory,
+        a job only starts while the reservations of running jobs plus its own
+        fit the memory budget. A job that doesn't fit yet lets smaller jobs of
+        other users pass, at most `max_bypass` times, then holds the queue
+        until enough memory is free. Every slicer process is capped at
+        `memory_limit_mb` so a bad prediction kills one slice, not the machine.
+
+        With `cpu_threads` set, every started job gets a slicer thread budget:
+        the threads not held by running jobs, split evenly over the free slots,
+        and no more than one per `seconds_per_thread` of predicted time, since
+        short slices are mostly startup and gain little from more threads.
+        Durations are learned normalized to one thread with Amdahl's law and
+        `parallel_fraction`, so budgets don't skew the predictions.
+
+        Args:
+            max_concurrency (int): Number of slicer processes allowed to run at once
+            max_queue (int): Maximum number of jobs waiting across all users
+            max_queue_per_user (int): Maximum number of jobs waiting for a single user
+            drain_window (float): Window in seconds used to compute the drain rate
+            poll_interval (float): Seconds between deadline and client disconnect checks
+            memory_budget_mb (float, optional): Memory all running slicer processes may use together
+            memory_limit_mb (int, optional): Hard memory limit of a single slicer process
+            memory_predictor (MemoryPredictor, optional): Predicts a job's peak memory from its triangle count
+            max_bypass (int): Times a queued job may be overtaken because it doesn't fit the memory budget
+            accounting (SlicerAccounting, optional): Records the resources every slicer process used
+            duration_predictor (DurationPredictor, optional): Predicts a job's slicing time
+            background_weight (float): Factor applied to the predicted time of background jobs
+            fair_share_seconds (float): Rank added per slice the job's user already has running
+            aging (float): Rank removed per second a job has waited
+            cpu_threads (int): Threads all slicer processes share, 0 leaves the thread count to the slicer
+            seconds_per_thread (float): Predicted slicing time per thread a job is given
+            parallel_fraction (float): Share of slicing time that parallelizes across threads
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.drain_window = drain_window
+        self.poll_interval = poll_interval
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_limit_mb = memory_limit_mb
+        self.memory_predictor = memory_predictor or MemoryPredictor()
+        self.max_bypass = max_bypass
+        self.accounting = accounting or SlicerAccounting()
+        self.duration_predictor = duration_predictor or DurationPredictor()
+        self.background_weight = background_weight
+        self.fair_share_seconds = fair_share_seconds
+        self.aging = aging
+        self.cpu_threads = cpu_threads
+        self.seconds_per_thread = seconds_per_thread
+        self.parallel_fraction = parallel_fraction
+        self._threads_reserved = 0
+        self._running_by_user: Counter[str] = Counter()
+        self._predictions: deque[tuple[float, float, bool]] = deque(maxlen=20)
+        self._memory_reserved = 0.0
+        self._peak_rss_mb: deque[tuple[int, float, float]] = deque(maxlen=20)
+
+        self._queues: dict[str, deque[SliceJob]] = {}
+        self._running = 0
+        self._queued = 0
+        self._completions: deque[float] = deque()
+        self._service_times: deque[float] = deque(maxlen=50)
+
+        self.shed_counts = {'queue_full': 0, 'user_queue_full': 0}
+        self.completed = 0
+        self.killed_counts = {'deadline': 0, 'disconnect': 0}
+        self.expired_in_queue = 0
+        self.killed_cpu_seconds = 0.0
+        self.predicted_cpu_seconds_saved = 0.0
+        self.rejected_memory = 0
+
+    async def run(
+        self,
+        user_id: str,
+        func: Callable,
+        *args,
+        deadline: Optional[float] = None,
+        request: Optional[Request] = None,
+        job_id: Optional[str] = None,
+        triangles: Optional[int] = None,
+        profile: Optional[str] = None,
+        dimensions: Optional[tuple[float, float, float]] = None,
+        layer_height: Optional[float] = None,
+        support_material: Optional[bool] = None,
+        interactive: bool = False,
+        **kwargs
+    ):
+        """
+        Wait for a slicer slot and run `func` in a worker thread.
+
+        `func` receives the job as its `job` keyword argument so the slicer
+        process can be attached to it and killed when the deadline expires or
+        the HTTP client disconnects.
+
+        Args:
+            user_id (str): User the job is queued under
+            func (Callable): Slicing function to run, e.g. PrusaSlicer.slice
+            deadline (float, optional): Seconds the request may spend queued and slicing
+            request (Request, optional): Request to watch for client disconnects
+            job_id (str, optional): Progress channel the job's events are published to
+            triangles (int, optional): Triangle count of the model, used to reserve memory
+            profile (str, optional): Printer profile the job slices with as `user_id/profile_name`, for resource accounting
+            dimensions (tuple, optional): Bounding box of the model in mm, used to predict slicing time
+            layer_height (float, optional): Layer height in mm, used to predict slicing time
+            support_material (bool, optional): Whether supports are generated, used to predict slicing time
+            interactive (bool): A user is waiting on the result, ranked ahead of background jobs
+
+        Raises:
+            HTTPException: 429 when the job is shed by admission control, 413 when
+                the model is predicted to exceed the per-process memory limit, 504
+                when the deadline expires and 499 when the client disconnected
+        """
+        job = SliceJob(
+            user_id=user_id,
+            job_id=job_id,
+            deadline=time.monotonic() + deadline if deadline else None,
+            triangles=triangles,
+            profile=profile,
+            memory_limit_mb=self.memory_limit_mb,
+            features=DurationPredictor.features(triangles, dimensions, layer_height, support_material),
+            interactive=interactive,
+        )
+        job.predicted_seconds = self.duration_predictor.predict(job.features)
+        if triangles is not None:
+            self._reserve_memory(job)
+        with span(
+            'slicer.queue',
+            triangles=triangles,
+            predicted_memory_mb=round(job.memory_mb, 1) or None,
+            predicted_seconds=round(job.predicted_seconds, 1),
+            interactive=interactive,
+        ):
+            self._admit(job)
+
+            try:
+                while not job.admitted.done():
+                    await asyncio.wait({job.admitted}, timeout=self.poll_interval)
+                    reason = await self._cancel_reason(job, request)
+                    if reason is not None and not job.admitted.done():
+                        self._withdraw(job)
+                        if reason == 'deadline':
+                            self.expired_in_queue += 1
+                        raise self._cancelled_error(reason, deadline)
+            except asyncio.CancelledError:
+                self._withdraw(job)
+                raise
+
+        progress_broker.publish(job_id, {'event': 'started', 'percent': 0, 'stage': 'Slicing'})
+        with span('slicer.process', threads=job.threads) as process_span:
+            # The worker thread copies this context, the slicer's environment names this span
+            task = asyncio.ensure_future(asyncio.to_thread(func, *args, job=job, **kwargs))
+            try:
+                while not task.done():
+                    await asyncio.wait({task}, timeout=self.poll_interval)
+                    if not task.done() and job.cancel_reason is None:
+                        reason = await self._cancel_reason(job, request)
+                        if reason is not None:
+                            logger.warning(f"Killing slice job for user {user_id}: {reason}")
+                            job.kill(reason)
+                result = task.result()
+            except asyncio.CancelledError:
+                # The handler itself was cancelled, don't leave the slicer running
+                job.kill('disconnect')
+                raise
+            finally:
+                self._finish(job)
+                record_child_process(
+                    'prusa-slicer',
+                    wall_seconds=round(time.monotonic() - job.started_at, 3),
+                    cpu_seconds=job.cpu_seconds,
+                    peak_rss_mb=round(job.peak_rss_kb / 1024, 1) if job.peak_rss_kb else None,
+                    returncode=job.returncode,
+                    cancel_reason=job.cancel_reason,
+                )
+                if process_span is not None:
+                    process_span.set(
+                        cpu_seconds=job.cpu_seconds,
+                        peak_rss_mb=round(job.peak_rss_kb / 1024, 1) if job.peak_rss_kb else None,
+                        returncode=job.returncode,
+                        cancel_reason=job.cancel_reason,
+                    )
+
+        if job.cancel_reason is not None:
+            raise self._cancelled_error(job.cancel_reason, deadline)
+        return result
+
+    async def _cancel_reason(self, job: SliceJob, request: Optional[Request]) -> Optional[str]:
+        """Return why the job should be cancelled, if it should"""
+        if job.deadline is not None and time.monotonic() >= job.deadline:
+            return 'deadline'
+        if request is not None and await request.is_disconnected():
+            return 'disconnect'
+        return None
+
+    def _cancelled_error(self, reason: str, deadline: Optional[float]) -> HTTPException:
+        if reason == 'deadline':
+            return HTTPException(
+                status_code=504,
+                detail=f"Slicing did not finish within the {deadline:g}s deadline",
+            )
+        return HTTPException(status_code=499, detail="Client closed the request")
+
+    def _reserve_memory(self, job: SliceJob):
+        """Attach the predicted peak memory to a job, rejecting models that can never fit"""
+        if self.memory_limit_mb is not None and self.memory_predictor.predict(job.triangles, safe=False) > self.memory_limit_mb:
+            self.rejected_memory += 1
+            raise HTTPException(
+                status_code=413,
+                detail=f"Model with {job.triangles} triangles needs more than the {self.memory_limit_mb} MB a slice may use",
+            )
+
+        job.memory_mb = self.memory_predictor.predict(job.triangles)
+        if self.memory_limit_mb is not None:
+            job.memory_mb = min(job.memory_mb, self.memory_limit_mb)
+
+    def _fits_memory(self, job: SliceJob) -> bool:
+        if self.memory_budget_mb is None or self._running == 0:
+            # Alone on the machine a job always runs, the hard limit still applies
+            return True
+        return self._memory_reserved + job.memory_mb <= self.memory_budget_mb
+
+    def _admit(self, job: SliceJob):
+        """Queue the job or shed it with a 429 response"""
+        user_queue = self._queues.get(job.user_id)
+
+        if self._queued >= self.max_queue:
+            reason = 'queue_full'
+        elif user_queue is not None and len(user_queue) >= self.max_queue_per_user:
+            reason = 'user_queue_full'
+        else:
+            reason = None
+
+        if reason is not None:
+            self.shed_counts[reason] += 1
+            retry_after = self.retry_after()
+            logger.warning(f"Shedding slice job for user {job.user_id} ({reason}), retry after {retry_after}s")
+            raise HTTPException(
+                status_code=429,
+                detail="Slicer is at capacity, please retry later",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+        job.admitted = asyncio.get_running_loop().create_future()
+        if user_queue is None:
+            user_queue = self._queues[job.user_id] = deque()
+        user_queue.append(job)
+        self._queued += 1
+        progress_broker.publish(job.job_id, {'event': 'queued', 'position': self._queued})
+        self._dispatch()
+
+    def _priority(self, job: SliceJob, now: float) -> float:
+        """Rank of a queued job in seconds, the lowest starts first"""
+        rank = job.predicted_seconds * (1.0 if job.interactive else self.background_weight)
+        rank += self.fair_share_seconds * self._running_by_user[job.user_id]
+        return rank - self.aging * (now - job.enqueued_at)
+
+    def speedup(self, threads: Optional[int]) -> float:
+        """Expected speedup of a slice run with `threads` threads over one thread"""
+        if not threads:
+            return 1.0
+        return 1.0 / ((1.0 - self.parallel_fraction) + self.parallel_fraction / threads)
+
+    def _thread_budget(self, job: SliceJob) -> Optional[int]:
+        """Threads a job about to start may use, None without a CPU budget"""
+        if not self.cpu_threads:
+            return None
+        open_slots = max(self.max_concurrency - self._running, 1)
+        share = (self.cpu_threads - self._threads_reserved) // open_slots
+        wanted = math.ceil(job.predicted_seconds / self.seconds_per_thread)
+        return max(1, min(share, wanted))
+
+    def _dequeue(self, job: SliceJob):
+        user_queue = self._queues[job.user_id]
+        user_queue.remove(job)
+        self._queued -= 1
+        if not user_queue:
+            del self._queues[job.user_id]
+
+    def _dispatch(self):
+        """Start the best ranked queued jobs while slots and memory are free"""
+        if self._running >= self.max_concurrency or not self._queued:
+            return
+
+        now = time.monotonic()
+        queued = [job for user_queue in self._queues.values() for job in user_queue]
+        waiting = []
+        for job in sorted(queued, key=lambda job: self._priority(job, now)):
+            if self._running >= self.max_concurrency:
+                return
+            if job.admitted.done():
+                # The waiter was cancelled while queued
+                self._dequeue(job)
+                continue
+
+            if not self._fits_memory(job):
+                if job.bypassed >= self.max_bypass:
+                    # Hold everything back until this job fits
+                    return
+                waiting.append(job)
+                continue
+
+            # Only smaller jobs of other users may pass a job waiting for memory
+            if any(job.user_id == blocked.user_id or job.memory_mb >= blocked.memory_mb for blocked in waiting):
+                continue
+
+            self._dequeue(job)
+            for overtaken in waiting:
+                overtaken.bypassed += 1
+            job.threads = self._thread_budget(job)
+            self._threads_reserved += job.threads or 0
+            self._running += 1
+            self._running_by_user[job.user_id] += 1
+            self._memory_reserved += job.memory_mb
+            job.started_at = now
+            job.admitted.set_result(True)
+
+    def _withdraw(self, job: SliceJob):
+        """Remove a job that was cancelled before it got a slot"""
+        if job.started_at is not None:
+            # Admitted just before the cancellation landed, give the slot back
+            self._release(job)
+            self._dispatch()
+            return
+
+        user_queue = self._queues.get(job.user_id)
+        if user_queue is not None and job in user_queue:
+            self._dequeue(job)
+
+    def _release(self, job: SliceJob):
+        self._running -= 1
+        self._running_by_user[job.user_id] -= 1
+        if not self._running_by_user[job.user_id]:
+            del self._running_by_user[job.user_id]
+        self._memory_reserved -= job.memory_mb
+        self._threads_reserved -= job.threads or 0
+
+    def _finish(self, job: SliceJob):
+        """Release the slot held by a job and record its completion"""
+        now = time.monotonic()
+        self._release(job)
+        self._dispatch()
+
+        if job.process is not None and job.returncode is not None:
+            self.accounting.record(job)
+
+        if job.triangles is not None and job.peak_rss_kb:
+            # Killed or failed slices stopped early, their peak would drag the fit down
+            peak_mb = job.peak_rss_kb / 1024
+            self._peak_rss_mb.append((job.triangles, round(job.memory_mb, 1), round(peak_mb, 1)))
+            if job.cancel_reason is None and job.returncode == 0:
+                self.memory_predictor.observe(job.triangles, peak_mb)
+
+        if job.cancel_reason is not None:
+            self.killed_counts[job.cancel_reason] += 1
+            self.killed_cpu_seconds += job.cpu_seconds or 0.0
+            self.predicted_cpu_seconds_saved += self._remaining_cpu_seconds(job)
+            return
+
+        if job.returncode == 0 and job.wall_seconds is not None:
+            # Predictions are for one thread, scale back what the budget sped up
+            seconds = job.wall_seconds * self.speedup(job.threads)
+            self.duration_predictor.observe(job.features, seconds)
+            self._predictions.append((round(job.predicted_seconds, 1), round(seconds, 1), job.interactive))
+
+        self.completed += 1
+        self._completions.append(now)
+        self._service_times.append(now - job.started_at)
+
+    def _remaining_cpu_seconds(self, job: SliceJob) -> float:
+        """
+        CPU seconds a killed slice was predicted to still need
+
+        Predictions are single thread seconds, which is about the CPU time a slice
+        burns whatever its thread budget. The work done is the time the process
+        ran, sped up by its threads. A disconnected slice would still have been
+        killed at its deadline, so it saves no more than the time left until then.
+        """
+        ran = job.killed_at - job.spawned_at if job.spawned_at is not None and job.killed_at is not None else 0.0
+        remaining = job.predicted_seconds - max(ran, 0.0) * self.speedup(job.threads)
+        if job.cancel_reason == 'disconnect' and job.deadline is not None and job.killed_at is not None:
+            remaining = min(remaining, (job.deadline - job.killed_at) * self.speedup(job.threads))
+        return max(remaining, 0.0)
+
+    def drain_rate(self) -> float:
+        """Jobs completed per second over the drain window"""
+        now = time.monotonic()
+        while self._completions and now - self._completions[0] > self.drain_window:
+            self._completions.popleft()
+
+        if len(self._completions) >= 2:
+            elapsed = max(now - self._completions[0], 1.0)
+            return len(self._completions) / elapsed
+
+        # Not enough history yet, estimate from the average service time
+        if self._service_times:
+            average = sum(self._service_times) / len(self._service_times)
+            return self.max_concurrency / max(average, 1.0)
+
+        return 0.0
+
+    def retry_after(self) -> int:
+        """Seconds a shed client should wait before the queue has room again"""
+        rate = self.drain_rate()
+        if rate <= 0:
+            return settings.SLICE_RETRY_AFTER_DEFAULT
+        return max(1, min(math.ceil((self._queued + 1) / rate), 600))
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and shedding counters for monitoring"""
+        return {
+            'running': self._running,
+            'queued': self._queued,
+            'queued_users': len(self._queues),
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'max_queue_per_user': self.max_queue_per_user,
+            'completed': self.completed,
+            'shed': dict(self.shed_counts),
+            'shed_total': sum(self.shed_counts.values()),
+            'drain_rate_per_minute': round(self.drain_rate() * 60, 2),
+            'killed': dict(self.killed_counts),
+            'expired_in_queue': self.expired_in_queue,
+            'killed_cpu_seconds': round(self.killed_cpu_seconds, 2),
+            'predicted_cpu_seconds_saved': round(self.predicted_cpu_seconds_saved, 2),
+            'memory': self.memory_stats(),
+            'usage': self.accounting.summary(),
+            'scheduling': self.scheduling_stats(),
+        }
+
+    def scheduling_stats(self) -> dict:
+        """Ranking and thread settings, duration predictor fit and recent (predicted, actual one thread seconds, interactive)"""
+        now = time.monotonic()
+        queued = [job for user_queue in self._queues.values() for job in user_queue]
+        return {
+            'background_weight': self.background_weight,
+            'fair_share_seconds': self.fair_share_seconds,
+            'aging': self.aging,
+            'cpu_threads': self.cpu_threads,
+            'threads_reserved': self._threads_reserved,
+            'queued_interactive': sum(job.interactive for job in queued),
+            'oldest_wait_seconds': round(max((now - job.enqueued_at for job in queued), default=0.0), 1),
+            'predictor': self.duration_predictor.stats(),
+            'recent': list(self._predictions),
+        }
+
+    def memory_stats(self) -> dict:
+        """Memory reservations, predictor fit and recent (triangles, predicted MB, peak RSS MB)"""
+        base, slope = self.memory_predictor.coefficients()
+        return {
+            'budget_mb': self.memory_budget_mb,
+            'process_limit_mb': self.memory_limit_mb,
+            'reserved_mb': round(self._memory_reserved, 1),
+            'rejected': self.rejected_memory,
+            'predictor': {
+                'base_mb': round(base, 1),
+                'mb_per_million_triangles': round(slope, 1),
+                'safety_factor': self.memory_predictor.safety_factor,
+                'observations': self.memory_predictor.observations,
+            },
+            'recent': list(self._peak_rss_mb),
+        }
+
+
+slice_scheduler = SliceScheduler(
+    max_concurrency=settings.SLICER_MAX_CONCURRENCY,
+    max_queue=settings.SLICE_QUEUE_MAX,
+    max_queue_per_user=settings.SLICE_QUEUE_MAX_PER_USER,
+    memory_budget_mb=settings.SLICER_MEMORY_BUDGET_MB,
+    memory_limit_mb=settings.SLICER_MEMORY_LIMIT_MB,
+    memory_predictor=MemoryPredictor(safety_factor=settings.SLICER_MEMORY_SAFETY_FACTOR),
+    accounting=SlicerAccounting(max_keys=settings.SLICER_ACCOUNTING_MAX_KEYS),
+    background_weight=settings.SLICE_BACKGROUND_WEIGHT,
+    fair_share_seconds=settings.SLICE_FAIR_SHARE_SECONDS,
+    aging=settings.SLICE_AGING,
+    cpu_threads=settings.SLICER_CPU_THREADS,
+    seconds_per_thread=settings.SLICE_SECONDS_PER_THREAD,
+    parallel_fraction=settings.SLICER_PARALLEL_FRACTION,
+)
@@ -0,0 +1,122 @@
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Jobs sliced with a config sent inline rather than a stored profile
+INLINE_PROFILE = '(inline)'
+
+USAGE_FIELDS = ('user_cpu_seconds', 'system_cpu_seconds', 'wall_seconds', 'output_bytes')
+
+
+class SlicerAccounting:
+    def __init__(self, max_keys: int = 10000, recent: int = 200):
+        """
+        Server resources spent on slicer processes, per job, user and profile.
+
+        Every finished slicer process is logged with its user and system CPU
+        seconds, wall time, peak RSS and G-code size, and added to running
+        totals per `user_id` and per printer profile. Profiles are keyed
+        `user_id/profile_name` since every user names their own. Totals cover
+        the life of the process; each table keeps the `max_keys` most recently
+        active keys.
+
+        Args:
+            max_keys (int): Users and profiles kept in each table
+            recent (int): Job records kept for monitoring
+        """
+        self.max_keys = max_keys
+        self.by_user: OrderedDict[str, dict] = OrderedDict()
+        self.by_profile: OrderedDict[str, dict] = OrderedDict()
+        self.totals = self._empty()
+        self.recent: deque[dict] = deque(maxlen=recent)
+
+    @staticmethod
+    def _empty() -> dict:
+        return {'jobs': 0, 'failed': 0, 'peak_rss_mb_max': 0.0, 'peak_rss_mb_sum': 0.0, **{field: 0 for field in USAGE_FIELDS}}
+
+    def record(self, job) -> dict:
+        """
+        Account for a finished slicer process
+
+        Args:
+            job (SliceJob): Job whose process has been reaped
+
+        Returns:
+            dict: The job's usage record
+        """
+        record = {
+            'user_id': job.user_id,
+            'profile': job.profile or INLINE_PROFILE,
+            'job_id': job.job_id,
+            'triangles': job.triangles,
+            'threads': job.threads,
+            'user_cpu_seconds': round(job.user_cpu_seconds or 0.0, 3),
+            'system_cpu_seconds': round(job.system_cpu_seconds or 0.0, 3),
+            'wall_seconds': round(job.wall_seconds or 0.0, 3),
+            'peak_rss_mb': round((job.peak_rss_kb or 0) / 1024, 1),
+            'output_bytes': job.output_bytes or 0,
+            'returncode': job.returncode,
+            'cancel_reason': job.cancel_reason,
+        }
+        failed = job.cancel_reason is not None or job.returncode != 0
+        logger.info(
+            f"Slicer usage user={record['user_id']} profile={record['profile']} "
+            f"cpu_user={record['user_cpu_seconds']}s cpu_sys={record['system_cpu_seconds']}s "
+            f"wall={record['wall_seconds']}s peak_rss={record['peak_rss_mb']}MB "
+            f"output={record['output_bytes']}B{' failed' if failed else ''}"
+        )
+
+        for totals in (self._entry(self.by_user, record['user_id']), self._entry(self.by_profile, record['profile']), self.totals):
+            totals['jobs'] += 1
+            totals['failed'] += failed
+            for field in USAGE_FIELDS:
+                totals[field] += record[field]
+            totals['peak_rss_mb_max'] = max(totals['peak_rss_mb_max'], record['peak_rss_mb'])
+            totals['peak_rss_mb_sum'] += record['peak_rss_mb']
+
+        self.recent.append(record)
+        return record
+
+    def _entry(self, table: OrderedDict, key: str) -> dict:
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = self._empty()
+            while len(table) > self.max_keys:
+                table.popitem(last=False)
+        table.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def _summary(totals: dict) -> dict:
+        jobs = totals['jobs']
+        cpu_seconds = totals['user_cpu_seconds'] + totals['system_cpu_seconds']
+        return {
+            'jobs': jobs,
+            'failed': totals['failed'],
+            'cpu_seconds': round(cpu_seconds, 2),
+            'user_cpu_seconds': round(totals['user_cpu_seconds'], 2),
+            'system_cpu_seconds': round(totals['system_cpu_seconds'], 2),
+            'wall_seconds': round(totals['wall_seconds'], 2),
+            'mean_cpu_seconds': round(cpu_seconds / jobs, 2) if jobs else None,
+            'mean_peak_rss_mb': round(totals['peak_rss_mb_sum'] / jobs, 1) if jobs else None,
+            'max_peak_rss_mb': totals['peak_rss_mb_max'],
+            'output_bytes': totals['output_bytes'],
+        }
+
+    def top(self, by: str = 'user', sort: str = 'cpu_seconds', limit: int = 20) -> list[dict]:
+        """
+        Users or profiles that cost the most
+
+        Args:
+            by (str): 'user' or 'profile'
+            sort (str): Summary field to rank by, e.g. 'cpu_seconds' or 'max_peak_rss_mb'
+            limit (int): Number of entries returned
+        """
+        table = self.by_user if by == 'user' else self.by_profile
+        summaries = [{by: key, **self._summary(totals)} for key, totals in table.items()]
+        return sorted(summaries, key=lambda summary: summary.get(sort) or 0, reverse=True)[:limit]
+
+    def summary(self) -> dict:
+        """Totals over every job, without per-user detail"""
+        return self._summary(self.totals)
@@ -0,0 +1,214 @@
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+from app.constants import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds between forced JWKS fetches when a token names an unknown key
+MIN_REFRESH_INTERVAL = 30.0
+
+
+class SupabaseTokenVerifier:
+    def __init__(
+        self,
+        jwt_secret: str = "",
+        jwks_url: Optional[str] = None,
+        issuer: Optional[str] = None,
+        audience: str = "authenticated",
+        max_entries: int = 10000,
+        refresh_interval: float = 600.0,
+        leeway: float = 30.0,
+    ):
+        """
+        Verifies Supabase access tokens locally instead of calling the auth API.
+
+        HS256 tokens are checked against the project's JWT secret, asymmetric
+        ones against the project's JWKS, fetched in the background and on
+        demand when a token is signed with a key we haven't seen yet. Verified
+        claims are kept in a bounded LRU until the token expires so repeated
+        exchanges of the same token skip the signature check. Tokens that can't
+        be checked locally (HS256 without a configured secret) fall back to
+        the auth API.
+
+        Args:
+            jwt_secret (str): Project JWT secret for HS256 tokens
+            jwks_url (str, optional): URL of the project's JSON Web Key Set
+            issuer (str, optional): Expected `iss` claim
+            audience (str): Expected `aud` claim
+            max_entries (int): Maximum number of verified tokens kept
+            refresh_interval (float): Seconds between background JWKS refreshes
+            leeway (float): Seconds of clock skew tolerated on `exp` and `iat`
+        """
+        self.jwt_secret = jwt_secret
+        self.jwks_url = jwks_url
+        self.issuer = issuer
+        self.audience = audience
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+        self.leeway = leeway
+
+        self._keys: dict[str, object] = {}
+        self._keys_fetched_at: Optional[float] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._cache: OrderedDict[str, dict] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.remote = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    async def verify(self, token: str) -> dict:
+        """
+        Claims of a valid Supabase access token
+
+        Raises:
+            jwt.PyJWTError: When the token is invalid, expired or signed with an unknown key
+        """
+        import jwt
+
+        cache_key = hashlib.sha256(token.encode()).hexdigest()
+        claims = self._cache.get(cache_key)
+        if claims is not None:
+            if claims['exp'] > time.time() - self.leeway:
+                self._cache.move_to_end(cache_key)
+                self.hits += 1
+                return claims
+            del self._cache[cache_key]
+        self.misses += 1
+
+        header = jwt.get_unverified_header(token)
+        if header.get('alg') == 'HS256':
+            if not self.jwt_secret:
+                claims = await self._verify_remote(token)
+                self._put(cache_key, claims)
+                return claims
+            key, algorithm = self.jwt_secret, 'HS256'
+        else:
+            jwk = self._keys.get(header.get('kid'))
+            if jwk is None:
+                # Supabase rotated its signing keys since the last refresh
+                await self.refresh(min_interval=MIN_REFRESH_INTERVAL)
+                jwk = self._keys.get(header.get('kid'))
+            if jwk is None:
+                raise jwt.InvalidKeyError(f"Token signed with unknown key {header.get('kid')}")
+            # The key decides the algorithm, never the token's header
+            key, algorithm = jwk.key, jwk.algorithm_name
+
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={'require': ['exp', 'sub']},
+        )
+        self._put(cache_key, claims)
+        return claims
+
+    async def _verify_remote(self, token: str) -> dict:
+        """Ask the Supabase auth API, used when the token can't be checked locally"""
+        import jwt
+        from app.db.supabase_auth import get_supabase_client
+
+        self.remote += 1
+        response = await asyncio.to_thread(get_supabase_client().auth.get_user, token)
+        if not response or not response.user:
+            raise jwt.InvalidTokenError("Invalid authentication credentials")
+
+        # Signature already checked by Supabase, only the expiry is needed for the cache
+        expires = jwt.decode(token, options={'verify_signature': False}).get('exp', 0)
+        return {'sub': response.user.id, 'email': response.user.email, 'exp': expires}
+
+    def _put(self, cache_key: str, claims: dict):
+        self._cache[cache_key] = claims
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def refresh(self, min_interval: float = 0.0) -> bool:
+        """
+        Fetch the JWKS, keeping the current keys when Supabase can't be reached
+
+        Returns:
+            bool: True when the keys were fetched
+        """
+        if not self.jwks_url:
+            return False
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        async with self._refresh_lock:
+            if self._keys_fetched_at is not None and time.monotonic() - self._keys_fetched_at < min_interval:
+                return False
+
+            import httpx
+            from jwt import PyJWKSet, PyJWKSetError
+
+            try:
+                async with httpx.AsyncClient(timeout=5.0) as client:
+                    response = await client.get(self.jwks_url)
+                    response.raise_for_status()
+                    data = response.json()
+                if data.get('keys'):
+                    keys = {key.key_id: key for key in PyJWKSet.from_dict(data).keys if key.key_id}
+                else:
+                    # Projects still on the shared secret publish an empty set
+                    keys = {}
+            except (httpx.HTTPError, ValueError, AttributeError) as e:
+                self.refresh_errors += 1
+                logger.warning(f"Could not refresh Supabase JWKS: {e}")
+                return False
+            except PyJWKSetError as e:
+                # Raised when none of the keys is usable, e.g. without the `cryptography` package
+                self.refresh_errors += 1
+                logger.error(f"No usable key in the Supabase JWKS, keeping the current keys: {e}")
+                return False
+            finally:
+                self._keys_fetched_at = time.monotonic()
+
+            self._keys = keys
+            self.refreshes += 1
+            return True
+
+    async def run(self):
+        """Refresh the JWKS forever, started with the app"""
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> Optional[asyncio.Task]:
+        if not self.jwks_url:
+            return None
+        return asyncio.get_running_loop().create_task(self.run())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'local_secret': bool(self.jwt_secret),
+            'jwks_keys': len(self._keys),
+            'jwks_age_seconds': round(time.monotonic() - self._keys_fetched_at, 1) if self._keys_fetched_at else None,
+            'cached_tokens': len(self._cache),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'remote_verifications': self.remote,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+        }
+
+
+token_verifier = SupabaseTokenVerifier(
+    jwt_secret=settings.SUPABASE_JWT_SECRET,
+    jwks_url=f"{settings.SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json" if settings.SUPABASE_URL else None,
+    issuer=f"{settings.SUPABASE_URL.rstrip('/')}/auth/v1" if settings.SUPABASE_URL else None,
+    audience=settings.SUPABASE_JWT_AUDIENCE,
+    max_entries=settings.TOKEN_CACHE_MAX_ENTRIES,
+    refresh_interval=settings.SUPABASE_JWKS_REFRESH_SECONDS,
+)
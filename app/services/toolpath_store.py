@@ -0,0 +1,109 @@
+import os
+import uuid
+import shutil
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional
+from app.constants import TOOLPATH_DIR, settings
+from app.utils.utilities import process_directory
+
+logger = logging.getLogger(__name__)
+
+
+class ToolpathStore:
+    def __init__(self, directory: Path, max_bytes: int = 2 * 1024 ** 3):
+        """
+        Node local store of sliced G-code, keyed by model and toolpath signature.
+
+        A slice request that only differs from an earlier one in toolpath
+        invariant settings (temperatures, ...) copies the stored G-code and
+        patches it instead of running the slicer again. The least recently used
+        files are deleted once the store grows past `max_bytes`.
+
+        Args:
+            directory (Path): Where the G-code files are kept, each process uses its own subdirectory
+            max_bytes (int): Disk budget of this process' store, the node uses up to this times its processes
+        """
+        self.root = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._bytes = 0
+        # Stores run in worker threads
+        self._lock = threading.Lock()
+        self._directory: Optional[Path] = None
+        self._pid: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self) -> Path:
+        """This process' directory, set up on first use so importing the module deletes nothing"""
+        if self._pid != os.getpid():
+            # A forked process starts over, the parent's index isn't its own
+            self._entries.clear()
+            self._bytes = 0
+            self._directory = process_directory(self.root)
+            self._pid = os.getpid()
+        return self._directory
+
+    def get(self, key: str) -> Optional[dict]:
+        """Stored entry {'path', 'temperatures'} for a key, if its file is still there"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry['path'].exists():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, gcode_path: Path, temperatures: dict):
+        """Keep a copy of a freshly sliced G-code"""
+        with self._lock:
+            directory = self.directory
+
+        # Copied outside the lock under a unique name, G-code can be large
+        path = directory / f"{key}.gcode"
+        partial = directory / f"{key}.{uuid.uuid4().hex}.partial"
+        try:
+            shutil.copyfile(gcode_path, partial)
+        except OSError as e:
+            partial.unlink(missing_ok=True)
+            logger.warning(f"Could not store G-code for reuse: {e}")
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            os.replace(partial, path)
+            size = path.stat().st_size
+            self._entries[key] = {'path': path, 'temperatures': dict(temperatures), 'size': size}
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+        entry['path'].unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+toolpath_store = ToolpathStore(
+    directory=TOOLPATH_DIR,
+    max_bytes=settings.TOOLPATH_STORE_MAX_BYTES,
+)
@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from app.constants import TRACE_EXPORT_PATH, settings
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """A timed step of a request, nested under the span active when it started"""
+
+    def __init__(self, name: str, trace: 'Trace', parent: Optional['Span'], attributes: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [
+                {'key': key, 'value': {'stringValue': str(value)}}
+                for key, value in self.attributes.items() if value is not None
+            ],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class Trace:
+    """All spans of one request"""
+
+    def __init__(self, request_id: str):
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id
+        self.spans: list[Span] = []
+
+
+class Tracer:
+    def __init__(self, export_path: Optional[Path] = None, max_bytes: int = 50 * 1024 ** 2, recent: int = 200):
+        """
+        Request scoped tracing with spans kept in context variables.
+
+        Spans nest through `contextvars`, so steps run with `asyncio.to_thread`
+        land under the step that started them. When a request's root span ends,
+        its whole trace is written as one OTLP/JSON `resourceSpans` line to
+        `export_path` by a background thread (rotated to `.1` past `max_bytes`),
+        the format an OpenTelemetry collector's file receiver reads. The last
+        `recent` traces stay in memory for /monitoring/traces/.
+
+        Args:
+            export_path (Path, optional): JSON lines file traces are appended to
+            max_bytes (int): Size at which the export file is rotated
+            recent (int): Number of traces kept in memory
+        """
+        self.export_path = Path(export_path) if export_path else None
+        self.max_bytes = max_bytes
+        self.recent: OrderedDict[str, Trace] = OrderedDict()
+        self.recent_max = recent
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Time a step of the current request, a no-op outside of one
+
+        Yields:
+            Span: The span, `.set()` adds attributes known once the step ran
+        """
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        current = Span(name, parent.trace, parent, attributes)
+        parent.trace.spans.append(current)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current.end_ns = time.time_ns()
+            _current_span.reset(token)
+
+    @contextmanager
+    def request(self, name: str, request_id: Optional[str] = None, **attributes):
+        """Root span of a request, exported with all its children once it ends"""
+        trace = Trace(request_id or uuid.uuid4().hex)
+        root = Span(name, trace, None, attributes)
+        trace.spans.append(root)
+        request_token = request_id_var.set(trace.request_id)
+        span_token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            root.end_ns = time.time_ns()
+            _current_span.reset(span_token)
+            request_id_var.reset(request_token)
+            self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        self.recent[trace.trace_id] = trace
+        while len(self.recent) > self.recent_max:
+            self.recent.popitem(last=False)
+
+        if self.export_path is not None:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_forever, name='trace-export', daemon=True)
+                self._writer.start()
+            self._queue.put(trace)
+
+    def _write_forever(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                self._write(trace)
+            except OSError as e:
+                logger.warning(f"Could not export trace {trace.trace_id}: {e}")
+
+    def _write(self, trace: Trace):
+        self.export_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.export_path.exists() and self.export_path.stat().st_size > self.max_bytes:
+            os.replace(self.export_path, self.export_path.with_name(self.export_path.name + '.1'))
+
+        line = json.dumps({
+            'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'cloud-slicer-api'}}]},
+                'scopeSpans': [{
+                    'scope': {'name': 'app.services.tracing'},
+                    'spans': [span.to_otlp() for span in trace.spans],
+                }],
+            }],
+        })
+        with open(self.export_path, 'a') as f:
+            f.write(line + '\n')
+
+    def timeline(self, trace: Trace) -> dict:
+        """A trace as offsets and durations in milliseconds from the start of the request"""
+        root = trace.spans[0]
+        depth = {root.span_id: 0}
+        spans = []
+        for span in trace.spans:
+            depth[span.span_id] = depth.get(span.parent_id, -1) + 1
+            end_ns = span.end_ns or time.time_ns()
+            spans.append({
+                'name': span.name,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'depth': depth[span.span_id],
+                'offset_ms': round((span.start_ns - root.start_ns) / 1e6, 2),
+                'duration_ms': round((end_ns - span.start_ns) / 1e6, 2),
+                'attributes': span.attributes,
+                'error': span.error,
+            })
+        return {
+            'trace_id': trace.trace_id,
+            'request_id': trace.request_id,
+            'name': root.name,
+            'duration_ms': spans[0]['duration_ms'],
+            'spans': spans,
+        }
+
+
+def subprocess_env() -> Optional[dict]:
+    """
+    Environment for a child process carrying the request ID and a W3C traceparent,
+    None outside of a request so the child inherits the environment unchanged
+    """
+    span = _current_span.get()
+    if span is None:
+        return None
+    return {
+        **os.environ,
+        'REQUEST_ID': span.trace.request_id,
+        'TRACEPARENT': f"00-{span.trace.trace_id}-{span.span_id}-01",
+    }
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request ID to every log record as `request_id`"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or '-'
+        return True
+
+
+def configure_logging():
+    """Log the app's messages with the request they belong to"""
+    app_logger = logging.getLogger('app')
+    if any(isinstance(f, RequestIdFilter) for handler in app_logger.handlers for f in handler.filters):
+        return
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    app_logger.addHandler(handler)
+    app_logger.setLevel(logging.INFO)
+    app_logger.propagate = False
+
+
+class TracingMiddleware:
+    def __init__(self, app, tracer: Tracer, exclude: tuple[str, ...] = ()):
+        """
+        Opens a trace for every HTTP request and returns its request ID.
+
+        The request ID comes from the client's X-Request-ID header when it
+        sends one, and is echoed back in the response's X-Request-ID header.
+
+        Args:
+            app: ASGI app to wrap
+            tracer (Tracer): Tracer the requests are recorded by
+            exclude (tuple[str, ...]): Path prefixes left untraced, e.g. monitoring polls
+        """
+        self.app = app
+        self.tracer = tracer
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(self.exclude):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope['headers'])
+        request_id = headers.get(b'x-request-id', b'').decode(errors='replace')[:128] or None
+        with self.tracer.request(f"{scope['method']} {scope['path']}", request_id=request_id, route=scope['path']) as root:
+            async def traced_send(message):
+                if message['type'] == 'http.response.start':
+                    root.set(status_code=message['status'])
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'x-request-id', root.trace.request_id.encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, traced_send)
+
+
+tracer = Tracer(
+    export_path=TRACE_EXPORT_PATH if settings.TRACE_EXPORT_ENABLED else None,
+    max_bytes=settings.TRACE_EXPORT_MAX_BYTES,
+    recent=settings.TRACE_RECENT_MAX,
+)
+span = tracer.span
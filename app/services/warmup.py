@@ -0,0 +1,78 @@
+import time
+import shutil
+import asyncio
+import logging
+import subprocess
+from app.constants import settings
+
+logger = logging.getLogger(__name__)
+
+# Modules the API imports on first use, loaded ahead of the first request
+WARM_MODULES = (
+    'numpy',
+    'stl',
+    'jwt',
+    'app.utils.mesh_analysis',
+    'app.utils.gcode_analysis',
+)
+
+warmup_state = {'status': 'pending', 'seconds': None, 'steps': {}}
+
+
+def _timed(name: str, func):
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        logger.warning(f"Warm-up step {name} failed: {e}")
+    warmup_state['steps'][name] = round(time.perf_counter() - start, 3)
+
+
+def _import_modules():
+    import importlib
+    for module in WARM_MODULES:
+        importlib.import_module(module)
+
+
+def _load_slicer_configs():
+    from app.services.pro_routes_helpers import load_default_config
+    load_default_config()
+
+
+def _create_supabase_client():
+    if settings.SUPABASE_URL and settings.SUPABASE_KEY:
+        from app.db.supabase_auth import get_supabase_client
+        get_supabase_client()
+
+
+def _page_in_slicer():
+    # Reads the slicer binary and its libraries into the page cache
+    if shutil.which('prusa-slicer'):
+        subprocess.run(['prusa-slicer', '--help'], capture_output=True, timeout=60)
+
+
+def warm_up():
+    """
+    Load what the first requests would otherwise pay for: heavy modules, the
+    slicer configs, the Supabase client and the slicer binary
+    """
+    start = time.perf_counter()
+    warmup_state['status'] = 'running'
+    _timed('imports', _import_modules)
+    _timed('slicer_configs', _load_slicer_configs)
+    _timed('supabase_client', _create_supabase_client)
+    _timed('slicer_binary', _page_in_slicer)
+    warmup_state['seconds'] = round(time.perf_counter() - start, 3)
+    warmup_state['status'] = 'done'
+    logger.info(f"Warm-up finished in {warmup_state['seconds']}s")
+
+
+def start_warm_up():
+    """
+    Run the warm-up in a worker thread once the app has started, the port opens
+    without waiting for it. Disabled with WARMUP_ON_STARTUP=false
+    """
+    if not settings.WARMUP_ON_STARTUP:
+        warmup_state['status'] = 'disabled'
+        return None
+    return asyncio.get_running_loop().run_in_executor(None, warm_up)
@@ -0,0 +1,442 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+from app.constants import WORKER_QUEUE_DB_PATH, settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds between result checks while the API waits on a worker
+POLL_INTERVAL = 0.2
+
+
+class RemoteSlice:
+    """Stands in for the slicer process of a job running on a worker, cancelled by run_slice once the job is killed"""
+
+    pid = None
+
+    def __init__(self, queue: 'WorkerQueue', job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.returncode: Optional[int] = None
+
+    def kill(self):
+        # Called on the event loop, the thread waiting in run_slice sees the job's
+        # cancel_reason within POLL_INTERVAL and cancels it on the queue
+        pass
+
+
+class WorkerQueue(ABC):
+    """
+    Slice jobs shared between API processes and `python -m app.worker` processes.
+
+    The API puts the model and slicer config next to the job as blobs, a worker
+    claims the job, slices and stores the G-code as a blob with the slicer's
+    resource usage as the result. Workers heartbeat running jobs, jobs of
+    workers that stopped heartbeating go back to the queue. Backends implement
+    the storage primitives, the protocol lives here.
+    """
+
+    def __init__(self, heartbeat_seconds: float = 5.0, stale_seconds: float = 30.0, blob_ttl: float = 3600.0):
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.blob_ttl = blob_ttl
+
+    # Storage primitives
+    @abstractmethod
+    def put_blob(self, key: str, data: bytes):
+        """Store a model, config or G-code under `job_id/name`"""
+
+    @abstractmethod
+    def get_blob(self, key: str) -> Optional[bytes]:
+        """A stored blob, None when it does not exist"""
+
+    @abstractmethod
+    def delete_blobs(self, job_id: str):
+        """Delete a job with its blobs, and anything older than `blob_ttl`"""
+
+    @abstractmethod
+    def submit(self, job_id: str, payload: dict):
+        """Queue a job for the workers"""
+
+    @abstractmethod
+    def claim(self, worker_id: str, timeout: float) -> Optional[tuple[str, dict]]:
+        """
+        Take the oldest queued job, waiting up to `timeout` seconds for one.
+        The job must be running with a fresh heartbeat as soon as it is taken.
+        """
+
+    @abstractmethod
+    def heartbeat(self, job_id: str):
+        """Mark a running job as alive"""
+
+    @abstractmethod
+    def finish(self, job_id: str, result: dict):
+        """Store the result of a job"""
+
+    @abstractmethod
+    def result(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Result of a job, waiting up to `timeout` seconds for it"""
+
+    @abstractmethod
+    def cancel(self, job_id: str):
+        """Ask the worker running a job to stop, or skip it if it is still queued"""
+
+    @abstractmethod
+    def cancelled(self, job_id: str) -> bool:
+        """Whether a job was cancelled or no longer exists"""
+
+    @abstractmethod
+    def requeue_stale(self) -> int:
+        """Queue running jobs whose heartbeat is older than `stale_seconds` again, returns how many"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Queue lengths for the monitoring endpoint"""
+
+    def run_slice(
+        self,
+        stl_file_path,
+        config_path,
+        output_gcode_path,
+        job,
+        env: Optional[dict] = None,
+        params: Optional[dict] = None,
+    ) -> bool:
+        """
+        Slice on a worker and wait for the G-code, called in place of running the slicer locally
+
+        Args:
+            stl_file_path (Path): Model to slice
+            config_path (Path): PrusaSlicer config file
+            output_gcode_path (Path): Where the G-code is written once the worker is done
+            job (SliceJob): Scheduler job, receives the worker's resource usage and can cancel it
+            env (dict, optional): Environment whose REQUEST_ID and TRACEPARENT are passed on
+            params (dict, optional): Other slicer parameters, e.g. material_profile
+
+        Returns:
+            bool: True when the worker sliced the model
+        """
+        job_id = uuid.uuid4().hex
+        try:
+            self.put_blob(f"{job_id}/model.stl", Path(stl_file_path).read_bytes())
+            if config_path is not None:
+                self.put_blob(f"{job_id}/config.ini", Path(config_path).read_bytes())
+            self.submit(job_id, {
+                'user_id': job.user_id if job is not None else None,
+                'stl_name': Path(stl_file_path).name,
+                'config': config_path is not None,
+                'params': params or {},
+                'memory_limit_mb': job.memory_limit_mb if job is not None else None,
+                'threads': job.threads if job is not None else None,
+                'env': {name: value for name, value in (env or {}).items() if name in ('REQUEST_ID', 'TRACEPARENT')},
+                'submitted_at': time.time(),
+            })
+
+            remote = RemoteSlice(self, job_id)
+            if job is not None:
+                job.attach(remote)
+
+            result = None
+            while result is None:
+                if job is not None and job.cancel_reason is not None:
+                    self.cancel(job_id)
+                    return False
+                result = self.result(job_id, timeout=POLL_INTERVAL)
+
+            remote.returncode = result.get('returncode')
+            if job is not None:
+                job.user_cpu_seconds = result.get('user_cpu_seconds')
+                job.system_cpu_seconds = result.get('system_cpu_seconds')
+                job.cpu_seconds = (job.user_cpu_seconds or 0.0) + (job.system_cpu_seconds or 0.0)
+                job.wall_seconds = result.get('wall_seconds')
+                job.peak_rss_kb = result.get('peak_rss_kb')
+                job.returncode = result.get('returncode')
+                job.output_bytes = result.get('output_bytes')
+
+            if not result.get('ok'):
+                logger.info(f"Worker {result.get('worker')} failed to slice {stl_file_path}: {result.get('error')}")
+                return False
+
+            gcode = self.get_blob(f"{job_id}/output.gcode")
+            if gcode is None:
+                logger.warning(f"G-code of worker job {job_id} is missing")
+                return False
+            Path(output_gcode_path).write_bytes(gcode)
+            return True
+        finally:
+            self.delete_blobs(job_id)
+
+
+class SQLiteWorkerQueue(WorkerQueue):
+    def __init__(self, path: Path, **options):
+        """
+        Worker queue in a SQLite file, for workers on the same machine and for tests
+
+        Args:
+            path (Path): SQLite database file shared by the API and its workers
+        """
+        super().__init__(**options)
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, SQLite serializes writers across processes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    heartbeat_at REAL,
+                    cancelled INTEGER NOT NULL DEFAULT 0,
+                    result TEXT
+                )"""
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, job_id TEXT NOT NULL, data BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def put_blob(self, key: str, data: bytes):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)", (key, key.split('/')[0], data, time.time())
+        )
+
+    def get_blob(self, key: str) -> Optional[bytes]:
+        row = self._connect().execute("SELECT data FROM blobs WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def delete_blobs(self, job_id: str):
+        connection = self._connect()
+        connection.execute("DELETE FROM blobs WHERE job_id = ? OR created_at < ?", (job_id, time.time() - self.blob_ttl))
+        connection.execute("DELETE FROM jobs WHERE id = ? OR created_at < ?", (job_id, time.time() - self.blob_ttl))
+
+    def submit(self, job_id: str, payload: dict):
+        self._connect().execute(
+            "INSERT INTO jobs (id, payload, status, created_at) VALUES (?, ?, 'queued', ?)",
+            (job_id, json.dumps(payload), time.time()),
+        )
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[tuple[str, dict]]:
+        deadline = time.monotonic() + timeout
+        connection = self._connect()
+        while True:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT id, payload FROM jobs WHERE status = 'queued' AND cancelled = 0 ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, heartbeat_at = ? WHERE id = ?",
+                        (worker_id, time.time(), row[0]),
+                    )
+            finally:
+                connection.execute("COMMIT")
+            if row is not None:
+                return row[0], json.loads(row[1])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def heartbeat(self, job_id: str):
+        self._connect().execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, result: dict):
+        self._connect().execute("UPDATE jobs SET status = 'done', result = ? WHERE id = ?", (json.dumps(result), job_id))
+
+    def result(self, job_id: str, timeout: float) -> Optional[dict]:
+        deadline = time.monotonic() + timeout
+        while True:
+            row = self._connect().execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row[0] is not None:
+                return json.loads(row[0])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(POLL_INTERVAL, max(deadline - time.monotonic(), 0.0)))
+
+    def cancel(self, job_id: str):
+        self._connect().execute("UPDATE jobs SET cancelled = 1 WHERE id = ?", (job_id,))
+
+    def cancelled(self, job_id: str) -> bool:
+        row = self._connect().execute("SELECT cancelled FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or bool(row[0])
+
+    def requeue_stale(self) -> int:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+            (time.time() - self.stale_seconds,),
+        )
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        workers = self._connect().execute("SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'running'").fetchone()[0]
+        return {'backend': 'sqlite', 'path': str(self.path), 'jobs': dict(rows), 'busy_workers': workers}
+
+
+# Moves the oldest pending job to running and stamps its heartbeat in one step.
+# Returns {id, payload}, {id} for a cancelled or expired job that was dropped, nil when none is pending.
+CLAIM_SCRIPT = """
+local job_id = redis.call('RPOP', KEYS[1])
+if not job_id then return nil end
+local job = ARGV[1] .. job_id
+local payload = redis.call('HGET', job, 'payload')
+if not payload or redis.call('HGET', job, 'cancelled') == '1' then return {job_id} end
+redis.call('LPUSH', KEYS[2], job_id)
+redis.call('HSET', job, 'worker', ARGV[2], 'heartbeat_at', ARGV[3])
+return {job_id, payload}
+"""
+
+# Queues a running job again if its heartbeat is missing or older than the cutoff,
+# clearing the heartbeat so the stale one can't requeue it again once it is claimed
+REQUEUE_SCRIPT = """
+local heartbeat = redis.call('HGET', KEYS[3], 'heartbeat_at')
+if heartbeat and tonumber(heartbeat) >= tonumber(ARGV[2]) then return 0 end
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then return 0 end
+redis.call('HDEL', KEYS[3], 'heartbeat_at', 'worker')
+redis.call('RPUSH', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+# Sets a field of a job only while the job exists, a late heartbeat or cancel after
+# delete_blobs would otherwise create a job hash without a TTL
+HSET_EXISTING_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+return redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+"""
+
+
+class RedisWorkerQueue(WorkerQueue):
+    def __init__(self, url: str, prefix: str = 'slicer', **options):
+        """
+        Worker queue in Redis, for workers on other machines
+
+        Args:
+            url (str): Redis URL, e.g. redis://queue.internal:6379/0
+            prefix (str): Prefix of every key the queue uses
+        """
+        super().__init__(**options)
+        # Only deployments with networked workers load the client
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        # Claiming and requeueing run as scripts, a job is never running without a heartbeat
+        self._claim = self.client.register_script(CLAIM_SCRIPT)
+        self._requeue = self.client.register_script(REQUEUE_SCRIPT)
+        self._hset_existing = self.client.register_script(HSET_EXISTING_SCRIPT)
+
+    def _key(self, *parts: str) -> str:
+        return ':'.join((self.prefix, *parts))
+
+    def put_blob(self, key: str, data: bytes):
+        self.client.set(self._key('blob', key), data, ex=int(self.blob_ttl))
+
+    def get_blob(self, key: str) -> Optional[bytes]:
+        return self.client.get(self._key('blob', key))
+
+    def delete_blobs(self, job_id: str):
+        keys = [self._key('blob', f"{job_id}/{name}") for name in ('model.stl', 'config.ini', 'output.gcode')]
+        self.client.delete(*keys, self._key('job', job_id), self._key('result', job_id))
+
+    def submit(self, job_id: str, payload: dict):
+        pipeline = self.client.pipeline()
+        pipeline.hset(self._key('job', job_id), mapping={'payload': json.dumps(payload), 'cancelled': 0})
+        pipeline.expire(self._key('job', job_id), int(self.blob_ttl))
+        pipeline.lpush(self._key('pending'), job_id)
+        pipeline.execute()
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[tuple[str, dict]]:
+        # Polled like the SQLite queue, a blocking move can't set the heartbeat in the same step
+        deadline = time.monotonic() + timeout
+        while True:
+            claimed = self._claim(
+                keys=[self._key('pending'), self._key('running')],
+                args=[self._key('job', ''), worker_id, time.time()],
+            )
+            if claimed is not None:
+                if len(claimed) == 2:
+                    return claimed[0].decode(), json.loads(claimed[1])
+                # A cancelled or expired job was dropped, look at the next one right away
+                continue
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(POLL_INTERVAL, max(deadline - time.monotonic(), 0.0)))
+
+    def heartbeat(self, job_id: str):
+        self._hset_existing(keys=[self._key('job', job_id)], args=['heartbeat_at', time.time()])
+
+    def finish(self, job_id: str, result: dict):
+        pipeline = self.client.pipeline()
+        pipeline.lrem(self._key('running'), 0, job_id)
+        pipeline.rpush(self._key('result', job_id), json.dumps(result))
+        pipeline.expire(self._key('result', job_id), int(self.blob_ttl))
+        pipeline.execute()
+
+    def result(self, job_id: str, timeout: float) -> Optional[dict]:
+        # Pushed back so a retried wait still finds it, deleted with the blobs
+        item = self.client.blmove(self._key('result', job_id), self._key('result', job_id), max(timeout, 0.01), 'LEFT', 'RIGHT')
+        return json.loads(item) if item is not None else None
+
+    def cancel(self, job_id: str):
+        self._hset_existing(keys=[self._key('job', job_id)], args=['cancelled', 1])
+
+    def cancelled(self, job_id: str) -> bool:
+        return self.client.hget(self._key('job', job_id), 'cancelled') in (None, b'1')
+
+    def requeue_stale(self) -> int:
+        requeued = 0
+        cutoff = time.time() - self.stale_seconds
+        for job_id in self.client.lrange(self._key('running'), 0, -1):
+            requeued += self._requeue(
+                keys=[self._key('running'), self._key('pending'), self._key('job', job_id.decode())],
+                args=[job_id, cutoff],
+            )
+        return requeued
+
+    def stats(self) -> dict:
+        return {
+            'backend': 'redis',
+            'jobs': {'queued': self.client.llen(self._key('pending')), 'running': self.client.llen(self._key('running'))},
+        }
+
+
+def create_worker_queue(url: str) -> Optional[WorkerQueue]:
+    """
+    Worker queue for a URL, None slices in the API process itself
+
+    Args:
+        url (str): '' for local slicing, 'sqlite:' for the default SQLite file,
+            'sqlite:///relative.sqlite3', 'sqlite:////absolute.sqlite3' or 'redis://host:port/db'
+    """
+    options = {
+        'heartbeat_seconds': settings.WORKER_HEARTBEAT_SECONDS,
+        'stale_seconds': settings.WORKER_STALE_SECONDS,
+    }
+    if not url:
+        return None
+    if url.startswith('sqlite:'):
+        path = url[len('sqlite:'):].removeprefix('///')
+        return SQLiteWorkerQueue(Path(path) if path else WORKER_QUEUE_DB_PATH, **options)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisWorkerQueue(url, **options)
+    raise ValueError(f"Unsupported worker queue URL: {url}")
+
+
+worker_queue = create_worker_queue(settings.WORKER_QUEUE_URL)
@@ -0,0 +1,247 @@
+import os
+import re
+import math
+import hashlib
+import logging
+from pathlib import Path
+from app.utils.utilities import seconds_to_time_str, time_str_to_seconds
+
+logger = logging.getLogger(__name__)
+
+# Slicers write their summary either at the top (Cura, Orca/Bambu header
+# block) or just above the settings dump at the end (PrusaSlicer, Orca), so
+# only these windows are read regardless of the file size
+HEAD_WINDOW = 64 * 1024
+TAIL_WINDOW = 256 * 1024
+
+# Used to derive weight and volume when a slicer only reports length
+DEFAULT_FILAMENT_DIAMETER = 1.75
+DEFAULT_FILAMENT_DENSITY = 1.24
+
+SLICER_SIGNATURES = [
+    ('bambu', re.compile(rb'BambuStudio')),
+    ('orca', re.compile(rb'OrcaSlicer')),
+    ('cura', re.compile(rb'Cura_SteamEngine|^;FLAVOR:', re.MULTILINE)),
+    ('prusa', re.compile(rb'PrusaSlicer|SuperSlicer|Slic3r')),
+]
+
+# Metadata written next to every G-code slice_model uploads, e.g. part.gcode.meta.json
+SIDECAR_SUFFIX = '.meta.json'
+SIDECAR_VERSION = 1
+
+# Layer change comments of PrusaSlicer and Orca/Bambu, and of Cura
+LAYER_MARKERS = (b'\n;LAYER_CHANGE', b'\n;LAYER:')
+
+_NUMBERS = r'([\d.]+(?:\s*,\s*[\d.]+)*)'
+
+# Per slicer (key, pattern) pairs in order of preference, the first match for a key wins
+PRUSA_PATTERNS = [
+    ('filament_length', rf'^; filament used \[mm\] = {_NUMBERS}'),
+    ('filament_volume', rf'^; filament used \[cm3\] = {_NUMBERS}'),
+    ('filament_weight', rf'^; (?:total )?filament used \[g\] = {_NUMBERS}'),
+    ('filament_cost', rf'^; total filament cost = {_NUMBERS}'),
+    ('estimated_time', r'^; estimated printing time \(normal mode\) = (.+)$'),
+    ('estimated_time', r'^; estimated printing time = (.+)$'),
+]
+
+# OrcaSlicer and Bambu Studio share PrusaSlicer's footer and add a header block
+ORCA_PATTERNS = PRUSA_PATTERNS + [
+    ('filament_length', rf'^; total filament length \[mm\] : {_NUMBERS}'),
+    ('filament_volume', rf'^; total filament volume \[cm\^3\] : {_NUMBERS}'),
+    ('filament_weight', rf'^; total filament weight \[g\] : {_NUMBERS}'),
+    ('filament_cost', rf'^; filament cost = {_NUMBERS}'),
+    ('estimated_time', r'total estimated time: ([^;\r\n]+)'),
+    ('estimated_time', r'^; model printing time: ([^;\r\n]+)'),
+    ('filament_diameter', rf'^; filament_diameter(?: =|:) {_NUMBERS}'),
+    ('filament_density', rf'^; filament_density(?: =|:) {_NUMBERS}'),
+]
+
+CURA_PATTERNS = [
+    ('estimated_seconds', r'^;TIME:([\d.]+)'),
+    ('filament_meters', r'^;Filament used: ([\d.]+m?(?:\s*,\s*[\d.]+m?)*)'),
+    ('filament_diameter', rf'^;\s*material_diameter = {_NUMBERS}'),
+]
+
+
+def _compile(patterns: list[tuple[str, str]]) -> list[tuple[str, re.Pattern]]:
+    return [(key, re.compile(pattern, re.MULTILINE)) for key, pattern in patterns]
+
+
+PATTERNS = {
+    'prusa': _compile(PRUSA_PATTERNS),
+    'orca': _compile(ORCA_PATTERNS),
+    'bambu': _compile(ORCA_PATTERNS),
+    'cura': _compile(CURA_PATTERNS),
+    'unknown': _compile(ORCA_PATTERNS + CURA_PATTERNS),
+}
+
+
+def _sum_values(value: str) -> float:
+    """Sum a comma separated per-extruder list such as '1.23, 0.5'"""
+    return sum(float(part.strip().rstrip('m')) for part in value.split(',') if part.strip().rstrip('m'))
+
+
+def detect_slicer(head: bytes, tail: bytes = b'') -> str:
+    """
+    Detect which slicer produced a G-code file from its head and tail bytes
+
+    Returns:
+        str: 'prusa', 'orca', 'bambu', 'cura' or 'unknown'
+    """
+    for slicer, signature in SLICER_SIGNATURES:
+        if signature.search(head) or signature.search(tail):
+            return slicer
+    return 'unknown'
+
+
+def parse_print_details(head: bytes, tail: bytes = b'') -> dict:
+    """
+    Extract print details from the head and tail windows of a G-code file
+
+    Args:
+        head (bytes): First bytes of the file
+        tail (bytes): Last bytes of the file, may overlap with head
+
+    Returns:
+        dict: Filament length (mm), volume (cm3), weight (g), cost, the estimated
+            time in PrusaSlicer's 'Xh Ym Zs' format and the detected slicer
+    """
+    slicer = detect_slicer(head, tail)
+    text = head.decode(errors='ignore') + '\n' + tail.decode(errors='ignore')
+
+    found = {}
+    for key, pattern in PATTERNS[slicer]:
+        if key in found:
+            continue
+        match = pattern.search(text)
+        if match:
+            found[key] = match.group(1).strip()
+
+    details = {
+        'filament_length': None,
+        'filament_volume': None,
+        'filament_weight': None,
+        'filament_cost': None,
+        'estimated_time': None,
+        'slicer': slicer,
+    }
+
+    try:
+        for key in ('filament_length', 'filament_volume', 'filament_weight', 'filament_cost'):
+            if key in found:
+                details[key] = _sum_values(found[key])
+
+        if 'estimated_time' in found:
+            # Normalize e.g. '1h 02m 03s' to PrusaSlicer's '1h 2m 3s'
+            details['estimated_time'] = seconds_to_time_str(time_str_to_seconds(found['estimated_time']))
+        elif 'estimated_seconds' in found:
+            details['estimated_time'] = seconds_to_time_str(float(found['estimated_seconds']))
+
+        if 'filament_meters' in found and details['filament_length'] is None:
+            details['filament_length'] = _sum_values(found['filament_meters']) * 1000
+    except ValueError as e:
+        logger.warning(f"Unexpected {slicer} G-code metadata: {e}")
+
+    # Cura only reports length, derive the rest from the filament settings
+    if details['filament_length'] is not None and details['filament_volume'] is None:
+        diameter = float(found['filament_diameter'].split(',')[0]) if 'filament_diameter' in found else DEFAULT_FILAMENT_DIAMETER
+        details['filament_volume'] = round(math.pi * (diameter / 2) ** 2 * details['filament_length'] / 1000, 2)
+    if details['filament_volume'] is not None and details['filament_weight'] is None:
+        density = float(found['filament_density'].split(',')[0]) if 'filament_density' in found else DEFAULT_FILAMENT_DENSITY
+        details['filament_weight'] = round(details['filament_volume'] * density, 2)
+
+    return details
+
+
+def read_windows(gcode_file_path: Path, head_size: int = HEAD_WINDOW, tail_size: int = TAIL_WINDOW) -> tuple[bytes, bytes]:
+    """Read the head and tail byte windows of a file, the tail is empty for small files"""
+    size = os.path.getsize(gcode_file_path)
+    with open(gcode_file_path, 'rb') as file:
+        head = file.read(head_size)
+        if size <= head_size:
+            return head, b''
+        file.seek(max(size - tail_size, head_size))
+        return head, file.read()
+
+
+def get_print_details(gcode_file_path: Path) -> dict:
+    """
+    Extract print details from a G-code file produced by PrusaSlicer, OrcaSlicer,
+    Bambu Studio or Cura, reading only its head and tail windows
+
+    Args:
+        gcode_file_path (str): Path to the G-code file
+
+    Returns:
+        dict: Dictionary containing print time, filament length, volume, weight and cost
+    """
+    try:
+        head, tail = read_windows(gcode_file_path)
+        return parse_print_details(head, tail)
+    except OSError as e:
+        logger.error(f"Error reading G-code file: {e}")
+        return {
+            'filament_length': None,
+            'filament_volume': None,
+            'filament_weight': None,
+            'filament_cost': None,
+            'estimated_time': None,
+            'slicer': None,
+        }
+
+
+def sidecar_path(gcode_path: str) -> str:
+    """Storage path of the metadata sidecar of a G-code file"""
+    return f"{gcode_path}{SIDECAR_SUFFIX}"
+
+
+def scan_gcode(gcode_file_path: Path, chunk_size: int = 1024 ** 2) -> dict:
+    """
+    Hash a G-code file and count its layers in one chunked pass
+
+    Returns:
+        dict: The file's size in bytes, its MD5 hex digest and its layer count,
+            None when the file has no layer change comments
+    """
+    digest = hashlib.md5()
+    layers = 0
+    size = 0
+    # A marker on the very first line has no newline before it
+    carry = b'\n'
+    overlap = max(len(marker) for marker in LAYER_MARKERS) - 1
+    with open(gcode_file_path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+            size += len(chunk)
+            # The carried bytes are shorter than a marker, so nothing is counted twice
+            window = carry + chunk
+            layers += sum(window.count(marker) for marker in LAYER_MARKERS)
+            carry = window[-overlap:]
+    return {'gcode_bytes': size, 'gcode_md5': digest.hexdigest(), 'layer_count': layers or None}
+
+
+def build_sidecar(gcode_file_path: Path, config_path: Path = None) -> dict:
+    """
+    Metadata of a freshly sliced G-code, stored next to it so quotes don't need the file
+
+    Args:
+        gcode_file_path (Path): The sliced G-code
+        config_path (Path, optional): Slicer config it was sliced with, hashed to tell slices apart
+
+    Returns:
+        dict: Estimated time, filament length, volume, weight and cost, layer count,
+            config hash, and the size and MD5 of the G-code it describes
+    """
+    details = get_print_details(gcode_file_path)
+    config_hash = None
+    if config_path is not None and os.path.exists(config_path):
+        with open(config_path, 'rb') as file:
+            config_hash = hashlib.sha256(file.read()).hexdigest()
+
+    return {
+        'version': SIDECAR_VERSION,
+        **details,
+        'estimated_time_seconds': time_str_to_seconds(details['estimated_time']) if details['estimated_time'] else None,
+        **scan_gcode(gcode_file_path),
+        'config_hash': config_hash,
+    }
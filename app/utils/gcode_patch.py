@@ -0,0 +1,113 @@
+import re
+from pathlib import Path
+from typing import Optional
+
+# Bytes read per chunk while patching
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Nozzle heater commands, M140/M190 drive the bed
+NOZZLE_COMMANDS = (b'M104', b'M109')
+
+# Anchored on a literal newline rather than ^ so the regex engine can skip
+# ahead with a fast substring search, about 10x quicker on large files
+TEMPERATURE_COMMAND = re.compile(rb'\n(M104|M109|M140|M190)([ \t][^;\n]*?)?([SR])(\d+(?:\.\d*)?)')
+SETTING_COMMENT = re.compile(
+    rb'\n; (temperature|first_layer_temperature|bed_temperature|first_layer_bed_temperature) = ([\d.,]+)'
+)
+
+
+def temperature_replacements(old: dict, new: dict) -> Optional[dict]:
+    """
+    Map the temperatures a G-code was sliced with to the requested ones
+
+    Args:
+        old (dict): Temperature settings the G-code was sliced with
+        new (dict): Requested temperature settings
+
+    Returns:
+        dict: {'nozzle': {old: new}, 'bed': {old: new}}, or None when two settings
+            shared a value in the old G-code but need different new values, so the
+            commands can't be told apart
+    """
+    groups = {
+        'nozzle': ('temperature', 'first_layer_temperature'),
+        'bed': ('bed_temperature', 'first_layer_bed_temperature'),
+    }
+    replacements = {}
+    for group, keys in groups.items():
+        mapping = {}
+        for key in keys:
+            before, after = int(old[key]), int(new[key])
+            if mapping.get(before, after) != after:
+                return None
+            mapping[before] = after
+        replacements[group] = {before: after for before, after in mapping.items() if before != after}
+    return replacements
+
+
+def patch_temperatures(source: Path, destination: Path, old: dict, new: dict) -> Optional[dict]:
+    """
+    Copy a G-code file, rewriting its heater commands for new temperatures.
+
+    Runs as a single streaming pass over fixed size chunks, only the heater
+    commands (M104/M109 for the nozzle, M140/M190 for the bed) and the settings
+    comments are touched. Heater off commands (S0) and values that don't belong
+    to a setting are left alone.
+
+    Args:
+        source (Path): G-code sliced with the `old` temperatures
+        destination (Path): Where to write the patched G-code
+        old (dict): Temperature settings `source` was sliced with
+        new (dict): Requested temperature settings
+
+    Returns:
+        dict: Number of patched nozzle and bed commands, or None when the G-code
+            can't be patched reliably and should be re-sliced
+    """
+    replacements = temperature_replacements(old, new)
+    if replacements is None:
+        return None
+
+    counts = {'nozzle': 0, 'bed': 0}
+
+    def patch_command(match: re.Match) -> bytes:
+        group = 'nozzle' if match.group(1) in NOZZLE_COMMANDS else 'bed'
+        value = float(match.group(4))
+        if value != int(value) or int(value) not in replacements[group]:
+            return match.group(0)
+        counts[group] += 1
+        prefix = match.group(0)[:match.start(4) - match.start(0)]
+        return prefix + str(replacements[group][int(value)]).encode()
+
+    def patch_setting(match: re.Match) -> bytes:
+        key = match.group(1).decode()
+        values = ','.join(str(new[key]) for _ in match.group(2).split(b','))
+        return b'\n; ' + match.group(1) + b' = ' + values.encode()
+
+    def patch_lines(lines: bytes) -> bytes:
+        # Every chunk starts at a line start, the added newline lets the first line match
+        patched = TEMPERATURE_COMMAND.sub(patch_command, b'\n' + lines)
+        return SETTING_COMMENT.sub(patch_setting, patched)[1:]
+
+    remainder = b''
+    with open(source, 'rb') as reader, open(destination, 'wb') as writer:
+        while True:
+            data = reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            data = remainder + data
+            cut = data.rfind(b'\n') + 1
+            remainder = data[cut:]
+            writer.write(patch_lines(data[:cut]))
+
+        if remainder:
+            writer.write(patch_lines(remainder))
+
+    # A changed temperature that never shows up means the heaters are driven by
+    # something we don't understand (e.g. a custom start G-code macro)
+    for group in counts:
+        if replacements[group] and not counts[group]:
+            Path(destination).unlink(missing_ok=True)
+            return None
+
+    return counts
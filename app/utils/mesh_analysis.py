@@ -0,0 +1,586 @@
+import io
+import os
+import hashlib
+import numpy as np
+from pathlib import Path
+from stl import mesh
+
+# Yaw steps about Z tried for every "down" direction, 90 degrees apart from
+# each other only swap X and Y so half a turn covers rectangular beds
+YAW_ANGLES = np.radians(np.arange(0, 180, 15))
+
+# Keep the (vertices x candidates) projection below this many floats per chunk
+MAX_PROJECTION_SIZE = 8_000_000
+
+# Record layout of a binary STL after its 84 byte header
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attributes', '<u2')])
+
+# Relative step sizes (volume, area, inertia) are quantized to, and the absolute
+# step for the normalized third order invariants
+FINGERPRINT_TOLERANCE = 1e-3
+
+
+def load_triangles(stl_file_path) -> np.ndarray:
+    """
+    Load the triangles of an STL file
+
+    Args:
+        stl_file_path (Path): Path to the STL file
+
+    Returns:
+        np.ndarray: (F, 3, 3) array of triangle vertices
+    """
+    model = mesh.Mesh.from_file(Path(stl_file_path))
+    return model.vectors.astype(np.float64)
+
+
+def stl_triangle_count(stl_file_path) -> int:
+    """
+    Number of triangles in an STL file without parsing it
+
+    Binary files carry the count in their header, ASCII files are scanned for
+    'endfacet' in chunks.
+    """
+    size = os.path.getsize(stl_file_path)
+    with open(stl_file_path, 'rb') as file:
+        header = file.read(84)
+        if len(header) == 84:
+            count = int.from_bytes(header[80:84], 'little')
+            if size == 84 + 50 * count:
+                return count
+
+        file.seek(0)
+        count, carry = 0, b''
+        while True:
+            chunk = file.read(16 * 1024 * 1024)
+            if not chunk:
+                return count
+            data = carry + chunk
+            count += data.count(b'endfacet')
+            carry = data[-7:]
+
+
+def stl_statistics(stl_file_path) -> dict:
+    """
+    Triangle count and bounding box size of an STL file, what the slice scheduler
+    predicts slicing time from
+
+    Binary files are memory mapped and only their vertex columns are read, ASCII
+    files are parsed.
+
+    Returns:
+        dict: `triangles` and `dimensions` (x, y, z) in mm
+    """
+    triangles = stl_triangle_count(stl_file_path)
+    if triangles and os.path.getsize(stl_file_path) == 84 + 50 * triangles:
+        records = np.memmap(stl_file_path, dtype=STL_RECORD, mode='r', offset=84, shape=(triangles,))
+        vertices = records['vertices'].reshape(-1, 3)
+    elif triangles:
+        vertices = load_triangles(stl_file_path).reshape(-1, 3)
+    else:
+        return {'triangles': 0, 'dimensions': (0.0, 0.0, 0.0)}
+
+    size = vertices.max(axis=0).astype(np.float64) - vertices.min(axis=0)
+    return {'triangles': triangles, 'dimensions': tuple(round(float(value), 3) for value in size)}
+
+
+def triangles_from_bytes(data: bytes) -> np.ndarray:
+    """
+    Parse the triangles of an STL file held in memory
+
+    Args:
+        data (bytes): Contents of an ASCII or binary STL file
+
+    Returns:
+        np.ndarray: (F, 3, 3) array of triangle vertices
+    """
+    model = mesh.Mesh.from_file('upload.stl', fh=io.BytesIO(data))
+    return model.vectors.astype(np.float64)
+
+
+def face_normals_and_areas(triangles: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute unit face normals and face areas
+
+    Args:
+        triangles (np.ndarray): (F, 3, 3) array of triangle vertices
+
+    Returns:
+        tuple: (F, 3) unit normals and (F,) areas
+    """
+    cross = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    norms = np.linalg.norm(cross, axis=1)
+    areas = norms / 2
+    normals = np.divide(cross, norms[:, None], out=np.zeros_like(cross), where=norms[:, None] > 0)
+    return normals, areas
+
+
+def rotation_to_down(direction: np.ndarray) -> np.ndarray:
+    """
+    Rotation matrix that maps `direction` onto -Z (the build plate)
+
+    Args:
+        direction (np.ndarray): Unit vector that should face the bed
+
+    Returns:
+        np.ndarray: (3, 3) rotation matrix
+    """
+    target = np.array([0.0, 0.0, -1.0])
+    v = np.cross(direction, target)
+    c = float(np.dot(direction, target))
+
+    if np.linalg.norm(v) < 1e-9:
+        if c > 0:
+            return np.eye(3)
+        # Upside down, flip about X
+        return np.diag([1.0, -1.0, -1.0])
+
+    vx = np.array([
+        [0, -v[2], v[1]],
+        [v[2], 0, -v[0]],
+        [-v[1], v[0], 0],
+    ])
+    return np.eye(3) + vx + vx @ vx * (1 / (1 + c))
+
+
+def candidate_down_directions(normals: np.ndarray, areas: np.ndarray, n_faces: int = 16) -> np.ndarray:
+    """
+    Candidate directions to place against the bed.
+
+    Combines the 26 axis, edge and corner directions of a cube with the
+    normals of the largest flat regions of the model, which are the most
+    likely stable resting faces. The original orientation (-Z down) is first.
+
+    Returns:
+        np.ndarray: (D, 3) unit vectors
+    """
+    grid = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij')).reshape(3, -1).T
+    grid = grid[np.any(grid != 0, axis=1)].astype(np.float64)
+    grid /= np.linalg.norm(grid, axis=1)[:, None]
+
+    # Group faces by quantized normal and keep the directions with the most area
+    if len(areas):
+        keys = np.round(normals * 20).astype(np.int64) + 20
+        keys = (keys[:, 0] * 41 + keys[:, 1]) * 41 + keys[:, 2]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        region_area = np.bincount(inverse, weights=areas)
+        top = np.argsort(region_area)[::-1][:n_faces]
+        region_normals = np.stack([
+            np.bincount(inverse, weights=normals[:, axis] * areas, minlength=len(unique_keys))
+            for axis in range(3)
+        ], axis=1)[top]
+        lengths = np.linalg.norm(region_normals, axis=1)
+        region_normals = region_normals[lengths > 0] / lengths[lengths > 0, None]
+    else:
+        region_normals = np.empty((0, 3))
+
+    directions = np.vstack([[0.0, 0.0, -1.0], grid, region_normals])
+
+    # Drop near duplicates while keeping the first occurrence
+    _, first = np.unique(np.round(directions, 3), axis=0, return_index=True)
+    return directions[np.sort(first)]
+
+
+def projected_extents(points: np.ndarray, axes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Minimum and maximum of `points` projected on each of `axes`, in bounded chunks
+
+    Args:
+        points (np.ndarray): (N, 3) points
+        axes (np.ndarray): (K, 3) projection axes
+
+    Returns:
+        tuple: (K,) minimums and (K,) maximums
+    """
+    lows = np.empty(len(axes))
+    highs = np.empty(len(axes))
+    points_t = np.ascontiguousarray(points.T, dtype=np.float32)
+    axes = axes.astype(np.float32)
+    chunk = max(1, MAX_PROJECTION_SIZE // max(len(points), 1))
+    for start in range(0, len(axes), chunk):
+        projected = axes[start:start + chunk] @ points_t
+        lows[start:start + chunk] = projected.min(axis=1)
+        highs[start:start + chunk] = projected.max(axis=1)
+    return lows, highs
+
+
+def overhang_areas(
+        triangles: np.ndarray,
+        normals: np.ndarray,
+        areas: np.ndarray,
+        up_axes: np.ndarray,
+        z_min: np.ndarray,
+        overhang_threshold: float = 45.0,
+    ) -> np.ndarray:
+    """
+    Downward facing area steeper than the threshold for each candidate up axis.
+
+    Faces resting on the bed (at the lowest Z of the candidate) are supported
+    by the bed itself and are not counted.
+
+    Args:
+        triangles (np.ndarray): (F, 3, 3) array of triangle vertices
+        normals (np.ndarray): (F, 3) unit face normals
+        areas (np.ndarray): (F,) face areas
+        up_axes (np.ndarray): (D, 3) unit vectors that become +Z
+        z_min (np.ndarray): (D,) lowest vertex height for each up axis
+        overhang_threshold (float): Slope in degrees from horizontal below which faces need support
+
+    Returns:
+        np.ndarray: (D,) overhang area in mm^2
+    """
+    limit = -np.cos(np.radians(overhang_threshold))
+    centroids = triangles.mean(axis=1)
+    result = np.empty(len(up_axes))
+    chunk = max(1, MAX_PROJECTION_SIZE // max(len(areas), 1))
+    for start in range(0, len(up_axes), chunk):
+        axes = up_axes[start:start + chunk]
+        normal_z = normals @ axes.T
+        face_z = centroids @ axes.T
+        overhanging = (normal_z < limit) & (face_z > z_min[start:start + chunk] + 1e-3)
+        result[start:start + chunk] = areas @ overhanging
+    return result
+
+
+def analyze_overhangs(
+        triangles: np.ndarray,
+        overhang_threshold: float = 45.0,
+        min_support_area: float = 10.0,
+    ) -> dict:
+    """
+    Overhang analysis of a mesh in its current orientation.
+
+    Args:
+        triangles (np.ndarray): (F, 3, 3) array of triangle vertices
+        overhang_threshold (float): Slope in degrees from horizontal below which faces need support
+        min_support_area (float): Overhang area in mm^2 from which supports are recommended
+
+    Returns:
+        dict: Overhang and total area in mm^2, the fraction of the surface needing
+            support and whether supports are recommended
+    """
+    normals, areas = face_normals_and_areas(triangles)
+    up = np.array([[0.0, 0.0, 1.0]])
+    z_min, _ = projected_extents(triangles.reshape(-1, 3), up)
+    overhang = float(overhang_areas(triangles, normals, areas, up, z_min, overhang_threshold)[0])
+    total_area = float(areas.sum())
+
+    return {
+        'overhang_threshold': float(overhang_threshold),
+        'overhang_area': overhang,
+        'total_area': total_area,
+        'overhang_fraction': overhang / total_area if total_area else 0.0,
+        'needs_support': overhang >= min_support_area,
+    }
+
+
+def _orientation_candidates(
+        triangles: np.ndarray,
+        overhang_threshold: float = 45.0,
+        height_weight: float = 0.5,
+    ) -> dict:
+    """
+    Candidate rotations of a mesh with their height, overhang and score.
+
+    Every candidate is a "down" direction combined with a yaw about Z. Height
+    and overhang area only depend on the down direction. The score is the
+    overhang fraction plus a weighted relative height, rounded so near ties
+    keep the earlier (original) orientation.
+    """
+    normals, areas = face_normals_and_areas(triangles)
+    total_area = float(areas.sum()) or 1.0
+    vertices = triangles.reshape(-1, 3)
+
+    directions = candidate_down_directions(normals, areas)
+    down_rotations = np.stack([rotation_to_down(d) for d in directions])  # (D, 3, 3)
+    up_axes = down_rotations[:, 2, :]
+
+    z_min, z_max = projected_extents(vertices, up_axes)
+    heights = z_max - z_min
+    overhang = overhang_areas(triangles, normals, areas, up_axes, z_min, overhang_threshold)
+
+    low, high = projected_extents(vertices, np.eye(3))
+    diagonal = float(np.linalg.norm(high - low)) or 1.0
+    score = np.round(overhang / total_area + height_weight * heights / diagonal, 6)
+
+    # X and Y axes of every (down direction, yaw) pair
+    cos_yaw, sin_yaw = np.cos(YAW_ANGLES), np.sin(YAW_ANGLES)
+    yaw_x = np.stack([cos_yaw, -sin_yaw, np.zeros_like(cos_yaw)], axis=1)  # (Y, 3)
+    yaw_y = np.stack([sin_yaw, cos_yaw, np.zeros_like(cos_yaw)], axis=1)
+
+    return {
+        'vertices': vertices,
+        'total_area': total_area,
+        'up_axes': up_axes,
+        'heights': heights,
+        'overhang': overhang,
+        'score': score,
+        'x_axes': np.einsum('yj,djk->dyk', yaw_x, down_rotations),  # (D, Y, 3)
+        'y_axes': np.einsum('yj,djk->dyk', yaw_y, down_rotations),
+    }
+
+
+def _orientation_result(candidates: dict, down_index: int, yaw_index: int, extent_x: float, extent_y: float, fits: bool) -> dict:
+    rotation = np.stack([
+        candidates['x_axes'][down_index, yaw_index],
+        candidates['y_axes'][down_index, yaw_index],
+        candidates['up_axes'][down_index],
+    ])
+    overhang = candidates['overhang'][down_index]
+    return {
+        'fits': fits,
+        'rotation': rotation,
+        'is_original': bool(np.allclose(rotation, np.eye(3))),
+        'dimensions': {
+            'x': float(extent_x),
+            'y': float(extent_y),
+            'z': float(candidates['heights'][down_index]),
+        },
+        'overhang_area': float(overhang),
+        'overhang_fraction': float(overhang / candidates['total_area']),
+    }
+
+
+def evaluate_orientations(
+        triangles: np.ndarray,
+        bed_size: tuple,
+        overhang_threshold: float = 45.0,
+        height_weight: float = 0.5,
+        sample_size: int = 20000,
+    ) -> dict:
+    """
+    Evaluate many candidate rotations of a mesh at once and pick the best one.
+
+    Every candidate is a "down" direction combined with a yaw about Z. Height
+    and overhang area only depend on the down direction and are computed
+    exactly for all of them. The X/Y extents of every (down, yaw) pair are
+    first bounded from below on a vertex sample, which rules out candidates
+    that cannot fit, and then checked exactly in score order until one fits.
+    The score is the overhang fraction plus a weighted relative height, and
+    the original orientation wins ties.
+
+    Args:
+        triangles (np.ndarray): (F, 3, 3) array of triangle vertices
+        bed_size (tuple): (x, y, z) build volume in mm
+        overhang_threshold (float): Slope in degrees from horizontal below which faces need support
+        height_weight (float): Weight of the relative print height in the score
+        sample_size (int): Number of vertices used for the X/Y lower bounds
+
+    Returns:
+        dict: Best orientation with its rotation matrix, dimensions, overhang area and fit status
+    """
+    bed = np.asarray(bed_size, dtype=np.float64)
+    candidates = _orientation_candidates(triangles, overhang_threshold, height_weight)
+    vertices = candidates['vertices']
+    x_axes, y_axes = candidates['x_axes'], candidates['y_axes']
+    heights, score = candidates['heights'], candidates['score']
+    n_down, n_yaw = x_axes.shape[:2]
+
+    # Lower bounds of the X/Y extents from a vertex sample
+    if len(vertices) > sample_size:
+        sample = vertices[np.random.default_rng(0).choice(len(vertices), sample_size, replace=False)]
+    else:
+        sample = vertices
+    axes = np.concatenate([x_axes.reshape(-1, 3), y_axes.reshape(-1, 3)])
+    lows, highs = projected_extents(sample, axes)
+    bounds = (highs - lows).reshape(2, n_down, n_yaw)
+    may_fit = (bounds[0] <= bed[0]) & (bounds[1] <= bed[1]) & (heights <= bed[2])[:, None]
+
+    best = None
+    for down_index in np.argsort(score, kind='stable'):
+        yaws = np.flatnonzero(may_fit[down_index])
+        if not len(yaws):
+            continue
+        x_low, x_high = projected_extents(vertices, x_axes[down_index, yaws])
+        y_low, y_high = projected_extents(vertices, y_axes[down_index, yaws])
+        fitting = np.flatnonzero((x_high - x_low <= bed[0]) & (y_high - y_low <= bed[1]))
+        if len(fitting):
+            i = fitting[0]
+            best = (down_index, yaws[i], x_high[i] - x_low[i], y_high[i] - y_low[i])
+            break
+
+    fits = best is not None
+    if not fits:
+        # Report the lowest scoring orientation in its original yaw
+        down_index = int(np.argmin(score))
+        x_low, x_high = projected_extents(vertices, x_axes[down_index, :1])
+        y_low, y_high = projected_extents(vertices, y_axes[down_index, :1])
+        best = (down_index, 0, (x_high - x_low)[0], (y_high - y_low)[0])
+
+    result = _orientation_result(candidates, *best, fits=fits)
+    result['candidates_evaluated'] = int(n_down * n_yaw)
+    return result
+
+
+def fit_matrix(
+        triangles: np.ndarray,
+        bed_sizes: np.ndarray,
+        overhang_threshold: float = 45.0,
+        height_weight: float = 0.5,
+    ) -> dict:
+    """
+    Check a mesh against many build volumes at once.
+
+    The exact X/Y/Z extents of every candidate orientation are computed once,
+    then compared with all beds in a single broadcast. For each bed the best
+    scoring orientation that fits is picked, as in `evaluate_orientations`.
+
+    Args:
+        triangles (np.ndarray): (F, 3, 3) array of triangle vertices
+        bed_sizes (np.ndarray): (P, 3) build volumes in mm
+        overhang_threshold (float): Slope in degrees from horizontal below which faces need support
+        height_weight (float): Weight of the relative print height in the score
+
+    Returns:
+        dict: 'fits_as_is' (P,) and 'fits' (P,) booleans, 'orientations' with the best
+            orientation per bed (None when nothing fits) and 'candidates_evaluated'
+    """
+    beds = np.asarray(bed_sizes, dtype=np.float64).reshape(-1, 3)
+    candidates = _orientation_candidates(triangles, overhang_threshold, height_weight)
+    vertices = candidates['vertices']
+    x_axes, y_axes = candidates['x_axes'], candidates['y_axes']
+    n_down, n_yaw = x_axes.shape[:2]
+
+    lows, highs = projected_extents(vertices, np.concatenate([x_axes.reshape(-1, 3), y_axes.reshape(-1, 3)]))
+    extents = (highs - lows).reshape(2, n_down, n_yaw)
+
+    # (P, D, Y) fit of every bed against every candidate
+    fits = (
+        (extents[0][None] <= beds[:, 0, None, None])
+        & (extents[1][None] <= beds[:, 1, None, None])
+        & (candidates['heights'][None, :, None] <= beds[:, 2, None, None])
+    )
+    any_yaw = fits.any(axis=2)
+    masked_score = np.where(any_yaw, candidates['score'][None], np.inf)
+    best_down = np.argmin(masked_score, axis=1)
+    fits_any = any_yaw.any(axis=1)
+
+    orientations = []
+    for bed_index, down_index in enumerate(best_down):
+        if not fits_any[bed_index]:
+            orientations.append(None)
+            continue
+        yaw_index = int(np.argmax(fits[bed_index, down_index]))
+        orientations.append(_orientation_result(
+            candidates, down_index, yaw_index,
+            extents[0, down_index, yaw_index], extents[1, down_index, yaw_index],
+            fits=True,
+        ))
+
+    return {
+        'fits_as_is': fits[:, 0, 0],
+        'fits': fits_any,
+        'orientations': orientations,
+        'candidates_evaluated': int(n_down * n_yaw),
+    }
+
+
+def rotate_stl(stl_file_path, rotation: np.ndarray, output_path=None):
+    """
+    Rotate an STL file in place (or into `output_path`) and rest it on Z=0
+
+    Args:
+        stl_file_path (Path): Path to the STL file
+        rotation (np.ndarray): (3, 3) rotation matrix
+        output_path (Path, optional): Where to write the rotated STL
+    """
+    model = mesh.Mesh.from_file(Path(stl_file_path))
+    vectors = model.vectors.reshape(-1, 3) @ rotation.T
+    vectors[:, 2] -= vectors[:, 2].min()
+    model.vectors[:] = vectors.reshape(-1, 3, 3)
+    model.update_normals()
+    model.save(str(output_path or stl_file_path))
+
+
+def volume_moments(triangles: np.ndarray) -> tuple[float, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Exact volume moments of a closed mesh up to third order.
+
+    Each face forms a signed tetrahedron with the origin, integrated with a
+    five point cubature rule that is exact for cubic polynomials. Re-triangulating
+    the same surface or reordering the faces does not change the result.
+
+    Args:
+        triangles (np.ndarray): (F, 3, 3) array of triangle vertices
+
+    Returns:
+        tuple: Volume, (3,) first, (3, 3) second and (3, 3, 3) third moments about the origin
+    """
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    volumes = np.einsum('ij,ij->i', a, np.cross(b, c)) / 6
+    s = a + b + c
+
+    # Keast's degree 3 rule: the centroid and the points halfway towards each vertex
+    points = np.concatenate([s / 4, s / 6, a / 3 + s / 6, b / 3 + s / 6, c / 3 + s / 6])
+    weights = np.concatenate([-0.8 * volumes] + [0.45 * volumes] * 4)
+
+    weighted = points * weights[:, None]
+    volume = volumes.sum()
+    first = weighted.sum(axis=0)
+    second = weighted.T @ points
+    third = np.stack([(weighted * points[:, [axis]]).T @ points for axis in range(3)])
+
+    return float(volume), first, second, third
+
+
+def geometry_fingerprint(triangles: np.ndarray, tolerance: float = FINGERPRINT_TOLERANCE) -> dict:
+    """
+    Rotation and translation invariant fingerprint of a closed mesh.
+
+    Uses the volume, surface area, principal moments of inertia and two
+    rotation invariants of the third order central moment tensor (its norm and
+    the norm of its trace vector), normalized by the part's size. Everything is
+    quantized to `tolerance` so the same part re-exported rotated, moved or with
+    its faces reordered or re-triangulated maps to the same hash. Mirror images
+    share a fingerprint too, which is fine for quoting.
+
+    Args:
+        triangles (np.ndarray): (F, 3, 3) array of triangle vertices
+        tolerance (float): Relative quantization step
+
+    Returns:
+        dict: fingerprint (hex digest) and the unquantized descriptor values
+    """
+    # Moments about the bounding box center keep the sums well conditioned
+    points = triangles.reshape(-1, 3)
+    triangles = triangles - (points.min(axis=0) + points.max(axis=0)) / 2
+
+    _, areas = face_normals_and_areas(triangles)
+    # Signed volume, so meshes wound inwards normalize to the same moments
+    volume, first, second, third = volume_moments(triangles)
+    if abs(volume) <= 0:
+        raise ValueError("Mesh encloses no volume")
+
+    center = first / volume
+    mean_outer = second / volume
+    covariance = mean_outer - np.outer(center, center)
+    e3 = (
+        third / volume
+        - np.einsum('i,jk->ijk', center, mean_outer)
+        - np.einsum('j,ik->ijk', center, mean_outer)
+        - np.einsum('k,ij->ijk', center, mean_outer)
+        + 2 * np.einsum('i,j,k->ijk', center, center, center)
+    )
+    volume = abs(volume)
+
+    principal = np.sort(np.clip(np.linalg.eigvalsh(covariance), 0, None))
+    scale = float(np.sqrt(principal.sum()))
+    skew = float(np.sqrt((e3 ** 2).sum())) / scale ** 3
+    skew_trace = float(np.linalg.norm(np.einsum('ijj->i', e3))) / scale ** 3
+
+    descriptor = {
+        'volume': volume,
+        'surface_area': float(areas.sum()),
+        'principal_moments': [float(m) for m in principal],
+        'skew': skew,
+        'skew_trace': skew_trace,
+    }
+
+    log_step = np.log1p(tolerance)
+    quantized = [
+        int(round(np.log(value) / log_step)) if value > 0 else 0
+        for value in (volume, descriptor['surface_area'], *principal)
+    ] + [int(round(skew / tolerance)), int(round(skew_trace / tolerance))]
+
+    digest = hashlib.sha256(','.join(map(str, quantized)).encode()).hexdigest()
+    return {'fingerprint': digest, **descriptor}
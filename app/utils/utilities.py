@@ -1,9 +1,9 @@
+import os
 import sys
-import time
 import shutil
+import asyncio
 import logging
 import subprocess
-from stl import mesh
 from pathlib import Path
 from io import BytesIO
 from typing import Union
@@ -12,50 +12,6 @@ from fastapi import UploadFile
 
 logger = logging.getLogger(__name__)
 
-def get_prusa_print_details(
-        gcode_file_path : Path
-    ):
-    """
-    Extract print details like time and filament usage from a G-code file
-    
-    Args:
-        gcode_file_path (str): Path to the G-code file
-        
-    Returns:
-        dict: Dictionary containing print time, filament length, and weight
-    """
-    details = {
-        'filament_length': None,
-        'filament_volume': None,
-        'filament_weight': None,
-        'filament_cost': None,
-        'estimated_time': None,
-    }
-    
-    try:
-        with open(gcode_file_path, 'r') as file:
-            for line in file:
-                if line.startswith('; filament used [mm]'):
-                    details['filament_length'] = float(line.split('=')[1].strip())
-
-                elif line.startswith('; filament used [cm3]'):
-                    details['filament_volume'] = float(line.split('=')[1].strip())
-
-                elif line.startswith('; filament used [g]'):
-                    details['filament_weight'] = float(line.split('=')[1].strip())
-
-                elif line.startswith('; total filament cost'):
-                    details['filament_cost'] = float(line.split('=')[1].strip())
-                
-                elif line.startswith('; estimated printing time'):
-                    details['estimated_time'] = line.split('=')[1].strip()
-                    break # Last line we need, so we can break here        
-        return details
-    except Exception as e:
-        print(f"Error parsing G-code file: {e}")
-        return details
-
-
 def time_str_to_seconds(time_str):
     """
     Convert a time string in format '36m 28s' to total seconds
@@ -83,9 +39,34 @@ def time_str_to_seconds(time_str):
     return seconds
 
 
+def seconds_to_time_str(seconds):
+    """
+    Convert total seconds to a time string in PrusaSlicer's format, e.g. '1h 36m 28s'
+    
+    Args:
+        seconds (float): Total time in seconds
+        
+    Returns:
+        str: Time string in format 'Xd Xh Xm Xs', largest units omitted when zero
+    """
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+
+    parts = []
+    for value, unit in ((days, 'd'), (hours, 'h'), (minutes, 'm')):
+        if value or parts:
+            parts.append(f"{value}{unit}")
+    parts.append(f"{seconds}s")
+    return ' '.join(parts)
+
+
 def check_printability(
         stl_file_path, 
-        printer_dimensions=(210, 210, 250)
+        printer_dimensions=(210, 210, 250),
+        auto_orient=False,
+        overhang_threshold=45,
     ):
     """
     Check if an STL file's dimensions are within the printer's build volume
@@ -93,10 +74,16 @@ def check_printability(
     Args:
         stl_file_path (Path): Path to the STL file to check
         printer_dimensions (tuple): (x, y, z) dimensions of printer build volume in mm
+        auto_orient (bool): Also search for the best orientation when checking the fit
+        overhang_threshold (float): Overhang slope in degrees from horizontal below which supports are needed
         
     Returns:
         dict: Printability assessment with dimensions and status
     """
+    # Imported here so starting the API doesn't pay for numpy and numpy-stl
+    from stl import mesh
+    from app.utils.mesh_analysis import evaluate_orientations, analyze_overhangs
+
     try:         
         # Load the STL file
         model = mesh.Mesh.from_file(Path(stl_file_path))
@@ -140,7 +127,16 @@ def check_printability(
                 'y': float(printer_dimensions[1]),
                 'z': float(printer_dimensions[2])
             },
-            'exceeded_dimensions': exceeded_dimensions
+            'exceeded_dimensions': exceeded_dimensions,
+            'overhang': analyze_overhangs(
+                triangles=model.vectors.astype(float),
+                overhang_threshold=overhang_threshold,
+            ),
+            'orientation': evaluate_orientations(
+                triangles=model.vectors.astype(float),
+                bed_size=printer_dimensions,
+                overhang_threshold=overhang_threshold,
+            ) if auto_orient else None
         }
     except Exception as e:
         logger.error(f"Error checking STL dimensions: {str(e)}")
@@ -183,6 +179,40 @@ async def convert_path_to_upload_file(file_path: Union[str, Path]) -> UploadFile
     return upload_file
 
 
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def process_directory(root: Path) -> Path:
+    """
+    Directory of the current process under `root`, for node local files whose index only lives in memory
+
+    Every API and worker process gets its own, so a process starting never deletes
+    files another one still serves. Directories left by processes that are gone,
+    and files from before the per process layout, are removed.
+
+    Args:
+        root (Path): Directory shared by the processes of the node
+
+    Returns:
+        Path: `root/<pid>`, created
+    """
+    root = Path(root)
+    if root.is_dir():
+        for child in root.iterdir():
+            if not child.is_dir():
+                child.unlink(missing_ok=True)
+            elif not child.name.isdigit() or (int(child.name) != os.getpid() and not _process_alive(int(child.name))):
+                shutil.rmtree(child, ignore_errors=True)
+    directory = root / str(os.getpid())
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
 def cleanup_files(user_id: str):
     """
     Clean up temporary files for a user and remove the directory
@@ -200,32 +230,40 @@ def cleanup_files(user_id: str):
 
 
 # Define a cleanup function
-def cleanup_after_download(user_id: str):
+async def cleanup_after_download(user_id: str):
     """Delete a file after it has been downloaded"""
-    # Small delay to ensure file has been served
-    time.sleep(1)
-    
-    # Define the directory to clean up
-    temp_dir = Path(f"/app/app/db/temp/{user_id}")
+    # Small delay to ensure file has been served, without holding a thread or the event loop
+    await asyncio.sleep(1)
     
-    # Check if the directory exists
-    if temp_dir.exists():
-        # Remove the directory and its contents
-        shutil.rmtree(temp_dir)
+    # Removing a large directory tree blocks, keep it off the event loop
+    await asyncio.to_thread(cleanup_files, user_id=user_id)
 
 
 def shell(
-    command: str, hide_stdout: bool = False, stream: bool = False, **kwargs
+    command: str, hide_stdout: bool = False, stream: bool = False, job=None, **kwargs
 ) -> list[str]:  # type: ignore
     """
     Runs the command is a fully qualified shell.
 
     Args:
         command (str): A command.
+        job (SliceJob, optional): Job to attach the process to so it can be killed
+            and have its resource usage recorded. Its `memory_limit_mb` caps the
+            data segment of the command.
 
     Raises:
         OSError: The error cause by the shell.
     """
+    if os.name != 'nt':
+        # Own process group so the shell and everything it spawns can be killed together
+        kwargs.setdefault('start_new_session', True)
+
+        if job is not None and job.memory_limit_mb:
+            # Set by the shell before the command starts, inherited by everything it runs.
+            # RLIMIT_DATA rather than RLIMIT_AS, the slicer reserves far more address
+            # space than it ever touches
+            command = f"ulimit -d {job.memory_limit_mb * 1024} && {command}"
+
     process = subprocess.Popen(
         command,
         shell=True,
@@ -235,15 +273,27 @@ def shell(
         **kwargs,
     )
 
+    if job is not None:
+        job.attach(process)
+
     output = []
     for line in iter(process.stdout.readline, ""):  # type: ignore
         output += [line.rstrip()]
+        if job is not None:
+            job.on_line(line)
         if not hide_stdout:
             sys.stdout.write(line)
         if stream:
             yield line.rstrip()  # type: ignore
 
-    process.wait()
+    if os.name != 'nt':
+        # Reap the child ourselves to get its resource usage
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if job is not None:
+            job.record_exit(rusage, process.returncode)
+    else:
+        process.wait()
 
     if process.returncode != 0:
         raise OSError("\n".join(output))
@@ -252,7 +302,8 @@ def shell(
 
 def fancy_shell(
     command: str,
+    job=None,
     **kwargs,
 ):
-    for line in shell(command, hide_stdout=True, stream=True, **kwargs):
+    for line in shell(command, hide_stdout=True, stream=True, job=job, **kwargs):
         print(line)
\ No newline at end of file
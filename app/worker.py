@@ -0,0 +1,155 @@
+"""
+Slicer worker, runs PrusaSlicer for API processes sharing its worker queue.
+
+Claims slice jobs from the queue named by --queue (defaults to the
+WORKER_QUEUE_URL setting), slices each with the model, config and parameters
+the API stored next to it and hands back the G-code with the slicer's CPU
+time, wall time and peak memory. Running jobs are heartbeated so the queue can
+hand the jobs of a worker that died to another one, and a job the API cancels
+(deadline, client gone) has its slicer process killed.
+
+Usage:
+    python -m app.worker [--queue sqlite:] [--concurrency 2] [--id NAME]
+"""
+import os
+import time
+import shutil
+import socket
+import signal
+import logging
+import argparse
+import threading
+import contextvars
+from app.constants import WORKER_SCRATCH_DIR, settings
+from app.services.tracing import configure_logging, request_id_var
+from app.services.worker_queue import WorkerQueue, create_worker_queue
+from app.services.slice_scheduler import SliceJob
+from app.services.prusa_slicer import PrusaSlicer
+
+# Named explicitly, run with -m this module is __main__ and outside the 'app' logger
+logger = logging.getLogger('app.worker')
+
+
+def process_job(queue: WorkerQueue, worker_id: str, job_id: str, payload: dict) -> dict:
+    """
+    Slice one claimed job, heartbeating it and killing the slicer if the API cancels it
+
+    Returns:
+        dict: Result handed back to the API
+    """
+    scratch = WORKER_SCRATCH_DIR / job_id
+    scratch.mkdir(parents=True, exist_ok=True)
+    try:
+        stl_path = scratch / payload['stl_name']
+        stl_path.write_bytes(queue.get_blob(f"{job_id}/model.stl"))
+        config_path = None
+        if payload.get('config'):
+            config_path = scratch / 'config.ini'
+            config_path.write_bytes(queue.get_blob(f"{job_id}/config.ini"))
+        output_path = scratch / 'output.gcode'
+
+        job = SliceJob(
+            user_id=payload.get('user_id'),
+            job_id=job_id,
+            memory_limit_mb=payload.get('memory_limit_mb'),
+            threads=payload.get('threads'),
+        )
+        slicer = PrusaSlicer(config_path=config_path)
+        outcome = {}
+
+        def slice_model():
+            try:
+                outcome['ok'] = slicer.slice(
+                    stl_path,
+                    output_path,
+                    job=job,
+                    local=True,
+                    env={**os.environ, **payload.get('env', {})},
+                    **payload.get('params', {}),
+                )
+            except Exception as e:
+                logger.exception(f"Slicing job {job_id} failed")
+                outcome['ok'], outcome['error'] = False, str(e)
+
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(slice_model,), name=f"slice-{job_id}", daemon=True)
+        thread.start()
+        while thread.is_alive():
+            thread.join(queue.heartbeat_seconds)
+            if thread.is_alive():
+                queue.heartbeat(job_id)
+                if job.cancel_reason is None and queue.cancelled(job_id):
+                    logger.info(f"Job {job_id} was cancelled, killing the slicer")
+                    job.kill('cancelled')
+
+        ok = outcome.get('ok', False) and job.cancel_reason is None
+        if ok:
+            queue.put_blob(f"{job_id}/output.gcode", output_path.read_bytes())
+        return {
+            'ok': ok,
+            'worker': worker_id,
+            'error': outcome.get('error') or job.cancel_reason,
+            'returncode': job.returncode,
+            'user_cpu_seconds': job.user_cpu_seconds,
+            'system_cpu_seconds': job.system_cpu_seconds,
+            'wall_seconds': job.wall_seconds,
+            'peak_rss_kb': job.peak_rss_kb,
+            'output_bytes': job.output_bytes,
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run_slot(queue: WorkerQueue, worker_id: str, stop: threading.Event):
+    """Claim and slice jobs until `stop` is set"""
+    while not stop.is_set():
+        try:
+            queue.requeue_stale()
+            claimed = queue.claim(worker_id, timeout=1.0)
+            if claimed is None:
+                continue
+            job_id, payload = claimed
+            # Log lines carry the request ID of the API request that submitted the job
+            request_token = request_id_var.set(payload.get('env', {}).get('REQUEST_ID'))
+            try:
+                started = time.monotonic()
+                result = process_job(queue, worker_id, job_id, payload)
+                queue.finish(job_id, result)
+                logger.info(f"Job {job_id} of user {payload.get('user_id')} {'sliced' if result['ok'] else 'failed'} in {time.monotonic() - started:.1f}s")
+            finally:
+                request_id_var.reset(request_token)
+        except Exception:
+            # A broken queue connection shouldn't take the slot down for good
+            logger.exception("Worker slot error")
+            stop.wait(queue.heartbeat_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queue', default=settings.WORKER_QUEUE_URL or 'sqlite:', help="Worker queue URL")
+    parser.add_argument('--concurrency', type=int, default=settings.WORKER_CONCURRENCY, help="Slicer processes run at once")
+    parser.add_argument('--id', default=f"{socket.gethostname()}-{os.getpid()}", help="Worker name shown in job results")
+    args = parser.parse_args()
+
+    configure_logging()
+    queue = create_worker_queue(args.queue)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        # Finish the jobs in hand, claim nothing new
+        signal.signal(signum, lambda *_: stop.set())
+
+    slots = [
+        threading.Thread(target=run_slot, args=(queue, f"{args.id}/{slot}", stop), name=f"slot-{slot}")
+        for slot in range(args.concurrency)
+    ]
+    for slot in slots:
+        slot.start()
+    logger.info(f"Worker {args.id} slicing {args.concurrency} jobs at a time from {args.queue}")
+    while any(slot.is_alive() for slot in slots):
+        for slot in slots:
+            slot.join(timeout=1.0)
+    logger.info(f"Worker {args.id} stopped")
+
+
+if __name__ == '__main__':
+    main()
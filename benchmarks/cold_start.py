@@ -0,0 +1,84 @@
+"""
+Measure the cold start of the API the way a scale-to-zero machine sees it.
+
+Every run starts a fresh interpreter: once to time `import app.main` alone,
+once as a uvicorn server polled until its first response. Reports the
+median, min and max over the runs and fails when the median time to first
+response exceeds the budget.
+
+Usage:
+    python -m benchmarks.cold_start [--runs 5] [--path /] [--budget 1.0]
+"""
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import http.client
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def import_time() -> float:
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def time_to_first_response(path: str, timeout: float = 60.0) -> float:
+    """Seconds from spawning uvicorn until `path` answers"""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port), '--log-level', 'warning'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                connection.request('GET', path)
+                connection.getresponse().read()
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError(f"No response from {path} within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summary(name: str, values: list[float]) -> str:
+    return f"  {name:<24} median {statistics.median(values):6.3f}s  min {min(values):6.3f}s  max {max(values):6.3f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--budget', type=float, default=1.0, help="Seconds allowed for the median time to first response")
+    args = parser.parse_args()
+
+    imports = [import_time() for _ in range(args.runs)]
+    first_responses = [time_to_first_response(args.path) for _ in range(args.runs)]
+
+    print(f"Cold start over {args.runs} runs:")
+    print(summary('import app.main', imports))
+    print(summary(f'first response {args.path}', first_responses))
+
+    median = statistics.median(first_responses)
+    if median > args.budget:
+        print(f"\nOver budget: {median:.3f}s > {args.budget:.3f}s")
+        sys.exit(1)
+    print(f"\nWithin budget: {median:.3f}s <= {args.budget:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
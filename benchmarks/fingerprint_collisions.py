@@ -0,0 +1,172 @@
+"""
+Measure the collision behaviour of the geometry fingerprint used by the
+instant quote cache.
+
+A corpus of distinct parts (boxes, extruded star profiles, spheres and tori)
+is generated, then every part is re-exported the ways customers do it:
+rotated, moved, with its faces shuffled, its triangle winding rotated and
+re-triangulated. Reports how often a variant maps back to its original
+(cache hit rate) and how many distinct parts share a fingerprint (false hits).
+
+Usage:
+    python -m benchmarks.fingerprint_collisions [--parts 500] [--seed 0]
+"""
+import time
+import argparse
+import numpy as np
+from collections import defaultdict
+from app.utils.mesh_analysis import geometry_fingerprint
+
+
+def box(x, y, z):
+    v = np.array([[0, 0, 0], [x, 0, 0], [x, y, 0], [0, y, 0], [0, 0, z], [x, 0, z], [x, y, z], [0, y, z]], float)
+    faces = [[0, 2, 1], [0, 3, 2], [4, 5, 6], [4, 6, 7], [0, 1, 5], [0, 5, 4],
+             [1, 2, 6], [1, 6, 5], [2, 3, 7], [2, 7, 6], [3, 0, 4], [3, 4, 7]]
+    return v[np.array(faces)]
+
+
+def extrude(radii, height):
+    """Prism of a star shaped profile, radii are sampled at equal angles"""
+    angles = np.linspace(0, 2 * np.pi, len(radii), endpoint=False)
+    ring = np.stack([radii * np.cos(angles), radii * np.sin(angles)], axis=1)
+    nxt = np.roll(ring, -1, axis=0)
+    zero = np.zeros((len(ring), 2))
+
+    def lift(points, z):
+        return np.concatenate([points, np.full((len(points), 1), z)], axis=1)
+
+    bottom = np.stack([lift(zero, 0), lift(nxt, 0), lift(ring, 0)], axis=1)
+    top = np.stack([lift(zero, height), lift(ring, height), lift(nxt, height)], axis=1)
+    side_a = np.stack([lift(ring, 0), lift(nxt, 0), lift(nxt, height)], axis=1)
+    side_b = np.stack([lift(ring, 0), lift(nxt, height), lift(ring, height)], axis=1)
+    return np.concatenate([bottom, top, side_a, side_b])
+
+
+def uv_surface(point, n_u, n_v):
+    """Closed surface from a (u, v) parametrization sampled on a grid"""
+    u = np.linspace(0, 1, n_u + 1)
+    v = np.linspace(0, 1, n_v + 1)
+    grid = point(*np.meshgrid(u, v, indexing='ij'))
+    p00, p10 = grid[:-1, :-1], grid[1:, :-1]
+    p01, p11 = grid[:-1, 1:], grid[1:, 1:]
+    triangles = np.concatenate([
+        np.stack([p00, p10, p11], axis=-2).reshape(-1, 3, 3),
+        np.stack([p00, p11, p01], axis=-2).reshape(-1, 3, 3),
+    ])
+    # Drop the degenerate triangles at the poles
+    area = np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]), axis=1)
+    return triangles[area > 1e-12]
+
+
+def sphere(radius, n):
+    def point(u, v):
+        theta, phi = np.pi * u, 2 * np.pi * v
+        return radius * np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=-1)
+    return uv_surface(point, n, 2 * n)
+
+
+def torus(major, minor, n):
+    def point(u, v):
+        a, b = 2 * np.pi * u, 2 * np.pi * v
+        r = major + minor * np.cos(b)
+        return np.stack([r * np.cos(a), r * np.sin(a), minor * np.sin(b)], axis=-1)
+    return uv_surface(point, 2 * n, n)
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+
+def subdivide(triangles):
+    """Split every triangle into four, the surface itself is unchanged"""
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab, bc, ca = (a + b) / 2, (b + c) / 2, (c + a) / 2
+    return np.concatenate([
+        np.stack([a, ab, ca], axis=1), np.stack([ab, b, bc], axis=1),
+        np.stack([ca, bc, c], axis=1), np.stack([ab, bc, ca], axis=1),
+    ])
+
+
+def variants(triangles, rng):
+    rotation = random_rotation(rng)
+    moved = triangles @ rotation.T + rng.uniform(-200, 200, size=3)
+    return {
+        'rotated+moved': moved,
+        'shuffled': triangles[rng.permutation(len(triangles))],
+        'winding rotated': np.roll(triangles, 1, axis=1),
+        're-triangulated': subdivide(triangles),
+        'all combined': np.roll(subdivide(moved), 2, axis=1)[rng.permutation(4 * len(triangles))],
+        'yaw 90 degrees': triangles @ np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1.0]]).T,
+    }
+
+
+def corpus(n_parts, rng):
+    parts = []
+    for i in range(n_parts):
+        kind = i % 4
+        if kind == 0:
+            parts.append(('box', box(*np.round(rng.uniform(5, 150, size=3), 1))))
+        elif kind == 1:
+            radii = np.round(rng.uniform(5, 40, size=int(rng.integers(5, 24))), 1)
+            parts.append(('extrusion', extrude(radii, round(float(rng.uniform(2, 80)), 1))))
+        elif kind == 2:
+            parts.append(('sphere', sphere(round(float(rng.uniform(5, 60)), 1), int(rng.integers(8, 40)))))
+        else:
+            major = float(rng.uniform(15, 60))
+            parts.append(('torus', torus(round(major, 1), round(float(rng.uniform(2, major / 2)), 1), int(rng.integers(8, 32)))))
+    return parts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--parts', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    parts = corpus(args.parts, rng)
+
+    owners = defaultdict(set)
+    hits = defaultdict(int)
+    originals = []
+    for index, (kind, triangles) in enumerate(parts):
+        fingerprint = geometry_fingerprint(triangles)['fingerprint']
+        owners[fingerprint].add(index)
+        originals.append(fingerprint)
+
+        for name, variant in variants(triangles, rng).items():
+            hits[name] += geometry_fingerprint(variant)['fingerprint'] == fingerprint
+
+    print(f"Corpus: {len(parts)} parts")
+    print("\nVariant cache hit rate (same part, should be 100%):")
+    for name, count in hits.items():
+        print(f"  {name:<18} {count / len(parts):7.2%}")
+
+    # Distinct parts that share a fingerprint would return someone else's quote
+    colliding = [indexes for indexes in owners.values() if len(indexes) > 1]
+    print(f"\nDistinct fingerprints: {len(owners)} for {len(parts)} parts")
+    print(f"Colliding groups: {len(colliding)}")
+    for indexes in colliding[:10]:
+        print("  " + ", ".join(f"#{i} {parts[i][0]}" for i in sorted(indexes)))
+
+    # How small a real change still produces a different fingerprint
+    print("\nNear duplicates (different parts, should miss):")
+    for change in (1.01, 1.002, 1.0005):
+        different = 0
+        for index, (kind, triangles) in enumerate(parts):
+            stretched = triangles * np.array([change, 1.0, 1.0])
+            different += geometry_fingerprint(stretched)['fingerprint'] != originals[index]
+        print(f"  stretched by {change - 1:.2%} along X: {different / len(parts):7.2%} detected")
+
+    triangles = sphere(50, 400)
+    start = time.perf_counter()
+    geometry_fingerprint(triangles)
+    print(f"\nFingerprint of a {len(triangles)} face mesh: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Latency of small instant quotes behind full slices, FIFO versus shortest job first.
+
+Replays the same Poisson arrival stream of mixed jobs through the slice
+scheduler twice: once ranked by arrival only (FIFO) and once with the
+default shortest-job-first ranking. Slicer processes are simulated by sleeping
+for the job's true duration, which follows the same features the duration
+predictor sees (triangles, bounding volume, layers, supports) with its own
+weights and noise, so the predictor has to learn it from observed times.
+Durations are scaled down by --time-scale to keep the run short, a warm-up
+stream trains the predictor before anything is measured.
+
+Reports p50/p95 latency (queue wait plus slicing) of the small interactive
+quotes and of the large background slices, and the longest wait of any
+background job to show aging keeps them from starving.
+
+Usage:
+    python -m benchmarks.sjf_latency [--jobs 200] [--load 0.85] [--small 0.75] [--time-scale 0.003]
+"""
+import math
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from app.services.slice_scheduler import SliceScheduler, DurationPredictor
+
+CONCURRENCY = 2
+
+# Weights of the simulated slicer, deliberately different from the predictor's prior
+TRUE_WEIGHTS = (-1.0, 0.7, 0.15, 0.35, 0.5)
+
+
+def make_job(rng: random.Random, small: float) -> dict:
+    if rng.random() < small:
+        triangles = rng.randint(2_000, 30_000)
+        dimensions = tuple(rng.uniform(15, 50) for _ in range(3))
+        interactive = True
+    else:
+        triangles = rng.randint(200_000, 1_000_000)
+        dimensions = tuple(rng.uniform(100, 220) for _ in range(3))
+        interactive = False
+    layer_height = rng.choice((0.1, 0.15, 0.2, 0.3))
+    support_material = rng.random() < 0.3
+    features = DurationPredictor.features(triangles, dimensions, layer_height, support_material)
+    seconds = math.exp(sum(w * x for w, x in zip(TRUE_WEIGHTS, features)) + rng.gauss(0, 0.2))
+    return {
+        'user_id': f"user-{rng.randint(1, 20)}",
+        'triangles': triangles,
+        'dimensions': dimensions,
+        'layer_height': layer_height,
+        'support_material': support_material,
+        'interactive': interactive,
+        'seconds': seconds,
+    }
+
+
+def fake_slice(seconds: float, job=None) -> bool:
+    """Stands in for PrusaSlicer.slice, reporting its wall time like shell() does"""
+    job.spawned_at = time.monotonic()
+    time.sleep(seconds)
+    job.returncode = 0
+    job.wall_seconds = time.monotonic() - job.spawned_at
+    return True
+
+
+async def replay(scheduler: SliceScheduler, jobs: list[dict], gaps: list[float], scale: float) -> list[tuple[dict, float]]:
+    """Submit `jobs` with the given inter-arrival gaps, return (job, latency) pairs"""
+    results = []
+
+    async def submit(job: dict):
+        start = time.monotonic()
+        await scheduler.run(
+            job['user_id'],
+            fake_slice,
+            job['seconds'] * scale,
+            triangles=job['triangles'],
+            dimensions=job['dimensions'],
+            layer_height=job['layer_height'],
+            support_material=job['support_material'],
+            interactive=job['interactive'],
+        )
+        results.append((job, time.monotonic() - start))
+
+    tasks = []
+    for job, gap in zip(jobs, gaps):
+        await asyncio.sleep(gap * scale)
+        tasks.append(asyncio.ensure_future(submit(job)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def measure(policy: str, args, warmup: tuple, stream: tuple) -> dict:
+    scale = args.time_scale
+    if policy == 'fifo':
+        ranking = {'background_weight': 1.0, 'fair_share_seconds': 0.0, 'aging': 1e9}
+    else:
+        ranking = {'fair_share_seconds': 30.0 * scale}
+    scheduler = SliceScheduler(
+        max_concurrency=CONCURRENCY,
+        max_queue=10_000,
+        max_queue_per_user=10_000,
+        poll_interval=0.01,
+        **ranking,
+    )
+    await replay(scheduler, *warmup, scale)
+    results = await replay(scheduler, *stream, scale)
+
+    small = [latency / scale for job, latency in results if job['interactive']]
+    large = [latency / scale for job, latency in results if not job['interactive']]
+    return {
+        'small_p50': statistics.median(small),
+        'small_p95': percentile(small, 0.95),
+        'large_p50': statistics.median(large),
+        'large_p95': percentile(large, 0.95),
+        'large_max': max(large),
+        'error_factor': scheduler.duration_predictor.stats()['mean_error_factor'],
+    }
+
+
+def stream(rng: random.Random, count: int, small: float, load: float) -> tuple[list[dict], list[float]]:
+    jobs = [make_job(rng, small) for _ in range(count)]
+    mean_seconds = sum(job['seconds'] for job in jobs) / count
+    rate = load * CONCURRENCY / mean_seconds
+    return jobs, [rng.expovariate(rate) for _ in jobs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=200, help="Measured jobs per policy")
+    parser.add_argument('--warmup', type=int, default=40, help="Jobs run before measuring, trains the predictor")
+    parser.add_argument('--load', type=float, default=0.85, help="Offered load as a fraction of slicer capacity")
+    parser.add_argument('--small', type=float, default=0.75, help="Fraction of jobs that are small instant quotes")
+    parser.add_argument('--time-scale', type=float, default=0.003, help="Real seconds per simulated second")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    warmup = stream(rng, args.warmup, args.small, args.load)
+    measured = stream(rng, args.jobs, args.small, args.load)
+
+    print(f"{args.jobs} jobs, {args.small:.0%} small, load {args.load:.0%} of {CONCURRENCY} slicers (simulated seconds)")
+    print(f"  {'policy':<6} {'small p50':>10} {'small p95':>10} {'large p50':>10} {'large p95':>10} {'large max':>10} {'pred. error':>12}")
+    for policy in ('fifo', 'sjf'):
+        result = asyncio.run(measure(policy, args, warmup, measured))
+        print(
+            f"  {policy:<6} {result['small_p50']:>9.1f}s {result['small_p95']:>9.1f}s {result['large_p50']:>9.1f}s "
+            f"{result['large_p95']:>9.1f}s {result['large_max']:>9.1f}s {result['error_factor']:>11}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Throughput and latency of the slicer under different per-job thread budgets.
+
+Generates a small and a large part (or slices the STL files given with
+--stl), then pushes the same burst of jobs through the slice scheduler and
+PrusaSlicer once per budget: a fixed --threads count for every job, and the
+scheduler's adaptive budget, which splits the CPU threads over the free slots
+and caps short jobs by their predicted time. More threads per job shorten a
+single slice but contend with the other slots once every slot is busy, so
+the best fixed count depends on the load; the adaptive budget follows it.
+
+Every budget first slices each part once untimed, which also trains the
+duration predictor the adaptive budget uses. Reports the time to drain the
+burst (throughput), p50/p95 latency of small and large jobs and the total
+slicer CPU seconds. Needs `prusa-slicer` on PATH.
+
+Usage:
+    python -m benchmarks.thread_budget [--jobs 12] [--concurrency 2] [--budgets 1,2,4,adaptive] [--stl part.stl ...]
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+import numpy as np
+from stl import mesh
+from app.services.prusa_slicer import PrusaSlicer
+from app.services.slice_scheduler import SliceScheduler
+from app.utils.mesh_analysis import stl_statistics
+from benchmarks.fingerprint_collisions import sphere, torus
+
+LAYER_HEIGHT = 0.2
+
+
+def write_stl(path: Path, triangles) -> Path:
+    part = mesh.Mesh(np.zeros(len(triangles), dtype=mesh.Mesh.dtype))
+    part.vectors[:] = triangles
+    part.save(str(path))
+    return path
+
+
+def generated_parts(directory: Path) -> list[Path]:
+    """A small part like an instant quote and a large, finely tessellated one"""
+    small = sphere(12, 24)
+    large = torus(70, 25, 300)
+    large[:, :, 2] += 25
+    small[:, :, 2] += 12
+    return [write_stl(directory / 'small.stl', small), write_stl(directory / 'large.stl', large)]
+
+
+def fixed_threads(threads: int):
+    """Slice function that overrides the scheduler's budget with a fixed count"""
+    def run(slicer: PrusaSlicer, stl: Path, output: Path, job=None) -> bool:
+        job.threads = threads
+        return slicer.slice(stl, output, job=job, local=True)
+    return run
+
+
+def adaptive(slicer: PrusaSlicer, stl: Path, output: Path, job=None) -> bool:
+    return slicer.slice(stl, output, job=job, local=True)
+
+
+async def measure(budget: str, parts: list[dict], args, scratch: Path) -> dict:
+    scheduler = SliceScheduler(
+        max_concurrency=args.concurrency,
+        max_queue=10_000,
+        max_queue_per_user=10_000,
+        poll_interval=0.05,
+        cpu_threads=os.cpu_count() if budget == 'adaptive' else 0,
+    )
+    func = adaptive if budget == 'adaptive' else fixed_threads(int(budget))
+    slicer = PrusaSlicer()
+
+    async def submit(index: int, part: dict) -> tuple[dict, float]:
+        start = time.monotonic()
+        ok = await scheduler.run(
+            f"user-{index % 4}",
+            func,
+            slicer,
+            part['path'],
+            scratch / f"{budget}-{index}.gcode",
+            triangles=part['triangles'],
+            dimensions=part['dimensions'],
+            layer_height=LAYER_HEIGHT,
+            support_material=False,
+            interactive=part['small'],
+        )
+        if not ok:
+            raise RuntimeError(f"Slicing {part['path']} failed")
+        return part, time.monotonic() - start
+
+    for part in parts:
+        await submit(-1, part)
+    usage = scheduler.accounting.summary()['cpu_seconds']
+
+    start = time.monotonic()
+    results = await asyncio.gather(*(submit(index, parts[index % len(parts)]) for index in range(args.jobs)))
+    makespan = time.monotonic() - start
+
+    small = [latency for part, latency in results if part['small']] or [0.0]
+    large = [latency for part, latency in results if not part['small']] or [0.0]
+    return {
+        'makespan': makespan,
+        'jobs_per_minute': args.jobs / makespan * 60,
+        'small_p50': statistics.median(small),
+        'small_p95': percentile(small, 0.95),
+        'large_p50': statistics.median(large),
+        'large_p95': percentile(large, 0.95),
+        'cpu_seconds': scheduler.accounting.summary()['cpu_seconds'] - usage,
+    }
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=12, help="Jobs in the measured burst")
+    parser.add_argument('--concurrency', type=int, default=2, help="Slicer processes run at once")
+    parser.add_argument('--budgets', default='1,2,4,adaptive', help="Comma separated fixed thread counts and/or 'adaptive'")
+    parser.add_argument('--stl', action='append', type=Path, help="Parts to slice instead of the generated ones, the first is the small one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        scratch = Path(directory)
+        paths = args.stl or generated_parts(scratch)
+        parts = []
+        for index, path in enumerate(paths):
+            parts.append({'path': path, 'small': index == 0, **stl_statistics(path)})
+
+        print(f"{args.jobs} jobs over {len(parts)} parts, {args.concurrency} slicer slots, {os.cpu_count()} CPU threads")
+        print(
+            f"  {'budget':<9} {'drain':>8} {'jobs/min':>9} {'small p50':>10} {'small p95':>10} "
+            f"{'large p50':>10} {'large p95':>10} {'cpu':>8}"
+        )
+        for budget in args.budgets.split(','):
+            result = asyncio.run(measure(budget.strip(), parts, args, scratch))
+            print(
+                f"  {budget:<9} {result['makespan']:>7.1f}s {result['jobs_per_minute']:>9.1f} "
+                f"{result['small_p50']:>9.1f}s {result['small_p95']:>9.1f}s "
+                f"{result['large_p50']:>9.1f}s {result['large_p95']:>9.1f}s {result['cpu_seconds']:>7.1f}s"
+            )
+
+
+if __name__ == '__main__':
+    main()
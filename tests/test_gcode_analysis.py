@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from app.utils.gcode_analysis import GcodeAnalyzer, KinematicSegmentTimes, _parse_numbers
+
+TOKENS = [
+    b'1', b'-1', b'+2.5', b'.8', b'-.8', b'3.', b'0.15458', b'-0.00001', b'00012', b'162.430',
+    b'12345678', b'1234567.8', b'123456789', b'9999.99999', b'12345.678901',
+    b'', b'-', b'.', b'1.2.3', b'1a', b'--1', b'1-2', b'1e5', b'7*12', b'5;c', b'1.5\r',
+]
+
+GCODE = b"""M83
+;LAYER_CHANGE
+;TYPE:Perimeter
+G1 Z0.2 F600
+G1 X10 Y0 E0.5 F1800
+G2 X20 Y10 I0 J10 E0.8 ; arc
+G1 X20 Y20 E0.4
+G1 E-0.8 F2400
+G0 X0 Y0 F6000
+;LAYER_CHANGE
+;TYPE:External perimeter
+G1 Z0.4
+G1 E0.8
+G3 X10 Y10 I5 J5 E0.6
+G1\tX10\tY0 E0.3 ; X99 Y99 ignored
+"""
+
+
+def parse(tokens: list[bytes]) -> np.ndarray:
+    data = b' '.join(b'X' + token for token in tokens) + b'\n'
+    padded = np.concatenate([np.frombuffer(data, dtype=np.uint8), np.zeros(64, dtype=np.uint8)])
+    return _parse_numbers(padded, np.flatnonzero(padded == ord('X')) + 1)
+
+
+def expected(token: bytes) -> float:
+    token = token.split(b'*')[0].split(b';')[0].strip()
+    try:
+        return float(token) if b'e' not in token else np.nan
+    except ValueError:
+        return np.nan
+
+
+def test_parse_numbers():
+    np.testing.assert_array_equal(parse(TOKENS), [expected(token) for token in TOKENS])
+
+
+def test_parse_numbers_random_tokens():
+    rng = np.random.default_rng(0)
+    alphabet = np.frombuffer(b'0123456789.-+a', dtype=np.uint8)
+    tokens = [bytes(rng.choice(alphabet, rng.integers(0, 11))) for _ in range(5000)]
+    np.testing.assert_array_equal(parse(tokens), [expected(token) for token in tokens])
+
+
+@pytest.mark.parametrize('chunk_size', [16, 100, 1 << 20])
+def test_chunk_size_does_not_change_the_result(tmp_path, chunk_size):
+    gcode_file_path = tmp_path / "part.gcode"
+    gcode_file_path.write_bytes(GCODE)
+
+    whole = GcodeAnalyzer(segment_times=KinematicSegmentTimes()).analyze_file(gcode_file_path)
+    chunked = GcodeAnalyzer(segment_times=KinematicSegmentTimes(), chunk_size=chunk_size).analyze_file(gcode_file_path)
+    assert chunked == whole
+
+
+def test_arcs_count_as_chords(tmp_path):
+    gcode_file_path = tmp_path / "part.gcode"
+    gcode_file_path.write_bytes(GCODE)
+
+    result = GcodeAnalyzer().analyze_file(gcode_file_path)
+    assert result['arc_moves'] == 2
+    assert result['layer_count'] == 2
+    assert result['total_filament_mm'] == pytest.approx(2.6)
+    # Chords of the arcs, Z moves are travel and words in comments are ignored
+    perimeter = 10 + np.hypot(10, 10) + 10
+    assert result['features']['Perimeter']['distance_mm'] == pytest.approx(perimeter, abs=0.01)
+    external = np.hypot(10, 10) + 10
+    assert result['features']['External perimeter']['distance_mm'] == pytest.approx(external, abs=0.01)
@@ -0,0 +1,66 @@
+import asyncio
+
+from app.services.idempotency import IdempotencyMiddleware, IdempotencyStore
+
+BODY = b'{"model": "cube.stl", "infill": 20}'
+
+
+async def echo_app(scope, receive, send):
+    """Stub endpoint answering 422 unless it gets the whole body"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            break
+    status = 200 if body == BODY else 422
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def scope():
+    return {
+        'type': 'http',
+        'method': 'POST',
+        'path': '/v1/stl/slice/',
+        'query_string': b'user_id=u1',
+        'headers': [(b'idempotency-key', b'retry-1'), (b'content-type', b'application/json')],
+    }
+
+
+async def call(middleware, messages):
+    messages = list(messages)
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope(), receive, send)
+    return sent
+
+
+def test_truncated_upload_is_not_stored(tmp_path):
+    async def scenario():
+        store = IdempotencyStore(tmp_path / 'idempotency.sqlite3')
+        middleware = IdempotencyMiddleware(echo_app, store, paths=['/v1/stl/slice/'])
+
+        truncated = await call(middleware, [
+            {'type': 'http.request', 'body': BODY[:4], 'more_body': True},
+            {'type': 'http.disconnect'},
+        ])
+        assert truncated == []
+        assert store.counts['stored'] == 0
+        assert not store.in_flight
+
+        retried = await call(middleware, [{'type': 'http.request', 'body': BODY, 'more_body': False}])
+        assert retried[0]['status'] == 200
+        assert retried[1]['body'] == BODY
+        assert store.counts['stored'] == 1
+        assert store.counts['mismatched'] == 0
+
+    asyncio.run(scenario())
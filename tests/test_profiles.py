@@ -0,0 +1,72 @@
+import pytest
+from fastapi import HTTPException
+
+import app.services.base_routes_helpers as base_routes_helpers
+import app.services.pro_routes_helpers as pro_routes_helpers
+from app.schemas.responses import PrinterConfig, QuoteConfig
+
+PRINTER_CONFIG = PrinterConfig(
+    bed_size_x=300,
+    bed_size_y=250,
+    bed_size_z=320,
+    print_speed=150,
+    first_layer_speed=25,
+    acceleration=4000,
+    jerk=12.5,
+    nozzle_diameter=0.6,
+    layer_height=0.28,
+    perimeters=4,
+    fill_density=35,
+    support_material=True,
+    auto_support=True,
+    support_material_threshold=50,
+    slice_timeout=90,
+    filament_type="PETG",
+    temperature=240,
+    bed_temperature=80,
+)
+QUOTE_CONFIG = QuoteConfig(currency="EUR", cost_per_hour=4.0, cost_per_gram=0.05, base_price=2.0)
+
+
+@pytest.fixture
+def bucket(tmp_path, monkeypatch):
+    """Save a profile the way /quote-profile/ does, into an in-memory bucket"""
+    monkeypatch.setattr(base_routes_helpers, 'LOCAL_DIR', tmp_path)
+    monkeypatch.setattr(pro_routes_helpers, 'LOCAL_DIR', tmp_path)
+
+    profile_path = "u1/profiles/petg"
+    responses = (
+        pro_routes_helpers.create_ini_config(user_id="u1", stl_file_path=profile_path, printer_config=PRINTER_CONFIG),
+        base_routes_helpers.create_quote_config(user_id="u1", quote_config_file=profile_path, quote_config=QUOTE_CONFIG),
+        base_routes_helpers.create_printer_config(user_id="u1", printer_config_file=profile_path, printer_config=PRINTER_CONFIG),
+    )
+    files = {f"{profile_path}/{response['output_dir'].name}": response['output_dir'].read_bytes() for response in responses}
+
+    def download_file(bucket_name, file_path):
+        if file_path not in files:
+            raise HTTPException(status_code=404, detail="Failed to download file. File does not exist")
+        return {'message': "downloaded", 'status': 200, 'data': files[file_path]}
+
+    monkeypatch.setattr(base_routes_helpers, 'download_file', download_file)
+    return files
+
+
+def test_profile_round_trip(bucket):
+    assert base_routes_helpers.get_printer_config(user_id="u1", profile_name="petg") == PRINTER_CONFIG
+    assert base_routes_helpers.get_quote_config(user_id="u1", profile_name="petg") == QUOTE_CONFIG
+
+
+def test_profile_without_json_reads_the_ini(bucket):
+    del bucket[f"u1/profiles/petg/petg{base_routes_helpers.PRINTER_CONFIG_SUFFIX}"]
+
+    printer_config = base_routes_helpers.get_printer_config(user_id="u1", profile_name="petg")
+
+    unstored = {'acceleration', 'jerk', 'auto_support', 'slice_timeout'}
+    assert printer_config.model_dump(exclude=unstored) == PRINTER_CONFIG.model_dump(exclude=unstored)
+    assert printer_config.model_dump(include=unstored) == PrinterConfig().model_dump(include=unstored)
+
+
+def test_missing_profile_is_not_found(bucket):
+    with pytest.raises(HTTPException) as error:
+        base_routes_helpers.get_printer_config(user_id="u1", profile_name="abs")
+    assert error.value.status_code == 404
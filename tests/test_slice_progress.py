@@ -0,0 +1,49 @@
+import asyncio
+
+from app.services.slice_progress import ProgressBroker
+
+
+async def collect(broker: ProgressBroker, job_id: str, user_id: str) -> list[tuple]:
+    return [
+        (event['event'], event.get('percent'), event.get('result'))
+        async for event in broker.subscribe(job_id, user_id) if event is not None
+    ]
+
+
+def test_subscriber_between_runs_gets_the_next_run():
+    async def run():
+        broker = ProgressBroker()
+        async with broker.track("job-1", "u1") as complete:
+            broker.publish("job-1", {'event': 'progress', 'percent': 50})
+            complete({'run': 1})
+
+        # Subscribed after the first run finished, before the retry opened the job again
+        subscriber = asyncio.ensure_future(collect(broker, "job-1", "u1"))
+        await asyncio.sleep(0.01)
+        assert not subscriber.done()
+
+        async with broker.track("job-1", "u1") as complete:
+            broker.publish("job-1", {'event': 'progress', 'percent': 20})
+            complete({'run': 2})
+        return await asyncio.wait_for(subscriber, timeout=1)
+
+    assert asyncio.run(run()) == [('progress', 20, None), ('completed', 100, {'run': 2})]
+
+
+def test_running_job_is_replayed():
+    async def run():
+        broker = ProgressBroker()
+        async with broker.track("job-1", "u1") as complete:
+            broker.publish("job-1", {'event': 'progress', 'percent': 50})
+            subscriber = asyncio.ensure_future(collect(broker, "job-1", "u1"))
+            await asyncio.sleep(0.01)
+            complete({'run': 1})
+        return await asyncio.wait_for(subscriber, timeout=1)
+
+    assert asyncio.run(run()) == [('progress', 50, None), ('completed', 100, {'run': 1})]
+
+
+def test_other_users_cannot_subscribe():
+    broker = ProgressBroker()
+    assert broker.authorize("job-1", "u1")
+    assert not broker.authorize("job-1", "u2")